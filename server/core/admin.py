@@ -7,22 +7,23 @@ Classes:
     ReferralAdmin: Admin interface options for Referral model.
     VerificationAdmin: Admin interface options for Verification model.
     AccessCodeAdmin: Admin interface options for AccessCode model.
+    WinnerSelectionAdmin: Admin interface options for WinnerSelection model.
 
 Functions:
     send_mail: Sends mail to selected users.
 """
 
 from django.contrib import admin
-from django.utils.crypto import get_random_string
+from django.db import transaction
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin
 from django.contrib.auth.models import User as DjangoUser, Group as DjangoGroup
 
 from unfold.admin import ModelAdmin
 
-from .serializers import AccessCodeSerializer
-from .models import User, Waitlist, Referral, Verification, AccessCode
-from .helpers import send_winners_mail
+from .models import User, Waitlist, Referral, Verification, AccessCode, WinnerSelection
+from .tasks import select_winners
+from .outbox import enqueue
 
 
 admin.site.unregister(DjangoUser)
@@ -67,28 +68,26 @@ def send_mail(modeladmin, request, queryset):
     """
     Action to send mail to selected users.
 
+    The winners are selected by a background job, follow its progress under
+    Winner selections.
+
     Args:
         modeladmin (ModelAdmin): Admin model instance.
         request (HttpRequest): Request object.
         queryset (QuerySet): Queryset of selected users.
     """
-    for query in queryset:
-        access_code = get_random_string(length=16)
-        while AccessCode.objects.filter(code=access_code).exists():
-            access_code = get_random_string(length=16)
-
-        access_code = access_code.upper()
-
-        accesscode_serializer = AccessCodeSerializer(
-            data={"code": access_code, "user": query.user.id}
+    waitlist_ids = list(queryset.order_by("position").values_list("id", flat=True))
+    with transaction.atomic():
+        selection = WinnerSelection.objects.create(
+            count=len(waitlist_ids), waitlist_ids=waitlist_ids
         )
-        if accesscode_serializer.is_valid():
-            accesscode_serializer.save()
+        enqueue(select_winners, selection.id)
 
-            send_winners_mail(query.user.name, query.user.email, access_code)
-        else:
-            print(accesscode_serializer.errors)
-            return
+    modeladmin.message_user(
+        request,
+        f"Selecting {len(waitlist_ids)} winners in the background, "
+        "follow the progress under Winner selections.",
+    )
 
 
 @admin.register(Waitlist)
@@ -157,3 +156,63 @@ class AccessCodeAdmin(ModelAdmin):
     list_display = ("code", "user")
     search_fields = ("user__name",)
     list_filter = ("user__name", "created_at")
+
+
+@admin.register(WinnerSelection)
+class WinnerSelectionAdmin(ModelAdmin):
+    """
+    Administration interface options for WinnerSelection model.
+
+    - Adding a selection with a count selects the top users of the waitlist in the background.
+    - Displays the status and progress of each selection.
+    - Filters available for status and creation date.
+    """
+
+    list_display = ("id", "count", "status", "progress", "failed", "created_at")
+    list_filter = ("status", "created_at")
+    fields = ("count", "status", "selected", "failed", "error", "created_at", "finished_at")
+
+    @admin.display(description="Progress")
+    def progress(self, obj):
+        """
+        Display the share of winners that received an access code.
+
+        Args:
+            obj (WinnerSelection): The winner selection job.
+
+        Returns:
+            str: The progress of the job.
+        """
+        if not obj.count:
+            return "-"
+        return f"{obj.selected} / {obj.count} ({obj.selected * 100 // obj.count}%)"
+
+    def get_readonly_fields(self, request, obj=None):
+        """
+        Only the count of a new selection can be edited.
+
+        Args:
+            request (HttpRequest): Request object.
+            obj (WinnerSelection, optional): The winner selection job. Defaults to None.
+
+        Returns:
+            tuple: The read only fields.
+        """
+        if obj is None:
+            return ("status", "selected", "failed", "error", "created_at", "finished_at")
+        return self.fields
+
+    def save_model(self, request, obj, form, change):
+        """
+        Save a new selection and start it in the background.
+
+        Args:
+            request (HttpRequest): Request object.
+            obj (WinnerSelection): The winner selection job.
+            form (ModelForm): The admin form.
+            change (bool): Whether an existing selection is being changed.
+        """
+        super().save_model(request, obj, form, change)
+
+        if not change:
+            enqueue(select_winners, obj.id)
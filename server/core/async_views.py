@@ -0,0 +1,228 @@
+"""
+Async views of the signup flow, for serving through `server.asgi`.
+
+They answer like AuthenticationView, VerificationView and
+ResendVerificationEmailView, but await the async ORM for their lookups, so a
+waiting request does not hold a worker thread. The writes of a request and the
+tasks it queues in the outbox still share one transaction, which the async ORM
+cannot open, so they run together in a single sync_to_async call. The sync views
+stay the default, these replace them on the same routes when the
+ASYNC_SIGNUP_VIEWS setting is on.
+
+Classes:
+    AsyncAuthenticationView: Async view for user registration and verification email sending.
+    AsyncVerificationView: Async view for user verification.
+    AsyncResendVerificationEmailView: Async view for resending the verification email.
+"""
+
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .tasks import create_waitlist, create_referrals, update_waitlist
+from .serializers import UserSerializer
+from .models import Verification, User, Referral
+from .helpers import send_verification_mail
+from .codes import generate_code
+from .outbox import enqueue
+from .cache import invalidate_users, bump_revision, referrals_revision
+
+
+def _read_json(request):
+    """
+    Parse the JSON body of a request.
+
+    Args:
+        request (HttpRequest): The request object.
+
+    Returns:
+        dict: The body, or None when it is not a JSON object.
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAuthenticationView(View):
+    """Async view for user registration and verification email sending."""
+
+    async def post(self, request, code=None):
+        """
+        Handle user registration and send verification email.
+
+        The referral code is checked before the user is created, instead of
+        deleting the user again when it is unknown.
+
+        Args:
+            request (HttpRequest): The request object containing user data.
+            code (str, optional): The referral code. Defaults to None.
+
+        Returns:
+            JsonResponse: The response object with user data or error message.
+        """
+        data = _read_json(request)
+        if data is None:
+            return JsonResponse({"message": "Invalid JSON body"}, status=400)
+
+        user_serializer = UserSerializer(data=data)
+        if not await sync_to_async(user_serializer.is_valid)():
+            return JsonResponse(user_serializer.errors, status=400)
+
+        if code and not await User.objects.filter(referral_code=code).aexists():
+            return JsonResponse({"message": "Invalid referral code"}, status=400)
+
+        user = await sync_to_async(self.register)(user_serializer.validated_data, code)
+
+        return JsonResponse(UserSerializer(user).data, status=201)
+
+    @staticmethod
+    @transaction.atomic
+    def register(data, code):
+        """
+        Create the user and its verification, and queue their tasks in one transaction.
+
+        Args:
+            data (dict): The validated user data.
+            code (str): The referral code, None without a referrer.
+
+        Returns:
+            User: The new user.
+        """
+        user = User.objects.create(**data)
+        invalidate_users([user.email])
+
+        if code:
+            enqueue(create_referrals, code, user.id)
+
+        verification = Verification.objects.create(
+            unique_code=generate_code("verification"), user=user
+        )
+        send_verification_mail(verification.unique_code, user.email)
+
+        return user
+
+
+class AsyncVerificationView(View):
+    """Async view for user verification."""
+
+    async def get(self, request, code):
+        """
+        Verify user using the provided verification code.
+
+        Args:
+            request (HttpRequest): The request object.
+            code (str): The verification code.
+
+        Returns:
+            JsonResponse: The response object with success or error message.
+        """
+        verification = (
+            await Verification.objects.select_related("user")
+            .filter(unique_code=code)
+            .afirst()
+        )
+
+        if verification is None:
+            return JsonResponse({"message": "Invalid verification code"}, status=400)
+
+        user = verification.user
+        if user.is_verified:
+            return JsonResponse({"message": "Verification Successful!!"}, status=200)
+
+        if verification.created_at < timezone.now() - timedelta(minutes=10):
+            return JsonResponse({"message": "Verification code expired"}, status=400)
+
+        referrer_id = (
+            await Referral.objects.filter(referee=user)
+            .values_list("referrer_id", flat=True)
+            .afirst()
+        )
+        await sync_to_async(self.verify)(user, referrer_id)
+
+        return JsonResponse({"message": "User verified successfully"}, status=200)
+
+    @staticmethod
+    @transaction.atomic
+    def verify(user, referrer_id):
+        """
+        Mark the user verified and queue their waitlist tasks in one transaction.
+
+        Args:
+            user (User): The user being verified.
+            referrer_id (int): The ID of the referrer, None without a referrer.
+        """
+        user.is_verified = True
+        user.save(update_fields=["is_verified"])
+        invalidate_users([user.email])
+
+        enqueue(create_waitlist, user.id)
+
+        if referrer_id is not None:
+            bump_revision(referrals_revision(referrer_id))
+            enqueue(update_waitlist, referrer_id, user.name)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncResendVerificationEmailView(View):
+    """Async view for resending the verification email."""
+
+    async def post(self, request):
+        """
+        Handle resending of verification email.
+
+        Args:
+            request (HttpRequest): The request object containing user data.
+
+        Returns:
+            JsonResponse: The response object with success or error message.
+        """
+        data = _read_json(request)
+        if data is None:
+            return JsonResponse({"message": "Invalid JSON body"}, status=400)
+
+        user = await User.objects.filter(email=data.get("email")).afirst()
+
+        if user is None:
+            return JsonResponse({"message": "User not found"}, status=404)
+
+        if user.is_verified:
+            return JsonResponse({"message": "User already verified"}, status=400)
+
+        verification = await Verification.objects.filter(user=user).afirst()
+
+        if verification and verification.created_at > timezone.now() - timedelta(
+            minutes=2
+        ):
+            return JsonResponse(
+                {"message": "Please wait atleast 2 mins before resending"}, status=400
+            )
+
+        await sync_to_async(self.resend)(user)
+
+        return JsonResponse({"message": "Verification email sent"}, status=200)
+
+    @staticmethod
+    @transaction.atomic
+    def resend(user):
+        """
+        Replace the verification of the user and queue its email in one transaction.
+
+        Args:
+            user (User): The unverified user.
+        """
+        Verification.objects.filter(user=user).delete()
+
+        verification = Verification.objects.create(
+            unique_code=generate_code("verification"), user=user
+        )
+        send_verification_mail(verification.unique_code, user.email)
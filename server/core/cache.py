@@ -0,0 +1,185 @@
+"""
+This module caches the user and waitlist lookups polled by the client.
+
+Lookups go through the default Django cache: a hit is served without touching
+the database, a miss loads the row and stores its serialized data, and unknown
+emails or ids are cached as well for a shorter time. Entries are invalidated by
+the code paths that change the underlying rows, after their transaction commits,
+so the cache backend has to be shared by the web and worker processes.
+
+Every user lookup has a version stamp, stored next to it and replaced on
+invalidation. Entries are stored with the version they were loaded under and
+ignored once it changed, so a lookup that loaded the row before an invalidation
+cannot cache the stale data after it. The waitlist lookups share a single stamp:
+a move shifts the positions of a whole range of users, and is invalidated with
+one write however many rows it moved.
+
+Revision stamps are kept in the separate "revisions" cache, where the culling of
+the lookups never evicts them.
+
+Functions:
+- user_cache_key(email): Return the cache key of a user lookup.
+- waitlist_cache_key(user_id): Return the cache key of a waitlist lookup.
+- read_through(key, load, version_key): Return the cached data of a key, loading it on a miss.
+- invalidate_users(emails): Drop the cached lookups of users.
+- invalidate_waitlists(): Drop every cached waitlist lookup.
+- get_revision(name): Return the current revision stamp of a resource.
+- bump_revision(name): Give a resource a new revision stamp.
+- referrals_revision(referrer_id): Return the revision name of the referrals of a user.
+"""
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+
+NOT_FOUND = "not-found"
+WAITLIST_VERSION_KEY = "version:waitlists"
+GLOBAL_WAITLIST_REVISION = "global_waitlist"
+
+
+def user_cache_key(email):
+    """
+    Return the cache key of a user lookup.
+
+    Args:
+        email (str): The email the user is looked up by.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"user:{hashlib.sha256(email.encode()).hexdigest()}"
+
+
+def waitlist_cache_key(user_id):
+    """
+    Return the cache key of a waitlist lookup.
+
+    Args:
+        user_id (int): The ID of the user the waitlist entry is looked up by.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"waitlist:{int(user_id)}"
+
+
+def _version_key(key):
+    return f"version:{key}"
+
+
+def read_through(key, load, version_key=None):
+    """
+    Return the cached data of a key, loading it on a miss.
+
+    The entry and its version stamp are read in one round-trip. An entry stored
+    under another version is a miss.
+
+    Args:
+        key (str): The cache key.
+        load (callable): Returns the data, or None when there is nothing to find.
+        version_key (str, optional): The key of the version stamp, when shared
+            with other entries. Defaults to a stamp of the key's own.
+
+    Returns:
+        The data, or None when there is nothing to find.
+    """
+    version_key = version_key or _version_key(key)
+    cached = cache.get_many([key, version_key])
+
+    version = cached.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key, version, settings.READ_CACHE_TIMEOUT):
+            version = cache.get(version_key, version)
+
+    entry = cached.get(key)
+    if isinstance(entry, tuple) and entry[0] == version:
+        data = entry[1]
+    else:
+        # Read before loading, so an invalidation committed meanwhile changes
+        # the version and the data stored here is never served
+        data = load()
+        if data is None:
+            data = NOT_FOUND
+            timeout = settings.READ_CACHE_NEGATIVE_TIMEOUT
+        else:
+            timeout = settings.READ_CACHE_TIMEOUT
+        cache.set(key, (version, data), timeout)
+
+    return None if data == NOT_FOUND else data
+
+
+def _invalidate(version_keys):
+    """Replace version stamps once the current transaction commits, in one round-trip."""
+    if version_keys:
+        transaction.on_commit(
+            lambda: cache.set_many(
+                {version_key: uuid.uuid4().hex for version_key in version_keys},
+                settings.READ_CACHE_TIMEOUT,
+            )
+        )
+
+
+def invalidate_users(emails):
+    """
+    Drop the cached lookups of users once the current transaction commits.
+
+    Args:
+        emails (iterable): The emails of the users.
+    """
+    _invalidate([_version_key(user_cache_key(email)) for email in emails])
+
+
+def invalidate_waitlists():
+    """Drop every cached waitlist lookup once the current transaction commits."""
+    _invalidate([WAITLIST_VERSION_KEY])
+
+
+def get_revision(name):
+    """
+    Return the current revision stamp of a resource.
+
+    A stamp that was evicted from the cache is replaced by a new one, so clients
+    holding the old stamp fetch the resource again.
+
+    Args:
+        name (str): The revision name of the resource.
+
+    Returns:
+        str: The revision stamp.
+    """
+    revisions = caches["revisions"]
+    key = f"revision:{name}"
+    revision = revisions.get(key)
+
+    if revision is None:
+        revision = uuid.uuid4().hex
+        if not revisions.add(key, revision, settings.REVISION_TIMEOUT):
+            revision = revisions.get(key, revision)
+
+    return revision
+
+
+def bump_revision(name):
+    """
+    Give a resource a new revision stamp once the current transaction commits.
+
+    Stamps are random rather than counted, so two concurrent bumps can never
+    leave the stamp a client already holds.
+
+    Args:
+        name (str): The revision name of the resource.
+    """
+    transaction.on_commit(
+        lambda: caches["revisions"].set(
+            f"revision:{name}", uuid.uuid4().hex, settings.REVISION_TIMEOUT
+        )
+    )
+
+
+def referrals_revision(referrer_id):
+    """Return the revision name of the referrals of a user."""
+    return f"referrals:{int(referrer_id)}"
@@ -0,0 +1,158 @@
+"""
+This module generates unique, non-guessable codes without probing the database.
+
+Every kind of code (referral, verification, access) draws its values from its own
+counter in the Sequence table and maps them through a keyed permutation of the
+code space: a Feistel network over the smallest even number of bits covering the
+space, with cycle walking to stay inside it. A permutation never maps two counter
+values to the same code, and without the key consecutive codes cannot be
+predicted from each other.
+
+The key is derived from CODE_SECRET_KEY, a secret of at least 32 characters the
+server refuses to start without. Changing it changes the mapping and may reissue
+codes that are still stored.
+
+Classes:
+    CodeGenerator: Generates the codes of one kind.
+
+Functions:
+    generate_code(kind): Return a new code of the given kind.
+    generate_codes(kind, count): Return `count` new codes of the given kind.
+"""
+
+import hashlib
+
+from django.conf import settings
+
+from .sequences import SequenceAllocator
+
+FEISTEL_ROUNDS = 8
+
+
+class CodeGenerator:
+    """
+    Generates the codes of one kind.
+
+    Args:
+        kind (str): Kind of code, also used to name its counter and derive its key.
+        length (int): Number of characters in a code.
+        alphabet (str): Characters a code is made of.
+        block_size (int): Number of counter values reserved per round-trip.
+    """
+
+    def __init__(self, kind, length, alphabet, block_size):
+        self.kind = kind
+        self.length = length
+        self.alphabet = alphabet
+        self.space = len(alphabet) ** length
+        self.half_bits = ((self.space - 1).bit_length() + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.key = hashlib.sha256(
+            f"{settings.CODE_SECRET_KEY}:code:{kind}".encode()
+        ).digest()
+        self.allocator = SequenceAllocator(f"code_{kind}", block_size, lambda: 0)
+
+    def _round(self, number, value):
+        digest = hashlib.blake2b(
+            number.to_bytes(1, "big") + value.to_bytes(16, "big"),
+            key=self.key,
+            digest_size=16,
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def permute(self, value):
+        """
+        Map a counter value to a value of the code space.
+
+        Args:
+            value (int): A counter value in [0, space).
+
+        Returns:
+            int: The permuted value in [0, space).
+        """
+        if not 0 <= value < self.space:
+            raise ValueError(f"The {self.kind} code space is exhausted.")
+
+        while True:
+            left, right = value >> self.half_bits, value & self.mask
+            for number in range(FEISTEL_ROUNDS):
+                left, right = right, left ^ self._round(number, right)
+            value = (left << self.half_bits) | right
+
+            if value < self.space:
+                return value
+
+    def encode(self, value):
+        """
+        Spell a value of the code space with the alphabet.
+
+        Args:
+            value (int): A value in [0, space).
+
+        Returns:
+            str: The code.
+        """
+        base = len(self.alphabet)
+        characters = []
+        for _ in range(self.length):
+            value, digit = divmod(value, base)
+            characters.append(self.alphabet[digit])
+        return "".join(reversed(characters))
+
+    def generate(self):
+        """Return a new code."""
+        return self.encode(self.permute(self.allocator.next()))
+
+    def generate_many(self, count):
+        """
+        Return `count` new codes, reserving their counter values in one round-trip.
+
+        Args:
+            count (int): Number of codes.
+
+        Returns:
+            list: The codes.
+        """
+        return [
+            self.encode(self.permute(value))
+            for value in self.allocator.reserve(count)
+        ]
+
+
+_generators = {}
+
+
+def _get_generator(kind):
+    if kind not in _generators:
+        options = settings.CODE_GENERATORS[kind]
+        _generators[kind] = CodeGenerator(
+            kind, options["length"], options["alphabet"], options["block_size"]
+        )
+    return _generators[kind]
+
+
+def generate_code(kind):
+    """
+    Return a new code of the given kind.
+
+    Args:
+        kind (str): A key of the CODE_GENERATORS setting.
+
+    Returns:
+        str: The code.
+    """
+    return _get_generator(kind).generate()
+
+
+def generate_codes(kind, count):
+    """
+    Return `count` new codes of the given kind.
+
+    Args:
+        kind (str): A key of the CODE_GENERATORS setting.
+        count (int): Number of codes.
+
+    Returns:
+        list: The codes.
+    """
+    return _get_generator(kind).generate_many(count)
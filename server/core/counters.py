@@ -0,0 +1,162 @@
+"""
+This module updates counter columns with atomic increments, optionally coalesced.
+
+An increment is written as `UPDATE ... SET column = column + n`, so concurrent
+workers never lose each other's updates and no other column is rewritten. With a
+flush interval, increments of the same row are summed in memory and written at
+most once per interval, which turns a burst of thousands of increments on a
+popular row into a handful of writes.
+
+Buffered increments are flushed by a timer thread, when the worker shuts down,
+and by anything that needs the current value (see `flush`). Increments still
+buffered when a process is killed are lost. Buffered referral counts are written
+after their referees were ranked, so each write queues a rank_referrers task in
+its transaction.
+
+Classes:
+    CounterBuffer: Coalesces increments of one counter column.
+
+Functions:
+    get_referral_counter(): Return the process wide buffer of User.referral_count.
+"""
+
+import threading
+from collections import defaultdict
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import User
+from .cache import invalidate_users
+from .outbox import enqueue
+
+
+class CounterBuffer:
+    """
+    Coalesces increments of one counter column.
+
+    Args:
+        model (Model): The model owning the column.
+        field (str): The name of the counter column.
+        interval (float): Seconds increments are held before being written, 0 writes them immediately.
+        on_write (callable, optional): Called with the primary keys of the rows
+            written. Defaults to None.
+    """
+
+    def __init__(self, model, field, interval, on_write=None):
+        self.model = model
+        self.field = field
+        self.interval = interval
+        self.on_write = on_write
+        self._pending = defaultdict(int)
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _write(self, pks, amount):
+        self.model.objects.filter(pk__in=pks).update(
+            **{self.field: F(self.field) + amount}
+        )
+        if self.on_write is not None:
+            self.on_write(pks)
+
+    def add(self, pk, amount=1):
+        """
+        Increment the counter of a row.
+
+        Args:
+            pk: The primary key of the row.
+            amount (int, optional): The increment. Defaults to 1.
+        """
+        if self.interval <= 0:
+            self._write([pk], amount)
+            return
+
+        with self._lock:
+            self._pending[pk] += amount
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own database connection
+            connection.close()
+
+    def flush(self):
+        """
+        Write the buffered increments, one UPDATE per distinct increment.
+
+        Returns:
+            int: The number of rows updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not pending:
+            return 0
+
+        by_amount = defaultdict(list)
+        for pk, amount in pending.items():
+            by_amount[amount].append(pk)
+
+        try:
+            with transaction.atomic():
+                for amount, pks in by_amount.items():
+                    self._write(pks, amount)
+        except Exception:
+            with self._lock:
+                for pk, amount in pending.items():
+                    self._pending[pk] += amount
+            raise
+
+        return len(pending)
+
+
+def _referral_counts_written(user_ids):
+    invalidate_users(User.objects.filter(id__in=user_ids).values_list("email", flat=True))
+
+    if settings.REFERRAL_COUNT_FLUSH_INTERVAL > 0:
+        # Imported here since the tasks use this module
+        from .tasks import rank_referrers
+
+        enqueue(rank_referrers, list(user_ids))
+
+
+_referral_counter = None
+_referral_counter_lock = threading.Lock()
+
+
+def get_referral_counter():
+    """
+    Return the process wide buffer of User.referral_count.
+
+    Returns:
+        CounterBuffer: The referral count buffer of this process.
+    """
+    global _referral_counter
+
+    with _referral_counter_lock:
+        if _referral_counter is None:
+            _referral_counter = CounterBuffer(
+                User,
+                "referral_count",
+                settings.REFERRAL_COUNT_FLUSH_INTERVAL,
+                on_write=_referral_counts_written,
+            )
+    return _referral_counter
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def flush_referral_counter(**kwargs):
+    """Write the buffered referral counts before the worker exits."""
+    if _referral_counter is not None:
+        _referral_counter.flush()
@@ -0,0 +1,87 @@
+"""
+This module renders the emails of the application from their template id.
+
+Email jobs only carry a template id, a small context and the recipients. The
+worker looks up the subject and template of the id and renders it from a
+compiled template kept in memory, which is loaded once when the worker starts.
+The base-email.html parent is compiled once as well, by the cached template
+loader Django uses by default.
+
+Functions:
+- get_email_template(template_id): Return the compiled template of an email.
+- render_email(template_id, context): Render the subject and HTML content of an email.
+- preload_email_templates(): Compile every email template ahead of the first job.
+"""
+
+import os
+
+from celery.signals import worker_process_init, worker_ready
+from django.template.loader import get_template
+
+from .tracing import span
+
+EMAIL_TEMPLATES = {
+    "verification": {
+        "subject": "Verification Email - SpotHot",
+        "template": "verification-email.html",
+        "context": {"type_of_action": "Email Verification"},
+    },
+    "welcome": {
+        "subject": "Welcome - Your Spot is Confirmed!",
+        "template": "welcome-email.html",
+        "context": {"type_of_action": "Registration"},
+    },
+    "spot_update": {
+        "subject": "Spot Update - SpotHot",
+        "template": "spot-update-email.html",
+        "context": {"type_of_action": "Referral"},
+    },
+    "winner": {
+        "subject": "Congratulations You Are Selected! - SpotHot",
+        "template": "winner-email.html",
+        "context": {"type_of_action": "Selection"},
+    },
+}
+
+_templates = {}
+
+
+def get_email_template(template_id):
+    """
+    Return the compiled template of an email.
+
+    Args:
+        template_id (str): A key of EMAIL_TEMPLATES.
+
+    Returns:
+        Template: The compiled template.
+    """
+    if template_id not in _templates:
+        _templates[template_id] = get_template(EMAIL_TEMPLATES[template_id]["template"])
+    return _templates[template_id]
+
+
+def render_email(template_id, context):
+    """
+    Render the subject and HTML content of an email.
+
+    Args:
+        template_id (str): A key of EMAIL_TEMPLATES.
+        context (dict): The variables of the email.
+
+    Returns:
+        tuple: The subject and HTML content of the email.
+    """
+    email = EMAIL_TEMPLATES[template_id]
+    context = {"client_url": os.getenv("CLIENT_URL"), **email["context"], **context}
+
+    with span("email.render", template=template_id):
+        return email["subject"], get_email_template(template_id).render(context)
+
+
+@worker_ready.connect
+@worker_process_init.connect
+def preload_email_templates(**kwargs):
+    """Compile every email template ahead of the first job."""
+    for template_id in EMAIL_TEMPLATES:
+        get_email_template(template_id)
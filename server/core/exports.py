@@ -0,0 +1,173 @@
+"""
+This module streams full exports of the waitlist and of the referral graph.
+
+Rows are read in keyset chunks (`WHERE key > last ORDER BY key LIMIT n`) inside
+one transaction, so an export sees a single snapshot of the tables and memory
+stays constant at any size. Unlike `.iterator()`, this does not depend on the
+database backend supporting server-side cursors, which MySQL does not. The rows
+are encoded as CSV or NDJSON and optionally gzipped on the fly.
+
+Functions:
+- export_rows(kind, chunk_size): Yield the rows of an export as dicts.
+- encode_rows(rows, fields, export_format): Yield the rows of an export encoded as text.
+- gzip_chunks(chunks): Gzip a stream of text chunks on the fly.
+- export_chunks(kind, export_format, compress, chunk_size): Yield the encoded chunks of an export.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from django.db import transaction
+
+from .models import Waitlist, Referral
+
+EXPORTS = {
+    "waitlist": {
+        "model": Waitlist,
+        "key": "position",
+        "fields": {
+            "user_id": "user_id",
+            "name": "user__name",
+            "email": "user__email",
+            "position": "position",
+            "referral_count": "user__referral_count",
+            "is_verified": "user__is_verified",
+        },
+    },
+    "referrals": {
+        "model": Referral,
+        "key": "id",
+        "fields": {
+            "referrer_id": "referrer_id",
+            "referee_id": "referee_id",
+            "created_at": "created_at",
+        },
+    },
+}
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_rows(kind, chunk_size=5000):
+    """
+    Yield the rows of an export as dicts.
+
+    Args:
+        kind (str): A key of EXPORTS.
+        chunk_size (int): Number of rows fetched per query.
+
+    Yields:
+        dict: The exported columns of a row.
+    """
+    export = EXPORTS[kind]
+    key = export["key"]
+    columns = list(export["fields"].values())
+    names = list(export["fields"])
+    if key not in columns:
+        columns.append(key)
+
+    base = export["model"].objects.order_by(key).values(*columns)
+
+    with transaction.atomic():
+        last = None
+        while True:
+            queryset = base if last is None else base.filter(**{f"{key}__gt": last})
+            rows = list(queryset[:chunk_size])
+            for row in rows:
+                yield {name: row[column] for name, column in zip(names, columns)}
+
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1][key]
+
+
+def encode_rows(rows, fields, export_format):
+    """
+    Yield the rows of an export encoded as text.
+
+    Args:
+        rows (iterable): The rows as dicts.
+        fields (list): The column names, in order.
+        export_format (str): A key of EXPORT_FORMATS.
+
+    Yields:
+        str: The header (CSV only), then one chunk per row.
+    """
+    if export_format == "ndjson":
+        for row in rows:
+            yield json.dumps(row, default=str) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _blocks(chunks, size=64 * 1024):
+    """Join small text chunks into blocks of about `size` characters."""
+    block = []
+    length = 0
+    for chunk in chunks:
+        block.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(block)
+            block = []
+            length = 0
+    if block:
+        yield "".join(block)
+
+
+def gzip_chunks(chunks):
+    """
+    Gzip a stream of text chunks on the fly.
+
+    Args:
+        chunks (iterable): The text chunks.
+
+    Yields:
+        bytes: The compressed stream, in pieces.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(kind, export_format, compress=False, chunk_size=5000):
+    """
+    Yield the encoded chunks of an export.
+
+    Args:
+        kind (str): A key of EXPORTS.
+        export_format (str): A key of EXPORT_FORMATS.
+        compress (bool, optional): Gzip the output. Defaults to False.
+        chunk_size (int, optional): Number of rows fetched per query. Defaults to 5000.
+
+    Yields:
+        bytes: The export, in pieces.
+    """
+    chunks = _blocks(
+        encode_rows(
+            export_rows(kind, chunk_size), list(EXPORTS[kind]["fields"]), export_format
+        )
+    )
+    if compress:
+        yield from gzip_chunks(chunks)
+    else:
+        for chunk in chunks:
+            yield chunk.encode()
@@ -0,0 +1,327 @@
+"""
+This module imports an existing waitlist in bulk.
+
+The input is a stream of rows with an `email` and a `name`, and optionally the
+email of the user who referred them (`referrer`), whether they verified their
+email (`is_verified`) and whether they were deleted (`is_deleted`). Users are
+inserted in chunks with one statement per chunk and their referral codes are
+generated in bulk. Once every user is known, the referrals are inserted and the
+referral counts incremented with one statement per distinct increment. The
+verified users then join the waitlist in rank order, merged with the existing
+entries in one pass, and are inserted at their final positions. Only the
+existing entries they outrank are moved.
+
+Users already in the database, rows without a valid email or name and repeated
+emails are skipped. The ranking actor must be stopped during an import, its
+ranking index is rebuilt from the imported rows when it starts again.
+
+Classes:
+    WaitlistImport: Imports users, referrals and waitlist entries in chunks.
+
+Functions:
+- read_rows(stream, import_format): Yield the rows of a CSV or NDJSON stream as dicts.
+"""
+
+import csv
+import heapq
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import F
+
+from .models import User, Referral, Waitlist, LeaderboardEntry
+from .codes import generate_codes
+from .cache import (
+    invalidate_users,
+    invalidate_waitlists,
+    bump_revision,
+    referrals_revision,
+)
+from .leaderboard import add_leaderboard_entries
+from .ranking import move_waitlist_entries
+from .sequences import get_waitlist_position_allocator
+
+IMPORT_FORMATS = ("csv", "ndjson")
+TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+
+
+def read_rows(stream, import_format):
+    """
+    Yield the rows of a CSV or NDJSON stream as dicts.
+
+    Args:
+        stream (file): A text stream.
+        import_format (str): One of IMPORT_FORMATS.
+
+    Yields:
+        dict: The columns of a row.
+    """
+    if import_format == "csv":
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def _flag(value):
+    return value if isinstance(value, bool) else _text(value).lower() in TRUE_VALUES
+
+
+class WaitlistImport:
+    """
+    Imports users, referrals and waitlist entries in chunks.
+
+    Call add_users with every row, then add_referrals and add_waitlist_entries.
+    Emails are compared case-insensitively, as the unique index of MySQL does.
+
+    Args:
+        chunk_size (int): Number of rows written per statement.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.skipped = 0
+        self.skipped_referrals = 0
+        self.user_ids = {}  # Lowercased email -> ID of every imported user
+        self.verified = []  # IDs of the imported verified users, in input order
+        self.pending = []  # (referee ID, lowercased referrer email) pairs
+        self.referral_counts = Counter()
+
+    def _parse(self, row):
+        """
+        Return the (email, name, referrer, is_verified, is_deleted) of a row.
+
+        Returns None when the row has no valid email or name.
+        """
+        email, name = _text(row.get("email")), _text(row.get("name"))
+        try:
+            validate_email(email)
+        except ValidationError:
+            return None
+        if not name or len(name) > User._meta.get_field("name").max_length:
+            return None
+
+        return (
+            email,
+            name,
+            _text(row.get("referrer")).lower(),
+            _flag(row.get("is_verified")),
+            _flag(row.get("is_deleted")),
+        )
+
+    def add_users(self, rows):
+        """
+        Insert the users of the rows, one statement per chunk.
+
+        Args:
+            rows (iterable): The rows as dicts.
+
+        Returns:
+            int: The number of users inserted.
+        """
+        inserted = 0
+        for chunk in _chunks(rows, self.chunk_size):
+            self.rows += len(chunk)
+
+            parsed = {}
+            for row in chunk:
+                user = self._parse(row)
+                key = user and user[0].lower()
+                if user is None or key in parsed or key in self.user_ids:
+                    continue
+                parsed[key] = user
+
+            existing = {
+                email.lower()
+                for email in User.objects.filter(
+                    email__in=[user[0] for user in parsed.values()]
+                ).values_list("email", flat=True)
+            }
+            users = [user for key, user in parsed.items() if key not in existing]
+            self.skipped += len(chunk) - len(users)
+            if not users:
+                continue
+
+            codes = generate_codes("referral", len(users))
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [
+                        User(
+                            email=email,
+                            name=name,
+                            is_verified=is_verified,
+                            is_deleted=is_deleted,
+                            referral_code=code,
+                        )
+                        for (email, name, _, is_verified, is_deleted), code in zip(
+                            users, codes
+                        )
+                    ]
+                )
+                # Unknown emails are cached, the imported ones must be looked up again
+                invalidate_users([user[0] for user in users])
+
+            # MySQL does not return the IDs of bulk inserted rows
+            ids = {
+                email.lower(): user_id
+                for email, user_id in User.objects.filter(
+                    email__in=[user[0] for user in users]
+                ).values_list("email", "id")
+            }
+            for email, _, referrer, is_verified, _ in users:
+                user_id = ids[email.lower()]
+                self.user_ids[email.lower()] = user_id
+                if is_verified:
+                    self.verified.append(user_id)
+                if referrer:
+                    self.pending.append((user_id, referrer))
+            inserted += len(users)
+
+        return inserted
+
+    def _referrer_ids(self):
+        """Return the ID of every referrer email, imported or already in the database."""
+        referrer_ids = dict(self.user_ids)
+        unknown = {email for _, email in self.pending if email not in referrer_ids}
+        for chunk in _chunks(unknown, self.chunk_size):
+            referrer_ids.update(
+                (email.lower(), user_id)
+                for email, user_id in User.objects.filter(email__in=chunk).values_list(
+                    "email", "id"
+                )
+            )
+        return referrer_ids
+
+    def add_referrals(self):
+        """
+        Insert the referrals of the imported users and increment the referral counts.
+
+        Referrals to unknown referrers and self-referrals are skipped.
+
+        Returns:
+            int: The number of referrals inserted.
+        """
+        referrer_ids = self._referrer_ids()
+        referrals = [
+            (referee_id, referrer_ids[email])
+            for referee_id, email in self.pending
+            if email in referrer_ids and referrer_ids[email] != referee_id
+        ]
+        self.skipped_referrals = len(self.pending) - len(referrals)
+
+        for chunk in _chunks(referrals, self.chunk_size):
+            Referral.objects.bulk_create(
+                [
+                    Referral(referee_id=referee_id, referrer_id=referrer_id)
+                    for referee_id, referrer_id in chunk
+                ]
+            )
+        self.referral_counts.update(referrer_id for _, referrer_id in referrals)
+
+        # Referral counts follow a power law, so there are few distinct increments
+        increments = defaultdict(list)
+        for referrer_id, count in self.referral_counts.items():
+            increments[count].append(referrer_id)
+
+        imported = set(self.user_ids.values())
+        for count, referrer_ids in increments.items():
+            for chunk in _chunks(referrer_ids, self.chunk_size):
+                User.objects.filter(id__in=chunk).update(
+                    referral_count=F("referral_count") + count
+                )
+
+        # Referrers that were already in the database may be on the leaderboard and cached
+        existing = [user_id for user_id in self.referral_counts if user_id not in imported]
+        for chunk in _chunks(existing, self.chunk_size):
+            with transaction.atomic():
+                LeaderboardEntry.objects.bulk_update(
+                    [
+                        LeaderboardEntry(user_id=user_id, referral_count=referral_count)
+                        for user_id, referral_count in User.objects.filter(
+                            id__in=chunk, leaderboardentry__isnull=False
+                        ).values_list("id", "referral_count")
+                    ],
+                    ["referral_count"],
+                )
+                invalidate_users(
+                    User.objects.filter(id__in=chunk).values_list("email", flat=True)
+                )
+                for user_id in chunk:
+                    bump_revision(referrals_revision(user_id))
+
+        return len(referrals)
+
+    def add_waitlist_entries(self):
+        """
+        Add the imported verified users to the waitlist at their final positions.
+
+        The imported users, by referral count and then in input order, are merged
+        with the existing entries in one pass, the imported users ranking after
+        existing entries with as many referrals since they join later. The
+        existing entries whose rank changed are moved first, then the imported
+        users are inserted at the positions left for them. Into an empty
+        waitlist, nothing is moved.
+
+        Returns:
+            int: The number of users added to the waitlist.
+        """
+        first_position = settings.WAITLIST_FIRST_POSITION
+        existing = Waitlist.objects.order_by("-user__referral_count", "id").values_list(
+            "id", "user_id", "position", "user__referral_count"
+        )
+        imported = sorted(
+            self.verified,
+            key=lambda user_id: (-self.referral_counts[user_id], user_id),
+        )
+
+        moved = []
+        positions = []
+        merged = heapq.merge(
+            ((-row[3], 0, row) for row in existing.iterator(chunk_size=self.chunk_size)),
+            ((-self.referral_counts[user_id], 1, user_id) for user_id in imported),
+            key=lambda item: item[:2],
+        )
+        for rank, (_, is_imported, item) in enumerate(merged):
+            position = first_position + rank
+            if is_imported:
+                positions.append(position)
+            elif item[2] != position:
+                moved.append((item[0], item[1], position, item[3]))
+
+        move_waitlist_entries(lambda: moved, settings.RANKING_BATCH_SIZE)
+        # Advancing the position counter past the imported entries
+        get_waitlist_position_allocator().reserve(len(imported))
+
+        for offset in range(0, len(imported), self.chunk_size):
+            chunk = imported[offset : offset + self.chunk_size]
+            users = User.objects.only("id", "name", "referral_count").in_bulk(chunk)
+            entries = [
+                (users[user_id], position)
+                for user_id, position in zip(chunk, positions[offset:])
+            ]
+            with transaction.atomic():
+                Waitlist.objects.bulk_create(
+                    [Waitlist(user=user, position=position) for user, position in entries]
+                )
+                add_leaderboard_entries(entries)
+                invalidate_waitlists()
+
+        return len(imported)
@@ -0,0 +1,189 @@
+"""
+This module maintains the LeaderboardEntry read model of the global waitlist.
+
+The entries mirror Waitlist joined with User. They are updated incrementally by
+the waitlist tasks and can be rebuilt from scratch or checked for drift with the
+`rebuild_leaderboard` management command. Every change gives the global waitlist
+a new revision stamp, used as the ETag of its pages.
+
+Functions:
+- add_leaderboard_entry(user, position): Adds a user to the leaderboard.
+- add_leaderboard_entries(entries): Adds users to the leaderboard in one statement.
+- update_leaderboard_referral_count(user): Copies the referral count of a user to the leaderboard.
+- move_leaderboard_entries(positions): Moves leaderboard entries to new positions.
+- rebuild_leaderboard(batch_size): Rebuilds the leaderboard from the Waitlist and User tables.
+- find_leaderboard_drift(batch_size): Compares the leaderboard with the Waitlist and User tables.
+"""
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import LeaderboardEntry, Waitlist
+from .cache import bump_revision, GLOBAL_WAITLIST_REVISION
+
+
+def add_leaderboard_entry(user, position):
+    """
+    Adds a user to the leaderboard.
+
+    Args:
+        user (User): The user joining the waitlist.
+        position (int): The waitlist position of the user.
+    """
+    LeaderboardEntry.objects.create(
+        user=user,
+        position=position,
+        name=user.name,
+        referral_count=user.referral_count,
+    )
+    bump_revision(GLOBAL_WAITLIST_REVISION)
+
+
+def add_leaderboard_entries(entries):
+    """
+    Adds users to the leaderboard in one statement.
+
+    Args:
+        entries (list): (user, position) pairs of the users joining the waitlist.
+    """
+    LeaderboardEntry.objects.bulk_create(
+        [
+            LeaderboardEntry(
+                user=user,
+                position=position,
+                name=user.name,
+                referral_count=user.referral_count,
+            )
+            for user, position in entries
+        ]
+    )
+    bump_revision(GLOBAL_WAITLIST_REVISION)
+
+
+def update_leaderboard_referral_count(user):
+    """
+    Copies the referral count of a user to the leaderboard.
+
+    Args:
+        user (User): The user whose referral count changed.
+    """
+    LeaderboardEntry.objects.filter(user=user.id).update(
+        referral_count=user.referral_count
+    )
+    bump_revision(GLOBAL_WAITLIST_REVISION)
+
+
+def move_leaderboard_entries(positions, batch_size=1000):
+    """
+    Moves leaderboard entries to new positions.
+
+    The entries are first moved to negative positions so that the final positions
+    can be assigned in bulk without tripping the unique constraint on `position`.
+
+    Args:
+        positions (dict): The new position of each user ID.
+        batch_size (int): Number of rows written per statement.
+    """
+    entries = [
+        LeaderboardEntry(user_id=user_id, position=position)
+        for user_id, position in positions.items()
+    ]
+
+    with transaction.atomic():
+        for offset in range(0, len(entries), batch_size):
+            ids = [entry.user_id for entry in entries[offset : offset + batch_size]]
+            LeaderboardEntry.objects.filter(user__in=ids).update(
+                position=-F("position")
+            )
+        LeaderboardEntry.objects.bulk_update(
+            entries, ["position"], batch_size=batch_size
+        )
+        bump_revision(GLOBAL_WAITLIST_REVISION)
+
+
+def _waitlist_rows(batch_size):
+    """Yields (user_id, position, name, referral_count) of the waitlist ordered by user."""
+    return (
+        Waitlist.objects.order_by("user_id")
+        .values_list("user_id", "position", "user__name", "user__referral_count")
+        .iterator(chunk_size=batch_size)
+    )
+
+
+def rebuild_leaderboard(batch_size=1000):
+    """
+    Rebuilds the leaderboard from the Waitlist and User tables.
+
+    Args:
+        batch_size (int): Number of rows inserted per statement.
+
+    Returns:
+        int: The number of entries written.
+    """
+    count = 0
+
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+
+        entries = []
+        for user_id, position, name, referral_count in _waitlist_rows(batch_size):
+            entries.append(
+                LeaderboardEntry(
+                    user_id=user_id,
+                    position=position,
+                    name=name,
+                    referral_count=referral_count,
+                )
+            )
+            if len(entries) >= batch_size:
+                LeaderboardEntry.objects.bulk_create(entries)
+                count += len(entries)
+                entries = []
+
+        LeaderboardEntry.objects.bulk_create(entries)
+        count += len(entries)
+
+        bump_revision(GLOBAL_WAITLIST_REVISION)
+
+    return count
+
+
+def find_leaderboard_drift(batch_size=1000):
+    """
+    Compares the leaderboard with the Waitlist and User tables.
+
+    Both sides are streamed in user order and merged, so memory use does not
+    grow with the size of the waitlist.
+
+    Args:
+        batch_size (int): Number of rows fetched per round-trip.
+
+    Returns:
+        dict: The user IDs that are `missing` from the leaderboard, `stale` in it
+        or `extra` in it.
+    """
+    drift = {"missing": [], "stale": [], "extra": []}
+
+    expected = iter(_waitlist_rows(batch_size))
+    actual = iter(
+        LeaderboardEntry.objects.order_by("user_id")
+        .values_list("user_id", "position", "name", "referral_count")
+        .iterator(chunk_size=batch_size)
+    )
+
+    row = next(expected, None)
+    entry = next(actual, None)
+    while row is not None or entry is not None:
+        if entry is None or (row is not None and row[0] < entry[0]):
+            drift["missing"].append(row[0])
+            row = next(expected, None)
+        elif row is None or entry[0] < row[0]:
+            drift["extra"].append(entry[0])
+            entry = next(actual, None)
+        else:
+            if row != entry:
+                drift["stale"].append(row[0])
+            row = next(expected, None)
+            entry = next(actual, None)
+
+    return drift
@@ -0,0 +1,143 @@
+"""
+This module delivers emails over a pooled connection of the configured email backend.
+
+Opening an SMTP connection costs a TCP handshake, TLS negotiation and a login,
+which dominates the time to send a single message. The mailer keeps one
+connection open per worker process and reuses it for every message, reopening it
+when it has been idle for too long or when the server drops it.
+
+Classes:
+    Mailer: Sends messages over one reused email backend connection.
+
+Functions:
+    build_html_email(subject, html_content, recipient_list): Build an HTML email with a plain text alternative.
+    get_mailer(): Return the process wide mailer.
+"""
+
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils.html import strip_tags
+
+from .metrics import EMAILS, EMAIL_SEND_DURATION, EMAIL_CONNECT_DURATION
+from .tracing import span
+
+
+def build_html_email(subject, html_content, recipient_list):
+    """
+    Build an HTML email with a plain text alternative.
+
+    Args:
+        subject (str): The subject of the email.
+        html_content (str): The HTML content of the email.
+        recipient_list (list): A list of email addresses to send the email to.
+
+    Returns:
+        EmailMultiAlternatives: The email message.
+    """
+    email = EmailMultiAlternatives(
+        subject,
+        strip_tags(html_content),
+        to=recipient_list,
+        from_email=settings.EMAIL_HOST_USER,
+    )
+    email.attach_alternative(html_content, "text/html")
+    return email
+
+
+class Mailer:
+    """
+    Sends messages over one reused email backend connection.
+
+    Args:
+        attempts (int): Number of times a message is tried, reconnecting in between.
+        max_idle (float): Seconds a connection may stay unused before it is reopened.
+        connection_factory (callable, optional): Returns a new backend connection.
+            Defaults to django.core.mail.get_connection.
+    """
+
+    def __init__(self, attempts, max_idle, connection_factory=get_connection):
+        self.attempts = attempts
+        self.max_idle = max_idle
+        self.connection_factory = connection_factory
+        self.connection = None
+        self.last_used = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if (
+            self.connection is not None
+            and time.monotonic() - self.last_used > self.max_idle
+        ):
+            self.close()
+
+        if self.connection is None:
+            connection = self.connection_factory()
+            with EMAIL_CONNECT_DURATION.time(), span("smtp.connect"):
+                connection.open()
+            self.connection = connection
+
+    def close(self):
+        """Close the connection, ignoring errors from a connection that is already gone."""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+    def send(self, messages):
+        """
+        Send messages, retrying each of them on a fresh connection after an error.
+
+        Args:
+            messages (list): The EmailMessage instances to send.
+
+        Returns:
+            list: The (message, error) pairs of the messages that could not be sent.
+        """
+        failed = []
+
+        with self._lock:
+            for message in messages:
+                for attempt in range(self.attempts):
+                    try:
+                        self._connect()
+                        with EMAIL_SEND_DURATION.time(), span(
+                            "smtp.send", recipients=len(message.recipients()), attempt=attempt
+                        ):
+                            self.connection.send_messages([message])
+                        self.last_used = time.monotonic()
+                        EMAILS.inc("sent")
+                        break
+                    except (smtplib.SMTPException, OSError) as error:
+                        self.close()
+                        if attempt == self.attempts - 1:
+                            failed.append((message, error))
+                            EMAILS.inc("failed")
+
+        return failed
+
+
+_mailer = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    """
+    Return the process wide mailer.
+
+    Returns:
+        Mailer: The mailer of this process.
+    """
+    global _mailer
+
+    with _mailer_lock:
+        if _mailer is None:
+            _mailer = Mailer(
+                settings.EMAIL_SEND_ATTEMPTS, settings.EMAIL_CONNECTION_MAX_IDLE
+            )
+    return _mailer
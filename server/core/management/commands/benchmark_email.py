@@ -0,0 +1,77 @@
+"""
+Management command to compare per-message and pooled SMTP delivery offline.
+
+Both modes send the same messages to a local SMTP sink. Per-message delivery
+opens a connection for every message, as send_html_email did, pooled delivery
+goes through core.mailer.Mailer.
+
+Usage:
+    python manage.py benchmark_email --messages 200 --connect-delay 0.05
+"""
+
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from core.mailer import Mailer, build_html_email
+from core.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    """Measures email throughput against a local SMTP sink."""
+
+    help = "Compares per-message and pooled SMTP delivery against a local SMTP sink."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument(
+            "--connect-delay",
+            type=float,
+            default=0.05,
+            help="Seconds the sink waits before greeting a connection.",
+        )
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(("127.0.0.1", 0), options["connect_delay"])
+        sink.start()
+        host, port = sink.server_address
+
+        def connection_factory():
+            return get_connection(
+                "django.core.mail.backends.smtp.EmailBackend",
+                host=host,
+                port=port,
+                username="",
+                password="",
+                use_tls=False,
+                use_ssl=False,
+            )
+
+        emails = [
+            build_html_email(
+                "Benchmark - SpotHot", f"<p>Message {number}</p>", ["user@example.com"]
+            )
+            for number in range(options["messages"])
+        ]
+
+        try:
+            start = time.perf_counter()
+            for email in emails:
+                connection_factory().send_messages([email])
+            single = time.perf_counter() - start
+
+            mailer = Mailer(attempts=3, max_idle=60, connection_factory=connection_factory)
+            start = time.perf_counter()
+            failed = mailer.send(emails)
+            mailer.close()
+            pooled = time.perf_counter() - start
+        finally:
+            sink.shutdown()
+            sink.server_close()
+
+        count = len(emails)
+        self.stdout.write(f"Per-message connections: {count / single:.1f} messages/s")
+        self.stdout.write(f"Pooled connection: {count / pooled:.1f} messages/s")
+        self.stdout.write(f"Speedup: {single / pooled:.1f}x, failed: {len(failed)}")
+        self.stdout.write(f"Sink accepted {sink.messages} of {count * 2} messages.")
@@ -0,0 +1,408 @@
+"""
+Management command to benchmark the signup, verification, referral and ranking pipeline.
+
+Every simulated user signs up, a share of them with the referral code of an
+earlier user, then verifies their email. The requests go through
+AuthenticationView and VerificationView, `--concurrency` users at a time. One
+worker thread drains the outbox meanwhile, as the outbox dispatcher, the Celery
+workers and the ranking actor do in production, so create_referrals,
+create_waitlist and update_waitlist run as they are queued.
+
+Tasks run either eagerly inside the dispatcher (`--celery eager`) or through an
+in-memory broker (`--celery memory`), where the ranking tasks are applied in
+micro-batches by the ranking actor. Emails go to the locmem backend and events
+to the in-process pub/sub, so nothing leaves the machine. The pipeline runs
+against the configured database: a local MySQL, or SQLite with
+DATABASE_ENGINE=sqlite3.
+
+Throughput, p50/p95/p99 latency and queries per operation are reported for each
+request, task and ranking batch, and saved as JSON. Pass the JSON of an earlier
+run as `--baseline` to compare. The benchmark users are deleted afterwards and
+the waitlist is re-ranked to close the gaps they leave.
+
+Usage:
+    python manage.py benchmark_pipeline --users 500 --concurrency 8
+    python manage.py benchmark_pipeline --celery memory --output after.json --baseline before.json
+"""
+
+import contextlib
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from celery.signals import task_prerun, task_postrun
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import RequestFactory, override_settings
+
+from core.models import User, Verification, OutboxMessage
+from core.outbox import dispatch_outbox
+from core.ranking import reset_ranking_index
+from core.ranking_actor import RankingActor
+from core.tasks import rerank_waitlist
+from core.views import AuthenticationView, VerificationView
+from server.celery import app, QUEUES, RANKING_TASKS
+
+
+class QueryCounter:
+    """Database execute wrapper counting the queries of its connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _percentile(values, percent):
+    """Return the nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    """Benchmarks the signup to re-rank pipeline."""
+
+    help = (
+        "Drives signups, verifications and the referral and ranking tasks they "
+        "queue, and reports throughput, latency percentiles and queries per "
+        "operation. Stop the outbox dispatcher and the ranking actor first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--referral-rate",
+            type=float,
+            default=0.6,
+            help="Share of users signing up with the referral code of an earlier user.",
+        )
+        parser.add_argument("--celery", choices=("eager", "memory"), default="eager")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output", help="JSON file for the results, benchmark-<time>.json by default."
+        )
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--users and --concurrency must be at least 1.")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+
+        self.prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        self.random = random.Random(options["seed"])
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # Step -> (seconds, queries) of each operation
+        self.errors = Counter()
+        self.codes = []
+        self.batch_sizes = []
+        self.done = threading.Event()
+        # SQLite allows one writer, and fails a transaction upgrading from reading
+        # to writing at once instead of waiting, so requests and tasks take turns
+        self.database_lock = (
+            threading.Lock() if connection.vendor == "sqlite" else contextlib.nullcontext()
+        )
+
+        app.conf.task_always_eager = options["celery"] == "eager"
+        if options["celery"] == "memory":
+            app.conf.broker_url = "memory://"
+        # Rebuilding the ranking index from the database, as the actor does on start
+        reset_ranking_index()
+
+        try:
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+                PUBSUB_BACKEND="core.pubsub.InProcessPubSub",
+            ):
+                elapsed = self.run(options)
+        finally:
+            OutboxMessage.objects.filter(args__icontains=self.prefix).delete()
+            deleted, _ = User.objects.filter(email__startswith=self.prefix).delete()
+            # Closing the gaps the benchmark users leave in the waitlist
+            rerank_waitlist()
+            self.stdout.write(f"Deleted {deleted} benchmark rows.")
+
+        results = self.summarize(elapsed, options)
+        output = options["output"] or (
+            f"benchmark-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+        )
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+
+        self.report(results, baseline)
+        self.stdout.write(self.style.SUCCESS(f"Saved the results to {output}."))
+
+    def record(self, step, seconds, queries):
+        with self.lock:
+            self.samples[step].append((seconds, queries))
+
+    def run(self, options):
+        """Run the pipeline, then one full re-rank, and return the elapsed seconds of the pipeline."""
+        worker = threading.Thread(target=self.drain, args=(options["celery"],))
+        task_prerun.connect(self.on_task_prerun)
+        task_postrun.connect(self.on_task_postrun)
+        try:
+            start = time.perf_counter()
+            worker.start()
+            try:
+                with ThreadPoolExecutor(options["concurrency"]) as executor:
+                    list(
+                        executor.map(
+                            lambda number: self.flow(number, options["referral_rate"]),
+                            range(options["users"]),
+                        )
+                    )
+            finally:
+                self.done.set()
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            self.run_task(rerank_waitlist)
+        finally:
+            task_prerun.disconnect(self.on_task_prerun)
+            task_postrun.disconnect(self.on_task_postrun)
+        return elapsed
+
+    def request(self, step, view, request, **kwargs):
+        """Call a view, recording its latency and queries. Returns the response, None on an error."""
+        counter = QueryCounter()
+        with self.database_lock:
+            start = time.perf_counter()
+            try:
+                with connection.execute_wrapper(counter):
+                    response = view(request, **kwargs)
+                    response.render()
+            except Exception as error:
+                self.stderr.write(f"{step} failed: {error}")
+                response = None
+            self.record(step, time.perf_counter() - start, counter.count)
+        if response is None or response.status_code >= 400:
+            with self.lock:
+                self.errors[step] += 1
+            return None
+        return response
+
+    def flow(self, number, referral_rate):
+        """Sign up and verify one user."""
+        factory = RequestFactory()
+        try:
+            with self.lock:
+                code = (
+                    self.random.choice(self.codes)
+                    if self.codes and self.random.random() < referral_rate
+                    else None
+                )
+
+            request = factory.post(
+                f"/api/auth/{code}/" if code else "/api/auth/",
+                {"name": f"Benchmark {number}", "email": f"{self.prefix}-{number}@example.com"},
+                content_type="application/json",
+            )
+            response = self.request(
+                "signup", AuthenticationView.as_view(), request, code=code
+            )
+            if response is None:
+                return
+
+            user_id = response.data["id"]
+            with self.database_lock:
+                unique_code = Verification.objects.values_list(
+                    "unique_code", flat=True
+                ).get(user_id=user_id)
+            request = factory.get(f"/api/auth/verify/{unique_code}/")
+            if self.request("verify", VerificationView.as_view(), request, code=unique_code):
+                with self.lock:
+                    self.codes.append(response.data["referral_code"])
+        finally:
+            connections.close_all()
+
+    def on_task_prerun(self, task_id, task, **kwargs):
+        # Tasks queued by a task run nested in eager mode, their time and queries
+        # are taken out of the parent's
+        self.task_stack.append([time.perf_counter(), self.task_counter.count, 0, 0])
+
+    def on_task_postrun(self, task_id, task, state=None, **kwargs):
+        start, queries, child_seconds, child_queries = self.task_stack.pop()
+        seconds = time.perf_counter() - start
+        queries = self.task_counter.count - queries
+        if self.task_stack:
+            self.task_stack[-1][2] += seconds
+            self.task_stack[-1][3] += queries
+
+        step = task.name.rsplit(".", 1)[-1]
+        self.record(step, seconds - child_seconds, queries - child_queries)
+        if state != "SUCCESS":
+            self.errors[step] += 1
+
+    def run_task(self, task):
+        self.task_stack = []
+        self.task_counter = QueryCounter()
+        with connection.execute_wrapper(self.task_counter):
+            task.apply()
+
+    def drain(self, mode):
+        """Run the queued tasks until the users are done and the outbox is empty."""
+        self.task_stack = []
+        self.task_counter = QueryCounter()
+        actor = RankingActor(
+            settings.RANKING_ACTOR_BATCH_SIZE, settings.RANKING_ACTOR_BATCH_WINDOW
+        )
+        messages = []
+        try:
+            with connection.execute_wrapper(self.task_counter):
+                if mode == "eager":
+                    # Tasks run inside apply_async as they are published
+                    while True:
+                        finished = self.done.is_set()
+                        if not self.dispatch():
+                            if finished:
+                                return
+                            time.sleep(0.001)
+                    return
+
+                ranking = []
+                batch_start = None
+                with app.connection_for_write() as broker, broker.Consumer(
+                    list(QUEUES.values()),
+                    callbacks=[lambda body, message: messages.append(message)],
+                    accept=["json"],
+                ):
+                    while True:
+                        finished = self.done.is_set()
+                        sent = self.dispatch()
+                        try:
+                            broker.drain_events(timeout=0.001)
+                        except TimeoutError:
+                            pass
+
+                        for message in messages:
+                            if message.headers["task"] in RANKING_TASKS:
+                                ranking.append(message)
+                                batch_start = batch_start or time.monotonic()
+                            else:
+                                with self.database_lock:
+                                    args, kwargs, _ = message.decode()
+                                    app.tasks[message.headers["task"]].apply(args, kwargs)
+                                message.ack()
+                        idle = not messages and not sent
+                        messages.clear()
+
+                        # Batching the ranking tasks as the ranking actor does
+                        if ranking and (
+                            len(ranking) >= actor.batch_size
+                            or time.monotonic() - batch_start >= actor.batch_window
+                            or (idle and finished)
+                        ):
+                            self.apply_ranking(actor, ranking)
+                            ranking, batch_start = [], None
+                        elif idle and finished and not ranking:
+                            return
+        finally:
+            connections.close_all()
+
+    def dispatch(self):
+        with self.database_lock:
+            return dispatch_outbox(settings.OUTBOX_BATCH_SIZE)
+
+    def apply_ranking(self, actor, messages):
+        """Apply a batch of ranking tasks as the ranking actor does."""
+        with self.database_lock:
+            start, queries = time.perf_counter(), self.task_counter.count
+            try:
+                actor.apply(messages)
+            except Exception as error:
+                self.stderr.write(f"ranking_batch failed: {error}")
+                self.errors["ranking_batch"] += 1
+            self.record(
+                "ranking_batch",
+                time.perf_counter() - start,
+                self.task_counter.count - queries,
+            )
+        self.batch_sizes.append(len(messages))
+        for message in messages:
+            message.ack()
+
+    def summarize(self, elapsed, options):
+        """Return the results of the run as a JSON-serializable dict."""
+        try:
+            revision = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            revision = None
+
+        steps = {}
+        for step, samples in sorted(self.samples.items()):
+            seconds = sorted(sample[0] for sample in samples)
+            queries = [sample[1] for sample in samples]
+            steps[step] = {
+                "count": len(samples),
+                "per_second": len(samples) / elapsed,
+                "p50_ms": _percentile(seconds, 50) * 1000,
+                "p95_ms": _percentile(seconds, 95) * 1000,
+                "p99_ms": _percentile(seconds, 99) * 1000,
+                "queries_per_operation": sum(queries) / len(queries),
+                "max_queries": max(queries),
+            }
+
+        return {
+            "revision": revision,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key]
+                for key in ("users", "concurrency", "referral_rate", "celery", "seed")
+            },
+            "elapsed_seconds": elapsed,
+            "users_per_second": options["users"] / elapsed,
+            "steps": steps,
+            "errors": dict(self.errors),
+            "ranking_batch_sizes": {
+                "count": len(self.batch_sizes),
+                "mean": sum(self.batch_sizes) / len(self.batch_sizes),
+                "max": max(self.batch_sizes),
+            }
+            if self.batch_sizes
+            else None,
+        }
+
+    def report(self, results, baseline):
+        """Print the results, and their change from the baseline when given."""
+        self.stdout.write(
+            f"{results['options']['users']} users in {results['elapsed_seconds']:.2f}s "
+            f"({results['users_per_second']:.1f} users/s) on {results['database']}"
+        )
+        for step, stats in results["steps"].items():
+            line = (
+                f"{step}: {stats['count']} ops, {stats['per_second']:.1f}/s, "
+                f"p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, "
+                f"p99 {stats['p99_ms']:.1f} ms, {stats['queries_per_operation']:.1f} queries/op"
+            )
+            before = (baseline or {}).get("steps", {}).get(step)
+            if before:
+                line += (
+                    f" (p95 {stats['p95_ms'] - before['p95_ms']:+.1f} ms, "
+                    f"{stats['queries_per_operation'] - before['queries_per_operation']:+.1f} queries/op)"
+                )
+            self.stdout.write(line)
+        if results["ranking_batch_sizes"]:
+            self.stdout.write(
+                f"ranking batches: {results['ranking_batch_sizes']['mean']:.1f} "
+                f"messages on average, {results['ranking_batch_sizes']['max']} at most"
+            )
+        if results["errors"]:
+            self.stdout.write(self.style.WARNING(f"Errors: {results['errors']}"))
@@ -0,0 +1,103 @@
+"""
+Management command to compare the sync and async signup views under concurrency.
+
+Both views are called the way the ASGI handler calls them: every request gets
+its own thread sensitive context, the sync view runs in it through sync_to_async,
+the async view is awaited on the event loop. Signups go to the configured
+database, the benchmark users and the verification emails they queued in the
+outbox are deleted afterwards.
+
+Usage:
+    python manage.py benchmark_signup --requests 500 --concurrency 100
+"""
+
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncRequestFactory
+
+from core.async_views import AsyncAuthenticationView
+from core.models import User, OutboxMessage
+from core.views import AuthenticationView
+
+
+class Command(BaseCommand):
+    """Measures signup throughput of the sync and async views."""
+
+    help = (
+        "Compares the sync and async signup views under concurrency. Stop the "
+        "outbox dispatcher first, or it publishes the verification emails of the "
+        "benchmark users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=100)
+
+    def handle(self, *args, **options):
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        modes = [
+            ("sync", sync_to_async(AuthenticationView.as_view())),
+            ("async", AsyncAuthenticationView.as_view()),
+        ]
+
+        try:
+            for mode, view in modes:
+                elapsed, latencies, statuses = asyncio.run(
+                    self.run(view, f"{prefix}-{mode}", options)
+                )
+                latencies.sort()
+                count = len(latencies)
+                self.stdout.write(
+                    f"{mode}: {count / elapsed:.1f} signups/s, "
+                    f"p50 {latencies[count // 2] * 1000:.1f} ms, "
+                    f"p95 {latencies[int(count * 0.95)] * 1000:.1f} ms, "
+                    f"statuses {dict(statuses)}"
+                )
+        finally:
+            OutboxMessage.objects.filter(args__icontains=prefix).delete()
+            deleted, _ = User.objects.filter(email__startswith=prefix).delete()
+            self.stdout.write(f"Deleted {deleted} benchmark rows.")
+
+    async def run(self, view, prefix, options):
+        """
+        Send the signups of one view, at most `concurrency` at a time.
+
+        Args:
+            view (callable): The async callable of the view.
+            prefix (str): Prefix of the benchmark emails.
+            options (dict): The command options.
+
+        Returns:
+            tuple: Elapsed seconds, the latency of each request and a Counter of statuses.
+        """
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        latencies = []
+        statuses = Counter()
+
+        async def signup(number):
+            request = factory.post(
+                "/api/auth/",
+                {"name": "Benchmark", "email": f"{prefix}-{number}@example.com"},
+                content_type="application/json",
+            )
+            async with semaphore, ThreadSensitiveContext():
+                start = time.perf_counter()
+                try:
+                    status = (await view(request)).status_code
+                except Exception:
+                    # The ASGI handler answers an unhandled error with a 500
+                    status = 500
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+                await sync_to_async(connections.close_all)()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(signup(number) for number in range(options["requests"])))
+        return time.perf_counter() - start, latencies, statuses
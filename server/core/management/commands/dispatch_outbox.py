@@ -0,0 +1,56 @@
+"""
+Management command to publish the tasks queued in the outbox to the broker.
+
+Runs until stopped, publishing batches as fast as they fill and polling the
+outbox when it is empty. Several dispatchers can run side by side. Use --once to
+drain the outbox and exit.
+
+Usage:
+    python manage.py dispatch_outbox
+    python manage.py dispatch_outbox --once
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.outbox import dispatch_outbox
+
+
+class Command(BaseCommand):
+    """Publishes the outbox to the broker."""
+
+    help = "Publishes the tasks queued in the outbox to the broker in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument(
+            "--once", action="store_true", help="Drain the outbox once and exit."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        total = 0
+        while True:
+            close_old_connections()
+            try:
+                sent = dispatch_outbox(batch_size)
+            except Exception as error:
+                if options["once"]:
+                    raise CommandError(f"Publishing failed: {error}")
+                self.stderr.write(f"Publishing failed, retrying: {error}")
+                time.sleep(settings.OUTBOX_RETRY_INTERVAL)
+                continue
+
+            total += sent
+            if sent < batch_size:
+                if options["once"]:
+                    break
+                time.sleep(settings.OUTBOX_POLL_INTERVAL)
+
+        self.stdout.write(self.style.SUCCESS(f"Published {total} tasks."))
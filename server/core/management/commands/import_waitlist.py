@@ -0,0 +1,93 @@
+"""
+Management command to import an existing waitlist in bulk.
+
+Reads a CSV or NDJSON file with an `email` and a `name` per row, and optionally
+`referrer` (the email of the user who referred them), `is_verified` and
+`is_deleted`. Users,
+referrals and waitlist entries are inserted in chunks, see core.imports. Stop the
+ranking actor before importing, it rebuilds its ranking index from the imported
+rows when started again.
+
+Usage:
+    python manage.py import_waitlist users.csv
+    python manage.py import_waitlist users.ndjson.gz --chunk-size 10000
+    cat users.ndjson | python manage.py import_waitlist - --format ndjson
+"""
+
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import IMPORT_FORMATS, WaitlistImport, read_rows
+
+
+class Command(BaseCommand):
+    """Imports an existing waitlist in bulk."""
+
+    help = "Imports users, referrals and waitlist entries from a CSV or NDJSON file in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, - for standard input. May be gzipped.")
+        parser.add_argument(
+            "--format",
+            choices=IMPORT_FORMATS,
+            help="Format of the file, guessed from its name when omitted.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        import_format = options["format"]
+        if import_format is None:
+            name = path.removesuffix(".gz")
+            import_format = "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+
+        if path == "-":
+            stream = sys.stdin
+        elif path.endswith(".gz"):
+            stream = gzip.open(path, "rt", encoding="utf-8", newline="")
+        else:
+            try:
+                stream = open(path, encoding="utf-8", newline="")
+            except OSError as error:
+                raise CommandError(f"Cannot read {path}: {error}")
+
+        waitlist_import = WaitlistImport(options["chunk_size"])
+        start = time.perf_counter()
+        try:
+            users = self._step(
+                "users", lambda: waitlist_import.add_users(read_rows(stream, import_format))
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        referrals = self._step("referrals", waitlist_import.add_referrals)
+        entries = self._step("waitlist entries", waitlist_import.add_waitlist_entries)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"Skipped {waitlist_import.skipped} rows (invalid, repeated or existing emails) "
+            f"and {waitlist_import.skipped_referrals} referrals (unknown referrers)."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {waitlist_import.rows} rows in {elapsed:.2f}s "
+                f"({waitlist_import.rows / max(elapsed, 1e-9):.0f} rows/s): {users} users, "
+                f"{referrals} referrals, {entries} waitlist entries."
+            )
+        )
+
+    def _step(self, name, run):
+        """Run an import step and report its rate."""
+        start = time.perf_counter()
+        count = run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Inserted {count} {name} in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f}/s)."
+        )
+        return count
@@ -0,0 +1,75 @@
+"""
+Management command to show how many tasks are waiting in each queue.
+
+Lists the broker queues of server/celery.py with their waiting messages and
+consumers, and the tasks still waiting in the outbox. A growing email queue means
+more email workers are needed before verification emails slow down.
+
+Usage:
+    python manage.py queue_depth
+    python manage.py queue_depth --watch 5
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from kombu.exceptions import ChannelError
+
+from core.models import OutboxMessage
+from server.celery import app, QUEUES
+
+
+class Command(BaseCommand):
+    """Shows the depth of the task queues."""
+
+    help = "Shows the waiting tasks and consumers of each queue, and the outbox backlog."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--watch",
+            type=float,
+            help="Print the depths again every given number of seconds.",
+        )
+
+    def depths(self, connection):
+        """
+        Read the depth of every queue.
+
+        Args:
+            connection (Connection): The broker connection.
+
+        Returns:
+            list: (queue, waiting messages, consumers) rows, None for a queue not declared yet.
+        """
+        rows = []
+        for name in QUEUES:
+            try:
+                _, messages, consumers = connection.default_channel.queue_declare(
+                    queue=name, passive=True
+                )
+            except ChannelError:
+                # The broker closes the channel of a failed passive declare
+                connection.release()
+                connection.connect()
+                messages = consumers = None
+            rows.append((name, messages, consumers))
+        return rows
+
+    def handle(self, *args, **options):
+        with app.connection_for_read() as connection:
+            while True:
+                for name, messages, consumers in self.depths(connection):
+                    if messages is None:
+                        self.stdout.write(f"{name:<12} not declared yet")
+                    else:
+                        self.stdout.write(
+                            f"{name:<12} {messages:>8} waiting {consumers:>4} consumers"
+                        )
+                self.stdout.write(
+                    f"{'outbox':<12} {OutboxMessage.objects.count():>8} waiting"
+                )
+
+                if not options["watch"]:
+                    break
+                time.sleep(options["watch"])
+                self.stdout.write("")
@@ -0,0 +1,47 @@
+"""
+Management command to rebuild the leaderboard read model or check it for drift.
+
+Usage:
+    python manage.py rebuild_leaderboard
+    python manage.py rebuild_leaderboard --check
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.leaderboard import find_leaderboard_drift, rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    """Rebuilds the LeaderboardEntry table from the Waitlist and User tables."""
+
+    help = "Rebuilds the leaderboard read model from scratch, or checks it for drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report drift between the leaderboard and the waitlist.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows read or written per round-trip.",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            drift = find_leaderboard_drift(options["batch_size"])
+            for kind, user_ids in drift.items():
+                self.stdout.write(f"{kind}: {len(user_ids)}")
+                if user_ids:
+                    self.stdout.write(f"  user ids: {user_ids[:20]}")
+
+            if any(drift.values()):
+                raise CommandError("The leaderboard has drifted from the waitlist.")
+
+            self.stdout.write(self.style.SUCCESS("The leaderboard is in sync."))
+            return
+
+        count = rebuild_leaderboard(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the leaderboard with {count} entries."))
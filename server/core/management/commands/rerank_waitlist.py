@@ -0,0 +1,48 @@
+"""
+Management command to recompute every waitlist position in one set-based pass.
+
+By default the re-rank is queued for the ranking actor, which moves its
+in-memory ranking index along. Use --now to run it in this process, only while
+the ranking actor is stopped, as its index would not follow.
+
+Usage:
+    python manage.py rerank_waitlist
+    python manage.py rerank_waitlist --now
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.ranking import rerank_positions
+from core.tasks import rerank_waitlist
+
+
+class Command(BaseCommand):
+    """Recomputes every waitlist position."""
+
+    help = "Recomputes every waitlist position from referral counts in one set-based pass."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--now",
+            action="store_true",
+            help="Run in this process instead of the ranking actor, only while the actor is stopped.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["now"]:
+            result = rerank_waitlist.delay()
+            self.stdout.write(f"Queued the re-rank as task {result.id}.")
+            return
+
+        start = time.perf_counter()
+        changed = rerank_positions(
+            settings.WAITLIST_FIRST_POSITION, settings.RANKING_BATCH_SIZE
+        )
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {changed} entries in {elapsed:.2f}s.")
+        )
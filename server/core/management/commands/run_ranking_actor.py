@@ -0,0 +1,48 @@
+"""
+Management command to run the single writer of waitlist positions.
+
+Consumes the ranking queue in micro-batches, see core.ranking_actor. Run exactly
+one actor: it is the only process allowed to move positions.
+
+Usage:
+    python manage.py run_ranking_actor
+    python manage.py run_ranking_actor --batch-size 500 --batch-window 0.05
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ranking_actor import RankingActor
+
+
+class Command(BaseCommand):
+    """Runs the ranking actor."""
+
+    help = "Applies the ranking queue in micro-batches, as the single writer of waitlist positions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.RANKING_ACTOR_BATCH_SIZE
+        )
+        parser.add_argument(
+            "--batch-window",
+            type=float,
+            default=settings.RANKING_ACTOR_BATCH_WINDOW,
+            help="Seconds spent collecting a batch after its first task.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        actor = RankingActor(options["batch_size"], options["batch_window"])
+        self.stdout.write("Ranking actor started, waiting for ranking tasks.")
+        try:
+            actor.run()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Applied {actor.messages} ranking tasks in {actor.batches} batches."
+            )
+        )
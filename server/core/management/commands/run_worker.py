@@ -0,0 +1,46 @@
+"""
+Management command to run the Celery workers of one queue.
+
+The number of worker processes comes from the WORKER_CONCURRENCY setting. The
+ranking queue has no workers, it is consumed by the ranking actor.
+
+Usage:
+    python manage.py run_worker email
+    python manage.py run_worker bulk_email --concurrency 4
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from server.celery import app, RANKING_QUEUE
+
+
+class Command(BaseCommand):
+    """Runs the Celery workers of one queue."""
+
+    help = "Runs the Celery workers of one queue with the concurrency set in WORKER_CONCURRENCY."
+
+    def add_arguments(self, parser):
+        parser.add_argument("queue", choices=sorted(settings.WORKER_CONCURRENCY))
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Worker processes, overriding WORKER_CONCURRENCY.",
+        )
+        parser.add_argument("--loglevel", default="INFO")
+
+    def handle(self, *args, **options):
+        queue = options["queue"]
+        if queue == RANKING_QUEUE:
+            raise CommandError("The ranking queue is consumed by run_ranking_actor.")
+
+        concurrency = options["concurrency"] or settings.WORKER_CONCURRENCY[queue]
+        app.worker_main(
+            [
+                "worker",
+                f"--queues={queue}",
+                f"--concurrency={concurrency}",
+                f"--hostname={queue}@%h",
+                f"--loglevel={options['loglevel']}",
+            ]
+        )
@@ -0,0 +1,81 @@
+"""
+Management command to insert a synthetic waitlist for benchmarks.
+
+Generates users with power-law referral counts, referral chains, unverified and
+soft-deleted users, see core.seeding. The same seed always generates the same
+dataset. Stop the ranking actor while seeding, as for an import.
+
+Usage:
+    python manage.py seed_waitlist --users 100000
+    python manage.py seed_waitlist --users 1000000 --seed 7 --referral-rate 0.4 --chain-rate 0.2
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.seeding import seed_waitlist
+
+
+class Command(BaseCommand):
+    """Inserts a synthetic waitlist."""
+
+    help = "Inserts a reproducible synthetic waitlist with realistic referral graphs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--referral-rate",
+            type=float,
+            default=0.6,
+            help="Share of users signing up with a referral.",
+        )
+        parser.add_argument(
+            "--chain-rate",
+            type=float,
+            default=0.1,
+            help="Share of referrals continuing the latest referral chain.",
+        )
+        parser.add_argument(
+            "--verification-rate",
+            type=float,
+            default=0.8,
+            help="Share of users who verified their email.",
+        )
+        parser.add_argument(
+            "--deletion-rate",
+            type=float,
+            default=0.02,
+            help="Share of soft-deleted users.",
+        )
+        parser.add_argument(
+            "--prefix", default="seed", help="Prefix of the generated emails."
+        )
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--users and --chunk-size must be at least 1.")
+        rates = ("referral_rate", "chain_rate", "verification_rate", "deletion_rate")
+        if not all(0 <= options[rate] <= 1 for rate in rates):
+            raise CommandError("Rates must be between 0 and 1.")
+
+        start = time.perf_counter()
+        counts = seed_waitlist(
+            options["users"],
+            options["seed"],
+            options["chunk_size"],
+            prefix=options["prefix"],
+            **{rate: options[rate] for rate in rates},
+        )
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Inserted {counts['users']} users, {counts['referrals']} referrals, "
+                f"{counts['waitlist_entries']} waitlist entries and "
+                f"{counts['verifications']} verifications in {elapsed:.2f}s "
+                f"({options['users'] / elapsed:.0f} users/s)."
+            )
+        )
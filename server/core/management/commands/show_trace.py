@@ -0,0 +1,111 @@
+"""
+Management command to print the traces written by core.tracing.
+
+Without a trace ID, lists the latest traces with their root span, duration and
+number of spans. With one, prints the trace as a tree: each span with its start
+relative to the trace, its duration and its details. The ID of the trace of a
+request is returned in its X-Trace-Id header.
+
+Usage:
+    python manage.py show_trace
+    python manage.py show_trace 4bf92f3577b34da6a3ce929d0e0e4736
+    python manage.py show_trace --file /var/log/waitlist/traces.jsonl --limit 50
+"""
+
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+ATTRIBUTE_LENGTH = 100  # Characters of an attribute printed, e.g. of a SQL statement
+
+
+class Command(BaseCommand):
+    """Prints the traces written by core.tracing."""
+
+    help = "Lists the latest traces, or prints one trace as a tree of spans."
+
+    def add_arguments(self, parser):
+        parser.add_argument("trace_id", nargs="?")
+        parser.add_argument(
+            "--file", help="JSON lines file of the spans, TRACE_EXPORT by default."
+        )
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Number of traces listed."
+        )
+
+    def handle(self, *args, **options):
+        path = options["file"] or settings.TRACE_EXPORT
+        if not path or path == "-":
+            raise CommandError("Set TRACE_EXPORT to a file, or pass --file.")
+
+        try:
+            spans = list(self._read(path, options["trace_id"]))
+        except OSError as error:
+            raise CommandError(f"Cannot read {path}: {error}")
+
+        if options["trace_id"]:
+            if not spans:
+                raise CommandError(f"No spans of trace {options['trace_id']} in {path}.")
+            self._print_tree(spans)
+        else:
+            self._print_traces(spans, options["limit"])
+
+    @staticmethod
+    def _read(path, trace_id):
+        with open(path) as lines:
+            for line in lines:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # Cut short by a crashed process
+                if trace_id is None or span["trace_id"] == trace_id:
+                    yield span
+
+    def _print_traces(self, spans, limit):
+        traces = defaultdict(list)
+        for span in spans:
+            traces[span["trace_id"]].append(span)
+
+        latest = sorted(
+            traces.items(), key=lambda item: min(span["start"] for span in item[1])
+        )[-limit:]
+        for trace_id, trace_spans in latest:
+            root = next(
+                (span for span in trace_spans if span["parent_id"] is None),
+                min(trace_spans, key=lambda span: span["start"]),
+            )
+            self.stdout.write(
+                f"{trace_id}  {root['duration_ms']:>10.1f}ms  "
+                f"{len(trace_spans):>4} spans  {root['name']}"
+            )
+
+    def _print_tree(self, spans):
+        span_ids = {span["span_id"] for span in spans}
+        children = defaultdict(list)
+        for span in spans:
+            # Spans whose parent was not exported (e.g. sampled out) are printed as roots
+            parent_id = span["parent_id"] if span["parent_id"] in span_ids else None
+            children[parent_id].append(span)
+        for siblings in children.values():
+            siblings.sort(key=lambda span: span["start"])
+
+        trace_start = min(span["start"] for span in spans)
+
+        def print_span(span, depth):
+            attributes = " ".join(
+                f"{key}={str(value)[:ATTRIBUTE_LENGTH]}"
+                for key, value in span["attributes"].items()
+            )
+            error = f"  ERROR {span['error']}" if "error" in span else ""
+            self.stdout.write(
+                f"+{(span['start'] - trace_start) * 1000:>9.1f}ms "
+                f"{span['duration_ms']:>9.1f}ms  {'  ' * depth}{span['name']}"
+                f"  [{span['process']}] {attributes}{error}"
+            )
+            for child in children[span["span_id"]]:
+                print_span(child, depth + 1)
+
+        for root in children[None]:
+            print_span(root, 0)
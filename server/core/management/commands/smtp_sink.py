@@ -0,0 +1,50 @@
+"""
+Management command to run a local SMTP server that discards every message.
+
+Point EMAIL_HOST, EMAIL_PORT and EMAIL_USE_TLS=False at it to run the workers
+without sending real emails.
+
+Usage:
+    python manage.py smtp_sink --port 1025 --connect-delay 0.2
+"""
+
+from django.core.management.base import BaseCommand
+
+from core.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    """Runs a local SMTP sink."""
+
+    help = "Runs a local SMTP server that accepts and discards every message."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=1025)
+        parser.add_argument(
+            "--connect-delay",
+            type=float,
+            default=0,
+            help="Seconds waited before greeting a connection, simulating TLS and login.",
+        )
+        parser.add_argument(
+            "--message-delay",
+            type=float,
+            default=0,
+            help="Seconds waited before accepting a message.",
+        )
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(
+            (options["host"], options["port"]),
+            options["connect_delay"],
+            options["message_delay"],
+        )
+        self.stdout.write(f"SMTP sink listening on {options['host']}:{options['port']}")
+
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f"Accepted {sink.messages} messages.")
+        finally:
+            sink.server_close()
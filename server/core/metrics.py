@@ -0,0 +1,529 @@
+"""
+This module collects Prometheus metrics of the requests, tasks and emails of every process.
+
+Each process counts in memory: an observation is a bucket increment under a
+lock, and queries are counted by an execute wrapper installed on every database
+connection, which adds them to the request or task measured in the current
+context. Every METRICS_FLUSH_INTERVAL seconds, and when the process exits, a
+process that observed anything writes its totals to a file of its own in
+METRICS_DIR, which the server and the workers share. `/metrics` sums the files
+of every process, so the web processes, the Celery workers, the ranking actor
+and the outbox dispatcher are scraped through one endpoint. The files of exited
+processes of the same host are merged into the totals of the process serving
+`/metrics`, so they neither pile up nor make the counters go back. Without
+METRICS_DIR, only the metrics of the process serving `/metrics` are exposed.
+
+Tasks are stamped with the time they were queued (the ENQUEUED_AT_HEADER header,
+set from the outbox row when there is one), so the time they waited for a worker
+is measured as well.
+
+Classes:
+    Counter: A counter, by label values.
+    Histogram: A histogram of observations, by label values.
+    QueryStats: The number and duration of the queries of a request or task.
+    MetricsMiddleware: Measures the latency and the queries of every request.
+
+Functions:
+- track_queries(): Count the queries run in the current context.
+- observe_queue_wait(task_name, enqueued_at): Record the time a task waited in the queue.
+- flush(): Write the metrics of this process to METRICS_DIR.
+- render_metrics(): Return the metrics of every process in the Prometheus text format.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import (
+    before_task_publish,
+    task_prerun,
+    task_postrun,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+ENQUEUED_AT_HEADER = "enqueued_at"  # Epoch seconds a task was queued at
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_metrics = {}  # Name -> metric, in definition order
+_lock = threading.Lock()
+_flush_timer = None
+_flush_pid = None
+
+
+class Counter:
+    """
+    A counter, by label values.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple, optional): The names of the labels. Defaults to ().
+    """
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics[name] = self
+
+    def inc(self, *labels, amount=1):
+        """Add `amount` to the counter of the label values."""
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+        _schedule_flush()
+
+    def _merge(self, values, labels, value):
+        values[labels] = values.get(labels, 0) + value
+
+    def _lines(self, labels, value):
+        yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """
+    A histogram of observations, by label values.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple, optional): The names of the labels. Defaults to ().
+        buckets (tuple, optional): The upper bounds of the buckets, sorted.
+            Defaults to DURATION_BUCKETS.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Label values -> the count of each bucket, then of +Inf, then the sum
+        self._values = {}
+        _metrics[name] = self
+
+    def observe(self, value, *labels):
+        """Record an observation for the label values."""
+        bucket = bisect_left(self.buckets, value)
+        with _lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+        _schedule_flush()
+
+    @contextmanager
+    def time(self, *labels):
+        """Record the seconds spent in the block for the label values."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _merge(self, values, labels, counts):
+        if len(counts) != len(self.buckets) + 2:
+            return  # Written by a process with other buckets
+        total = values.setdefault(labels, [0] * len(counts))
+        for index, count in enumerate(counts):
+            total[index] += count
+
+    def _lines(self, labels, counts):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            cumulative += count
+            bucket_labels = _labels((*self.labelnames, "le"), (*labels, _number(bound)))
+            yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(counts[-1])}"
+        yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Requests served, by route, method and status class.",
+    ("route", "method", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Seconds until the response is returned, streamed bodies excluded.",
+    ("route", "method"),
+)
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_queries", "Database queries per request.", ("route",), COUNT_BUCKETS
+)
+HTTP_REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Seconds spent in queries per request.", ("route",)
+)
+TASKS = Counter("celery_tasks_total", "Tasks run, by task and final state.", ("task", "state"))
+TASK_DURATION = Histogram("celery_task_duration_seconds", "Seconds a task ran.", ("task",))
+TASK_QUERIES = Histogram(
+    "celery_task_queries", "Database queries per task.", ("task",), COUNT_BUCKETS
+)
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds",
+    "Seconds between queueing a task and starting it.",
+    ("task",),
+    WAIT_BUCKETS,
+)
+RANKING_BATCH_SIZE = Histogram(
+    "ranking_batch_size", "Ranking tasks applied per batch.", buckets=COUNT_BUCKETS
+)
+RANKING_BATCH_DURATION = Histogram(
+    "ranking_batch_duration_seconds", "Seconds the ranking actor spent on a batch."
+)
+RANKING_BATCH_QUERIES = Histogram(
+    "ranking_batch_queries", "Database queries per ranking batch.", buckets=COUNT_BUCKETS
+)
+EMAILS = Counter("emails_total", "Emails sent, by outcome.", ("status",))
+EMAIL_SEND_DURATION = Histogram(
+    "email_send_duration_seconds", "Seconds the email backend took to send one email."
+)
+EMAIL_CONNECT_DURATION = Histogram(
+    "email_connect_duration_seconds", "Seconds taken to open an email backend connection."
+)
+
+
+class QueryStats:
+    """The number and duration of the queries of a request or task."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_current_queries = contextvars.ContextVar("metrics_queries", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+
+
+def _install_query_recorder(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    """Count the queries of every new database connection."""
+    _install_query_recorder(connection)
+
+
+@contextmanager
+def track_queries():
+    """
+    Count the queries run in the current context, async views' threads included.
+
+    Yields:
+        QueryStats: The queries run so far.
+    """
+    # The connection of this thread may have been opened before this module was loaded
+    _install_query_recorder(connection)
+    stats = QueryStats()
+    token = _current_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_queries.reset(token)
+
+
+class MetricsMiddleware:
+    """
+    Measures the latency and the queries of every request, by route pattern.
+
+    Must come first in MIDDLEWARE, so the other middleware are measured too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        with track_queries() as queries:
+            response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with track_queries() as queries:
+            response = await self.get_response(request)
+        self._observe(request, response, time.perf_counter() - start, queries)
+        return response
+
+    @staticmethod
+    def _observe(request, response, seconds, queries):
+        match = getattr(request, "resolver_match", None)
+        # The route pattern rather than the path, so IDs and codes do not create series
+        route = match.route if match is not None else "<unmatched>"
+        HTTP_REQUESTS.inc(route, request.method, f"{response.status_code // 100}xx")
+        HTTP_REQUEST_DURATION.observe(seconds, route, request.method)
+        HTTP_REQUEST_QUERIES.observe(queries.count, route)
+        HTTP_REQUEST_DB_DURATION.observe(queries.seconds, route)
+
+
+def observe_queue_wait(task_name, enqueued_at):
+    """
+    Record the time a task waited in the queue.
+
+    Args:
+        task_name (str): The name of the task.
+        enqueued_at (float): The value of its ENQUEUED_AT_HEADER header, None when
+            the task was not stamped (e.g. queued by an older release).
+    """
+    if enqueued_at is not None:
+        TASK_QUEUE_WAIT.observe(max(time.time() - float(enqueued_at), 0), task_name)
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    """Stamp the tasks that were not queued through the outbox with the time they are published."""
+    if headers is not None:
+        headers.setdefault(ENQUEUED_AT_HEADER, time.time())
+
+
+_running_tasks = {}  # Task ID -> (start, context token, QueryStats) of the tasks of this process
+
+
+@task_prerun.connect
+def start_task(task_id=None, task=None, **kwargs):
+    """Record the queue wait of a task and start measuring it."""
+    observe_queue_wait(task.name, task.request.get(ENQUEUED_AT_HEADER))
+    stats = QueryStats()
+    _install_query_recorder(connection)
+    _running_tasks[task_id] = (
+        time.perf_counter(),
+        _current_queries.set(stats),
+        stats,
+    )
+
+
+@task_postrun.connect
+def finish_task(task_id=None, task=None, state=None, **kwargs):
+    """Record the duration, the queries and the final state of a task."""
+    running = _running_tasks.pop(task_id, None)
+    if running is None:
+        return
+
+    start, token, stats = running
+    try:
+        _current_queries.reset(token)
+    except ValueError:
+        _current_queries.set(None)  # Started in another context
+    TASKS.inc(task.name, (state or "unknown").lower())
+    TASK_DURATION.observe(time.perf_counter() - start, task.name)
+    TASK_QUERIES.observe(stats.count, task.name)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _snapshot():
+    """Return the values of every metric of this process, JSON serializable."""
+    with _lock:
+        return {
+            name: [[list(labels), value] for labels, value in metric._values.items()]
+            for name, metric in _metrics.items()
+            if metric._values
+        }
+
+
+def _process_file():
+    return Path(settings.METRICS_DIR) / f"{socket.gethostname()}-{os.getpid()}.json"
+
+
+def _merge_snapshot(values, snapshot):
+    """Add a snapshot to `values`, by metric name and label values."""
+    for name, samples in snapshot.items():
+        if name in _metrics:
+            for labels, value in samples:
+                _metrics[name]._merge(values[name], tuple(labels), value)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running as another user
+    return True
+
+
+def _retire_exited_processes(directory):
+    """Merge the files of the exited processes of this host into the totals of this process."""
+    if os.name == "nt":
+        return  # os.kill would terminate the process instead of probing it
+
+    hostname = socket.gethostname()
+    claimed = []
+    for path in directory.glob(f"{hostname}-*.json"):
+        pid = path.stem[len(hostname) + 1 :]
+        if not pid.isdigit() or int(pid) == os.getpid() or _is_running(int(pid)):
+            continue
+
+        # Renaming claims the file, so no two processes merge it
+        claim = path.with_suffix(f".retired-{os.getpid()}")
+        try:
+            os.replace(path, claim)
+        except FileNotFoundError:
+            continue  # Claimed by another process
+        claimed.append(claim)
+
+        try:
+            snapshot = json.loads(claim.read_text())
+        except (OSError, ValueError):
+            continue  # Written by another release
+        with _lock:
+            totals = {name: metric._values for name, metric in _metrics.items()}
+            _merge_snapshot(totals, snapshot)
+
+    if claimed:
+        # The totals are written before the claimed files are removed, and a
+        # claimed file left behind by a crash is never read again
+        flush()
+        for claim in claimed:
+            claim.unlink(missing_ok=True)
+
+
+def flush():
+    """Write the metrics of this process to its file in METRICS_DIR, if set and not empty."""
+    global _flush_timer
+
+    with _lock:
+        _flush_timer = None
+    if not settings.METRICS_DIR:
+        return
+
+    snapshot = _snapshot()
+    if not snapshot:
+        return  # Nothing observed yet, a file would only add up to nothing
+
+    path = _process_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(snapshot))
+    # Readers see the previous totals or the new ones, never a partial file
+    os.replace(temporary, path)
+
+
+def _schedule_flush():
+    global _flush_timer, _flush_pid
+
+    if _flush_timer is not None and _flush_pid == os.getpid():
+        return
+    with _lock:
+        # A timer inherited from the parent of a forked process never fires in it
+        if _flush_timer is None or _flush_pid != os.getpid():
+            _flush_timer = threading.Timer(settings.METRICS_FLUSH_INTERVAL, flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+            _flush_pid = os.getpid()
+
+
+@worker_process_init.connect
+def reset_forked_metrics(**kwargs):
+    """Drop the values a pool process inherited from the worker, which counts them itself."""
+    with _lock:
+        for metric in _metrics.values():
+            metric._values.clear()
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def flush_on_shutdown(**kwargs):
+    """Write the metrics of the worker before it exits."""
+    flush()
+
+
+atexit.register(flush)
+
+
+def render_metrics():
+    """
+    Return the metrics of every process in the Prometheus text format.
+
+    Returns:
+        str: The exposition of every metric, summed over the processes.
+    """
+    flush()
+    values = {name: {} for name in _metrics}
+
+    if settings.METRICS_DIR:
+        directory = Path(settings.METRICS_DIR)
+        _retire_exited_processes(directory)
+        snapshots = []
+        for path in directory.glob("*.json"):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # Removed or written by another release
+    else:
+        snapshots = [_snapshot()]
+
+    for snapshot in snapshots:
+        _merge_snapshot(values, snapshot)
+
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for labels, value in sorted(values[name].items()):
+            lines.extend(metric._lines(labels, value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_leaderboard(apps, schema_editor):
+    Waitlist = apps.get_model('core', 'Waitlist')
+    LeaderboardEntry = apps.get_model('core', 'LeaderboardEntry')
+
+    rows = Waitlist.objects.values_list(
+        'user_id', 'position', 'user__name', 'user__referral_count'
+    ).iterator(chunk_size=1000)
+    entries = [
+        LeaderboardEntry(
+            user_id=user_id, position=position, name=name, referral_count=referral_count
+        )
+        for user_id, position, name, referral_count in rows
+    ]
+    LeaderboardEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_accesscode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.user')),
+                ('position', models.IntegerField(unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('referral_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'leaderboard_entry',
+            },
+        ),
+        migrations.RunPython(populate_leaderboard, migrations.RunPython.noop),
+    ]
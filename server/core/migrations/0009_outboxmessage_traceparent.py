@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='traceparent',
+            field=models.CharField(blank=True, default='', max_length=55),
+        ),
+    ]
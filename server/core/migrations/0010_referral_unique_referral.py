@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:01
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicate_referrals(apps, schema_editor):
+    Referral = apps.get_model('core', 'Referral')
+    User = apps.get_model('core', 'User')
+
+    # Referrals saved twice by a redelivered task were counted twice as well
+    duplicates = list(
+        Referral.objects.values('referrer_id', 'referee_id')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        Referral.objects.filter(
+            referrer_id=row['referrer_id'], referee_id=row['referee_id']
+        ).exclude(id=row['first_id']).delete()
+        User.objects.filter(id=row['referrer_id']).update(
+            referral_count=F('referral_count') - (row['count'] - 1)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_outboxmessage_traceparent'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_referrals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='referral',
+            constraint=models.UniqueConstraint(fields=('referrer', 'referee'), name='unique_referral'),
+        ),
+    ]
@@ -7,10 +7,13 @@ Classes:
     Referral: Model for storing user referrals.
     Verification: Model for storing user verification details.
     AccessCode: Model for storing access codes.
+    LeaderboardEntry: Model for storing the denormalized global waitlist.
+    Sequence: Model for storing named counters.
+    WinnerSelection: Model for storing winner selection jobs.
+    OutboxMessage: Model for storing tasks waiting to be sent to the broker.
 """
 
 from django.db import models
-from django.utils.crypto import get_random_string
 
 
 class User(models.Model):
@@ -45,12 +48,9 @@ class User(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.referral_code:
-            random_code = get_random_string(length=8)
+            from .codes import generate_code
 
-            while User.objects.filter(referral_code=random_code).exists():
-                random_code = get_random_string(length=8)
-
-            self.referral_code = random_code
+            self.referral_code = generate_code("referral")
         super().save(*args, **kwargs)
 
     class Meta:
@@ -103,6 +103,12 @@ class Referral(models.Model):
 
     class Meta:
         db_table = "referral"
+        # A redelivered create_referrals task must not count the referral twice
+        constraints = [
+            models.UniqueConstraint(
+                fields=["referrer", "referee"], name="unique_referral"
+            )
+        ]
 
 
 class Verification(models.Model):
@@ -153,3 +159,137 @@ class AccessCode(models.Model):
 
     class Meta:
         db_table = "access_code"
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Model for storing the denormalized global waitlist.
+
+    A read model of Waitlist joined with User, kept in sync by the waitlist
+    tasks so that the global waitlist is served with a single range scan.
+
+    Args:
+        models (django.db.models): Django model class.
+
+    Attributes:
+        user (OneToOneField): User foreign key, also the primary key.
+        position (int): Position of the user in the waitlist.
+        name (str): Name of the user.
+        referral_count (int): Number of referrals made by the user.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    position = models.IntegerField(unique=True)
+    name = models.CharField(max_length=255)
+    referral_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} - {self.position}"
+
+    class Meta:
+        db_table = "leaderboard_entry"
+
+
+class Sequence(models.Model):
+    """
+    Model for storing named counters.
+
+    Values are handed out in blocks by core.sequences.SequenceAllocator, so a row
+    is only locked once per block instead of once per value.
+
+    Args:
+        models (django.db.models): Django model class.
+
+    Attributes:
+        name (str): Name of the counter, also the primary key.
+        next_value (int): The next value that has not been reserved yet.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name} - {self.next_value}"
+
+    class Meta:
+        db_table = "sequence"
+
+
+class WinnerSelection(models.Model):
+    """
+    Model for storing winner selection jobs.
+
+    A job either selects the top `count` users of the waitlist that have no active
+    access code yet, or the waitlist entries listed in `waitlist_ids`. It is run
+    in the background by core.tasks.select_winners, which records its progress here.
+
+    Args:
+        models (django.db.models): Django model class.
+
+    Attributes:
+        count (int): Number of winners to select.
+        waitlist_ids (list): IDs of the selected waitlist entries, empty for the top `count`.
+        status (str): Status of the job.
+        selected (int): Number of winners that received an access code.
+        failed (int): Number of winners skipped because of an error.
+        error (str): The last error raised while selecting winners.
+        created_at (datetime): Date and time of job creation.
+        finished_at (datetime): Date and time the job finished.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    count = models.PositiveIntegerField()
+    waitlist_ids = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    selected = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.count} winners - {self.status}"
+
+    class Meta:
+        db_table = "winner_selection"
+
+
+class OutboxMessage(models.Model):
+    """
+    Model for storing tasks waiting to be sent to the broker.
+
+    Rows are written in the same transaction as the changes the task acts on, and
+    deleted by core.outbox.dispatch_outbox once the task has been published.
+
+    Args:
+        models (django.db.models): Django model class.
+
+    Attributes:
+        id (int): Auto-incremented primary key, the order tasks are published in.
+        task (str): Name of the Celery task.
+        args (list): Positional arguments of the task.
+        traceparent (str): Trace context the task continues, empty when untraced.
+        created_at (datetime): Date and time the task was queued.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    task = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    traceparent = models.CharField(max_length=55, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.task} - {self.created_at}"
+
+    class Meta:
+        db_table = "outbox_message"
@@ -0,0 +1,110 @@
+"""
+This module queues Celery tasks through the OutboxMessage table.
+
+Request handlers do not talk to the broker. They write the task into the outbox
+in the same transaction as the rows it acts on, so a task is only ever sent for
+committed changes and a slow or unavailable broker does not slow down requests.
+The `dispatch_outbox` management command drains the outbox in batches, publishing
+each batch over one pooled broker connection before deleting it.
+
+Delivery is at least once: a dispatcher that dies after publishing a batch but
+before deleting it publishes the batch again.
+
+Each row keeps the trace context of the request that queued it (see
+core.tracing), so the task joins the trace of the request.
+
+Functions:
+- enqueue(task, *args): Queue a task in the outbox of the current transaction.
+- aenqueue(task, *args): Queue a task in the outbox, from async code.
+- dispatch_outbox(batch_size): Publish the oldest queued tasks to the broker.
+"""
+
+from celery import current_app
+from django.db import transaction
+
+from .models import OutboxMessage
+from .metrics import ENQUEUED_AT_HEADER
+from .tracing import current_traceparent, trace
+
+
+def enqueue(task, *args):
+    """
+    Queue a task in the outbox of the current transaction.
+
+    Args:
+        task (Task): The Celery task.
+        *args: The arguments of the task, JSON serializable.
+
+    Returns:
+        OutboxMessage: The queued task.
+    """
+    return OutboxMessage.objects.create(
+        task=task.name, args=list(args), traceparent=current_traceparent()
+    )
+
+
+async def aenqueue(task, *args):
+    """
+    Queue a task in the outbox, from async code.
+
+    Args:
+        task (Task): The Celery task.
+        *args: The arguments of the task, JSON serializable.
+
+    Returns:
+        OutboxMessage: The queued task.
+    """
+    return await OutboxMessage.objects.acreate(
+        task=task.name, args=list(args), traceparent=current_traceparent()
+    )
+
+
+def dispatch_outbox(batch_size=100):
+    """
+    Publish the oldest queued tasks to the broker.
+
+    The batch is locked with SKIP LOCKED, so several dispatchers can drain the
+    outbox side by side. When publishing fails part way, the tasks already
+    published are deleted and the error is raised.
+
+    Args:
+        batch_size (int): Maximum number of tasks published.
+
+    Returns:
+        int: The number of tasks published.
+    """
+    error = None
+    sent = []
+
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True).order_by("id")[
+                :batch_size
+            ]
+        )
+        if not messages:
+            return 0
+
+        try:
+            with current_app.producer_or_acquire() as producer:
+                for message in messages:
+                    # Published inside the trace of the request that queued the
+                    # task, which the task then continues
+                    with trace(
+                        "outbox.publish", message.traceparent, root=False, task=message.task
+                    ):
+                        # The queue wait of a task starts when it was written to the outbox
+                        current_app.tasks[message.task].apply_async(
+                            args=message.args,
+                            producer=producer,
+                            headers={ENQUEUED_AT_HEADER: message.created_at.timestamp()},
+                        )
+                    sent.append(message.id)
+        except Exception as exception:
+            error = exception
+
+        OutboxMessage.objects.filter(id__in=sent).delete()
+
+    if error is not None:
+        raise error
+    return len(sent)
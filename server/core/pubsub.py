@@ -0,0 +1,274 @@
+"""
+This module publishes user events to the streaming connections of the ASGI server.
+
+Events are (channel, payload) pairs, where the channel names the user the event is
+for, e.g. `user:42`. Publishers hand a batch of events to the pub/sub backend once
+their transaction commits, and every subscriber of a channel receives its payloads
+on an asyncio queue.
+
+Two backends are available, chosen with the PUBSUB_BACKEND setting:
+
+- InProcessPubSub delivers events inside the current process. It stands in for a
+  real broker in development and tests, when the tasks run eagerly in the server.
+- BrokerPubSub publishes each batch as one message on a RabbitMQ fanout exchange.
+  Every ASGI process consumes the exchange in a background thread and delivers
+  the events to its own subscribers.
+
+Classes:
+    Subscription: Async iterator over the payloads of one channel.
+    InProcessPubSub: Delivers events to subscribers in the current process.
+    BrokerPubSub: Delivers events to subscribers in every process through RabbitMQ.
+
+Functions:
+    user_channel(user_id): Return the channel of a user.
+    get_pubsub(): Return the process wide pub/sub backend.
+    publish_events(events): Publish events once the current transaction commits.
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from kombu import Connection, Exchange, Queue
+from kombu.pools import producers
+
+
+def user_channel(user_id):
+    """
+    Return the channel of a user.
+
+    Args:
+        user_id (int): The ID of the user.
+
+    Returns:
+        str: The channel name.
+    """
+    return f"user:{int(user_id)}"
+
+
+class Subscription:
+    """
+    Async iterator over the payloads of one channel.
+
+    Args:
+        pubsub (InProcessPubSub): The backend the subscription belongs to.
+        channel (str): The channel subscribed to.
+    """
+
+    def __init__(self, pubsub, channel):
+        self.pubsub = pubsub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.PUBSUB_QUEUE_SIZE)
+
+    def deliver(self, payload):
+        """Queue a payload from any thread, dropping it if the subscriber is too slow."""
+
+        def put():
+            if not self.queue.full():
+                self.queue.put_nowait(payload)
+
+        self.loop.call_soon_threadsafe(put)
+
+    async def get(self, timeout):
+        """
+        Wait for the next payload.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            The payload, or None when the timeout expired.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        """Stop receiving payloads."""
+        self.pubsub.unsubscribe(self)
+
+
+class InProcessPubSub:
+    """Delivers events to subscribers in the current process."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """
+        Subscribe to a channel, from inside a running event loop.
+
+        Args:
+            channel (str): The channel.
+
+        Returns:
+            Subscription: The subscription, to be closed when done.
+        """
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Remove a subscription.
+
+        Args:
+            subscription (Subscription): The subscription.
+        """
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.channel, None)
+
+    def deliver(self, events):
+        """
+        Deliver events to the subscribers of this process.
+
+        Args:
+            events (list): The (channel, payload) pairs.
+        """
+        with self._lock:
+            targets = [
+                (subscription, payload)
+                for channel, payload in events
+                for subscription in self._subscriptions.get(channel, ())
+            ]
+
+        for subscription, payload in targets:
+            subscription.deliver(payload)
+
+    def publish(self, events):
+        """
+        Publish a batch of events.
+
+        Args:
+            events (list): The (channel, payload) pairs.
+        """
+        self.deliver(events)
+
+
+class BrokerPubSub(InProcessPubSub):
+    """
+    Delivers events to subscribers in every process through RabbitMQ.
+
+    Args:
+        url (str, optional): The broker URL. Defaults to the BROKER_URL setting.
+    """
+
+    exchange = Exchange("spothot.events", type="fanout", durable=False)
+
+    def __init__(self, url=None):
+        super().__init__()
+        self.url = url or settings.BROKER_URL
+        self._consumer = None
+
+    def publish(self, events):
+        """
+        Publish a batch of events as one broker message.
+
+        Args:
+            events (list): The (channel, payload) pairs.
+        """
+        with producers[Connection(self.url)].acquire(block=True) as producer:
+            producer.publish(
+                [list(event) for event in events],
+                exchange=self.exchange,
+                declare=[self.exchange],
+                serializer="json",
+                retry=True,
+                retry_policy={"max_retries": 1, "interval_start": 0},
+            )
+
+    def subscribe(self, channel):
+        """
+        Subscribe to a channel, starting the consumer thread of this process if needed.
+
+        Args:
+            channel (str): The channel.
+
+        Returns:
+            Subscription: The subscription, to be closed when done.
+        """
+        with self._lock:
+            if self._consumer is None:
+                self._consumer = threading.Thread(target=self._consume, daemon=True)
+                self._consumer.start()
+        return super().subscribe(channel)
+
+    def _on_message(self, body, message):
+        self.deliver(body)
+        message.ack()
+
+    def _consume(self):
+        queue = Queue(
+            f"spothot.events.{uuid.uuid4().hex}",
+            exchange=self.exchange,
+            exclusive=True,
+            auto_delete=True,
+        )
+
+        while True:
+            try:
+                with Connection(self.url) as connection:
+                    with connection.Consumer(
+                        queue, callbacks=[self._on_message], accept=["json"]
+                    ):
+                        while True:
+                            try:
+                                connection.drain_events(timeout=5)
+                            except TimeoutError:
+                                connection.heartbeat_check()
+            except Exception as error:
+                print(error)
+                time.sleep(1)
+
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+def get_pubsub():
+    """
+    Return the process wide pub/sub backend.
+
+    Returns:
+        InProcessPubSub: The backend named by the PUBSUB_BACKEND setting.
+    """
+    global _pubsub
+
+    with _pubsub_lock:
+        if _pubsub is None:
+            _pubsub = import_string(settings.PUBSUB_BACKEND)()
+    return _pubsub
+
+
+def publish_events(events):
+    """
+    Publish events once the current transaction commits.
+
+    A failure to publish is printed and otherwise ignored, clients pick up the
+    change on their next event or reconnect.
+
+    Args:
+        events (list): The (channel, payload) pairs.
+    """
+    if not events:
+        return
+
+    def publish():
+        try:
+            get_pubsub().publish(events)
+        except Exception as error:
+            print(error)
+
+    transaction.on_commit(publish)
@@ -0,0 +1,542 @@
+"""
+This module maintains an in-memory ranking index over the waitlist.
+
+Every waitlist entry is kept in an indexable skip list ordered by referral count
+(descending) and by the order in which the entry joined the waitlist (ascending),
+so the rank of a user and the users inside a range of ranks are found in O(log n).
+Positions are written back to the Waitlist table in batches, and only for the
+rows whose position actually changed.
+
+The index lives in the memory of the ranking actor (see core.ranking_actor), the
+single process the ranking tasks are routed to. It is rebuilt from the Waitlist
+and User tables when the actor starts and is kept up to date by the batches of
+ranking tasks it applies.
+
+Classes:
+    IndexableSkipList: Ordered container supporting rank and index lookups.
+    RankingIndex: Ranking of the waitlist entries with batched position write-back.
+
+Functions:
+    get_ranking_index(): Return the process wide ranking index, building it on first use.
+    reset_ranking_index(): Drop the process wide ranking index so it is rebuilt on next use.
+    move_waitlist_entries(rows, batch_size): Move waitlist entries to new positions in one transaction.
+    rerank_positions(first_position, batch_size): Recompute every position with one set-based query.
+"""
+
+import random
+import threading
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Waitlist, LeaderboardEntry
+from .leaderboard import move_leaderboard_entries
+from .cache import invalidate_waitlists, bump_revision, GLOBAL_WAITLIST_REVISION
+from .pubsub import publish_events, user_channel
+
+
+class _Node:
+    """Node of an IndexableSkipList."""
+
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, height):
+        self.value = value
+        self.next = [None] * height
+        self.width = [1] * height
+
+
+class IndexableSkipList:
+    """
+    Ordered container supporting rank and index lookups in O(log n).
+
+    Every link stores its width, the number of elements it skips over, so the
+    index of an element can be accumulated while searching for it. Values must
+    be unique and comparable with each other.
+    """
+
+    MAX_HEIGHT = 32
+
+    def __init__(self):
+        self.size = 0
+        self.head = _Node(None, self.MAX_HEIGHT)
+
+    def __len__(self):
+        return self.size
+
+    def _random_height(self):
+        height = 1
+        while height < self.MAX_HEIGHT and random.getrandbits(1):
+            height += 1
+        return height
+
+    def _search(self, value):
+        """
+        Find the rightmost node before `value` on every level.
+
+        Returns:
+            tuple: The chain of nodes and the index (1 based) of each of them.
+        """
+        chain = [None] * self.MAX_HEIGHT
+        indexes = [0] * self.MAX_HEIGHT
+        node = self.head
+        index = 0
+        for level in reversed(range(self.MAX_HEIGHT)):
+            while node.next[level] is not None and node.next[level].value < value:
+                index += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            indexes[level] = index
+        return chain, indexes
+
+    def insert(self, value):
+        """
+        Insert a value.
+
+        Args:
+            value: The value to insert.
+
+        Returns:
+            int: The index the value was inserted at.
+        """
+        chain, indexes = self._search(value)
+        index = indexes[0]
+        node = _Node(value, self._random_height())
+
+        for level in range(len(node.next)):
+            previous = chain[level]
+            skipped = index + 1 - indexes[level]
+            node.next[level] = previous.next[level]
+            node.width[level] = previous.width[level] - skipped + 1
+            previous.next[level] = node
+            previous.width[level] = skipped
+
+        for level in range(len(node.next), self.MAX_HEIGHT):
+            chain[level].width[level] += 1
+
+        self.size += 1
+        return index
+
+    def remove(self, value):
+        """
+        Remove a value.
+
+        Args:
+            value: The value to remove.
+
+        Returns:
+            int: The index the value was removed from.
+
+        Raises:
+            KeyError: If the value is not in the list.
+        """
+        chain, indexes = self._search(value)
+        node = chain[0].next[0]
+        if node is None or node.value != value:
+            raise KeyError(value)
+
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+
+        for level in range(len(node.next), self.MAX_HEIGHT):
+            chain[level].width[level] -= 1
+
+        self.size -= 1
+        return indexes[0]
+
+    def index(self, value):
+        """
+        Return the index of a value.
+
+        Raises:
+            KeyError: If the value is not in the list.
+        """
+        chain, indexes = self._search(value)
+        node = chain[0].next[0]
+        if node is None or node.value != value:
+            raise KeyError(value)
+        return indexes[0]
+
+    def _node_at(self, index):
+        node = self.head
+        remaining = index + 1
+        for level in reversed(range(self.MAX_HEIGHT)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).value
+
+    def slice(self, start, stop):
+        """
+        Return the values with an index in [start, stop).
+
+        Args:
+            start (int): First index, inclusive.
+            stop (int): Last index, exclusive.
+
+        Returns:
+            list: The values in order.
+        """
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+
+        values = []
+        node = self._node_at(start)
+        while node is not None and len(values) < stop - start:
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+    def __iter__(self):
+        node = self.head.next[0]
+        while node is not None:
+            yield node.value
+            node = node.next[0]
+
+
+class RankingIndex:
+    """
+    Ranking of the waitlist entries with batched position write-back.
+
+    Entries are ordered by referral count (descending), then by waitlist entry
+    id (ascending) which is the order users joined the waitlist. The entry at
+    rank r belongs at position `first_position + r`.
+
+    Args:
+        first_position (int): Position of the entry at rank 0.
+        batch_size (int): Number of rows written per UPDATE statement.
+    """
+
+    def __init__(self, first_position, batch_size):
+        self.first_position = first_position
+        self.batch_size = batch_size
+        self._entries = IndexableSkipList()
+        self._keys = {}
+        self._waitlist_ids = {}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._keys
+
+    @staticmethod
+    def make_key(user_id, waitlist_id, referral_count):
+        """Return the sort key of a waitlist entry."""
+        return (-referral_count, waitlist_id, user_id)
+
+    def rebuild(self):
+        """
+        Rebuild the index from the Waitlist and User tables and write back drifted positions.
+
+        Returns:
+            int: The number of positions that were corrected.
+        """
+        self._entries = IndexableSkipList()
+        self._keys = {}
+        self._waitlist_ids = {}
+        self._positions = {}
+
+        rows = Waitlist.objects.values_list(
+            "id", "user_id", "user__referral_count", "position"
+        ).iterator(chunk_size=self.batch_size)
+        for waitlist_id, user_id, referral_count, position in rows:
+            key = self.make_key(user_id, waitlist_id, referral_count)
+            self._entries.insert(key)
+            self._keys[user_id] = key
+            self._waitlist_ids[user_id] = waitlist_id
+            self._positions[user_id] = position
+
+        return self.write_positions(0, len(self))
+
+    def add(self, user_id, waitlist_id, referral_count, position):
+        """
+        Add a new waitlist entry.
+
+        Args:
+            user_id (int): The ID of the user.
+            waitlist_id (int): The ID of the waitlist entry.
+            referral_count (int): The referral count of the user.
+            position (int): The position currently stored for the entry.
+
+        Returns:
+            tuple: The range of ranks [start, stop) whose position may have changed.
+        """
+        key = self.make_key(user_id, waitlist_id, referral_count)
+        rank = self._entries.insert(key)
+        self._keys[user_id] = key
+        self._waitlist_ids[user_id] = waitlist_id
+        self._positions[user_id] = position
+        return rank, len(self)
+
+    def update(self, user_id, referral_count):
+        """
+        Move a user after their referral count changed.
+
+        Args:
+            user_id (int): The ID of the user.
+            referral_count (int): The new referral count of the user.
+
+        Returns:
+            tuple: The range of ranks [start, stop) whose position may have changed.
+        """
+        key = self._keys[user_id]
+        new_key = self.make_key(user_id, self._waitlist_ids[user_id], referral_count)
+        if new_key == key:
+            return 0, 0
+
+        old_rank = self._entries.remove(key)
+        new_rank = self._entries.insert(new_key)
+        self._keys[user_id] = new_key
+        return min(old_rank, new_rank), max(old_rank, new_rank) + 1
+
+    def move(self, user_id, referral_count, position):
+        """
+        Record a move of a user written to the database outside of the index.
+
+        Args:
+            user_id (int): The ID of the user.
+            referral_count (int): The referral count the user was ranked on.
+            position (int): The position written for the user.
+        """
+        self.update(user_id, referral_count)
+        self._positions[user_id] = position
+
+    def remove(self, user_id):
+        """
+        Remove a user from the index.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            tuple: The range of ranks [start, stop) whose position may have changed.
+        """
+        rank = self._entries.remove(self._keys.pop(user_id))
+        del self._waitlist_ids[user_id]
+        del self._positions[user_id]
+        return rank, len(self)
+
+    def rank_of(self, user_id):
+        """Return the rank (0 based) of a user."""
+        return self._entries.index(self._keys[user_id])
+
+    def position_of(self, user_id):
+        """Return the waitlist position of a user."""
+        return self.first_position + self.rank_of(user_id)
+
+    def users_between(self, start, stop):
+        """
+        Return the users with a rank in [start, stop).
+
+        Args:
+            start (int): First rank, inclusive.
+            stop (int): Last rank, exclusive.
+
+        Returns:
+            list: The user IDs in rank order.
+        """
+        return [key[2] for key in self._entries.slice(start, stop)]
+
+    def write_positions(self, start, stop):
+        """
+        Write the positions of the ranks in [start, stop) back to the Waitlist table.
+
+        Only rows whose stored position differs from their rank are written, to
+        both the Waitlist table and the leaderboard read model. They are first
+        moved to negative positions so that the final positions can be assigned
+        in bulk without tripping the unique constraint on `position`. The users
+        whose position changed are sent a `position` event.
+
+        Args:
+            start (int): First rank, inclusive.
+            stop (int): Last rank, exclusive.
+
+        Returns:
+            int: The number of rows written.
+        """
+        changed = {}
+        for rank, user_id in enumerate(self.users_between(start, stop), start):
+            position = self.first_position + rank
+            if self._positions[user_id] != position:
+                changed[user_id] = Waitlist(
+                    id=self._waitlist_ids[user_id], position=position
+                )
+
+        if not changed:
+            return 0
+
+        entries = list(changed.values())
+        with transaction.atomic():
+            for offset in range(0, len(entries), self.batch_size):
+                ids = [entry.id for entry in entries[offset : offset + self.batch_size]]
+                Waitlist.objects.filter(id__in=ids).update(position=-F("position"))
+            Waitlist.objects.bulk_update(
+                entries, ["position"], batch_size=self.batch_size
+            )
+            move_leaderboard_entries(
+                {user_id: entry.position for user_id, entry in changed.items()},
+                self.batch_size,
+            )
+            invalidate_waitlists()
+            publish_events(
+                [
+                    (user_channel(user_id), {"type": "position", "position": entry.position})
+                    for user_id, entry in changed.items()
+                ]
+            )
+
+        for user_id, entry in changed.items():
+            self._positions[user_id] = entry.position
+        return len(entries)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_ranking_index():
+    """
+    Return the process wide ranking index, building it on first use.
+
+    Returns:
+        RankingIndex: The ranking index of this process.
+    """
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            index = RankingIndex(
+                settings.WAITLIST_FIRST_POSITION, settings.RANKING_BATCH_SIZE
+            )
+            index.rebuild()
+            _index = index
+    return _index
+
+
+def reset_ranking_index():
+    """Drop the process wide ranking index so it is rebuilt on next use."""
+    global _index
+
+    with _index_lock:
+        _index = None
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def move_waitlist_entries(rows, batch_size):
+    """
+    Move waitlist entries to new positions in one transaction.
+
+    The entries are moved to negative positions chunk by chunk, then to their
+    final positions, in one transaction as write_positions does, so that readers
+    never see a negative position and a failure leaves every entry where it was.
+    The rows are read once per pass rather than held in memory. Leaderboard
+    entries and the ranking index of this process, when loaded, are moved along
+    with them, and the users are sent a `position` event.
+
+    Args:
+        rows (callable): Returns an iterable of the (waitlist ID, user ID, new
+            position, referral count) of each entry, called once per pass.
+        batch_size (int): Number of rows written per statement.
+
+    Returns:
+        int: The number of entries moved.
+    """
+    index = _index
+    moved = 0
+
+    try:
+        with transaction.atomic():
+            for chunk in _chunks(rows(), batch_size):
+                Waitlist.objects.filter(id__in=[row[0] for row in chunk]).update(
+                    position=-F("position")
+                )
+                LeaderboardEntry.objects.filter(
+                    user__in=[row[1] for row in chunk]
+                ).update(position=-F("position"))
+
+            for chunk in _chunks(rows(), batch_size):
+                Waitlist.objects.bulk_update(
+                    [Waitlist(id=row[0], position=row[2]) for row in chunk], ["position"]
+                )
+                LeaderboardEntry.objects.bulk_update(
+                    [
+                        LeaderboardEntry(
+                            user_id=row[1], position=row[2], referral_count=row[3]
+                        )
+                        for row in chunk
+                    ],
+                    ["position", "referral_count"],
+                )
+                publish_events(
+                    [
+                        (user_channel(row[1]), {"type": "position", "position": row[2]})
+                        for row in chunk
+                    ]
+                )
+                if index is not None:
+                    for _, user_id, position, referral_count in chunk:
+                        if user_id in index:
+                            index.move(user_id, referral_count, position)
+                moved += len(chunk)
+
+            if moved:
+                invalidate_waitlists()
+    except Exception:
+        reset_ranking_index()
+        raise
+
+    if moved:
+        bump_revision(GLOBAL_WAITLIST_REVISION)
+    return moved
+
+
+def rerank_positions(first_position, batch_size):
+    """
+    Recompute every position with one set-based query.
+
+    The true rank of every entry is computed by the database with ROW_NUMBER()
+    over Waitlist joined with User, in the same order as RankingIndex, and only the
+    rows whose position differs are streamed to move_waitlist_entries.
+
+    Args:
+        first_position (int): Position of the entry at rank 0.
+        batch_size (int): Number of rows written per statement.
+
+    Returns:
+        int: The number of positions that changed.
+    """
+    ranked = Waitlist.objects.annotate(
+        new_position=Window(
+            RowNumber(),
+            order_by=(F("user__referral_count").desc(), F("id").asc()),
+        )
+        + (first_position - 1)
+    )
+    # After the first pass the moved rows are at negative positions, so the
+    # second pass reads the same rows
+    changed = ranked.exclude(position=F("new_position")).values_list(
+        "id", "user_id", "new_position", "user__referral_count"
+    )
+
+    return move_waitlist_entries(
+        lambda: changed.iterator(chunk_size=batch_size), batch_size
+    )
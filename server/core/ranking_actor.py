@@ -0,0 +1,169 @@
+"""
+This module runs the single writer of waitlist positions.
+
+The ranking tasks (create_waitlist, update_waitlist, rank_referrers and
+rerank_waitlist) are routed to the ranking queue. RankingActor consumes that
+queue in one process, the only one holding a ranking index and moving positions,
+so no two mutations ever race for the same position. Messages are taken in micro-batches: after the
+first message arrives, the actor keeps collecting for a short window or until the
+batch is full, applies the batch in one transaction and only then acknowledges
+it. A failing batch is applied again message by message, and a message that
+still fails is rejected so it cannot block the queue.
+
+Classes:
+    RankingActor: Consumes the ranking queue and applies it in micro-batches.
+"""
+
+import socket
+import time
+
+from django.db import close_old_connections
+
+from server.celery import app, QUEUES, RANKING_QUEUE
+
+from .metrics import (
+    ENQUEUED_AT_HEADER,
+    RANKING_BATCH_SIZE,
+    RANKING_BATCH_DURATION,
+    RANKING_BATCH_QUERIES,
+    observe_queue_wait,
+    track_queries,
+)
+from .ranking import get_ranking_index
+from .tracing import TRACEPARENT_HEADER, record_span, trace
+from .tasks import apply_ranking_events, rerank_waitlist
+
+
+class RankingActor:
+    """
+    Consumes the ranking queue and applies it in micro-batches.
+
+    Args:
+        batch_size (int): Maximum number of messages applied in one transaction.
+        batch_window (float): Seconds spent collecting a batch after its first message.
+    """
+
+    queue = QUEUES[RANKING_QUEUE]
+
+    def __init__(self, batch_size, batch_window):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.batches = 0
+        self.messages = 0
+        self._pending = []
+
+    def _on_message(self, body, message):
+        self._pending.append(message)
+
+    def _collect(self, connection):
+        """Wait for a first message, then collect a batch until it is full or the window closes."""
+        try:
+            connection.drain_events(timeout=1)
+        except socket.timeout:
+            connection.heartbeat_check()
+            return
+
+        deadline = time.monotonic() + self.batch_window
+        while len(self._pending) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                connection.drain_events(timeout=remaining)
+            except socket.timeout:
+                break
+
+    @staticmethod
+    def _event(message):
+        """Return the (task name, args) of a Celery task message."""
+        args, _, _ = message.decode()
+        return message.headers["task"], args
+
+    def apply(self, messages):
+        """
+        Apply messages in order, ranking tasks in one transaction per run between re-ranks.
+
+        Args:
+            messages (list): The task messages.
+        """
+        events = []
+        for name, args in map(self._event, messages):
+            if name == rerank_waitlist.name:
+                if events:
+                    apply_ranking_events(events)
+                    events = []
+                rerank_waitlist()
+            else:
+                events.append((name, args))
+
+        if events:
+            apply_ranking_events(events)
+
+    def _handle(self, messages):
+        try:
+            self.apply(messages)
+        except Exception as error:
+            if len(messages) == 1:
+                print(f"Rejected ranking task {messages[0].headers.get('id')}: {error}")
+                messages[0].reject()
+                return
+            for message in messages:
+                self._handle([message])
+            return
+
+        for message in messages:
+            message.ack()
+
+    @staticmethod
+    def _record_spans(messages, batch_span, start_time, duration):
+        """Give each task of a batch a span in its own trace, pointing to the batch."""
+        batch = {}
+        if batch_span is not None:
+            batch = {"batch_trace_id": batch_span.trace_id, "batch_span_id": batch_span.span_id}
+        for message in messages:
+            record_span(
+                f"task {message.headers['task']}",
+                message.headers.get(TRACEPARENT_HEADER),
+                start_time,
+                duration,
+                task_id=message.headers.get("id"),
+                batch_size=len(messages),
+                **batch,
+            )
+
+    def run(self):
+        """Build the ranking index and apply the ranking queue until stopped."""
+        get_ranking_index()
+
+        with app.connection_for_read() as connection:
+            with connection.Consumer(
+                self.queue,
+                callbacks=[self._on_message],
+                accept=["json"],
+                prefetch_count=self.batch_size,
+            ):
+                while True:
+                    self._collect(connection)
+                    if not self._pending:
+                        continue
+
+                    messages, self._pending = self._pending, []
+                    for message in messages:
+                        observe_queue_wait(
+                            message.headers["task"],
+                            message.headers.get(ENQUEUED_AT_HEADER),
+                        )
+
+                    close_old_connections()
+                    start_time, start = time.time(), time.perf_counter()
+                    with track_queries() as queries, trace(
+                        "ranking.batch", size=len(messages)
+                    ) as batch_span:
+                        self._handle(messages)
+                    duration = time.perf_counter() - start
+                    self._record_spans(messages, batch_span, start_time, duration)
+                    RANKING_BATCH_DURATION.observe(duration)
+                    RANKING_BATCH_SIZE.observe(len(messages))
+                    RANKING_BATCH_QUERIES.observe(queries.count)
+                    self.batches += 1
+                    self.messages += len(messages)
@@ -0,0 +1,140 @@
+"""
+This module generates synthetic waitlists for benchmarks.
+
+Users sign up one after another. A share of them sign up with the referral code
+of an earlier user, picked by preferential attachment: the more referrals a user
+already has, the likelier they are to get the next one, which gives the
+power-law referral counts of real referral programs. Another share continues the
+latest referral chain instead, each referee referring the next. The rows are
+inserted through the bulk import of core.imports, and the unverified users get a
+pending verification code.
+
+The same seed always generates the same users, referrals and flags, and into an
+empty database the same rows.
+
+Functions:
+- seed_email(prefix, number): Return the email of a synthetic user.
+- seed_rows(users, seed, **rates): Yield the rows of a synthetic waitlist.
+- seed_waitlist(users, seed, chunk_size, **rates): Insert a synthetic waitlist.
+"""
+
+import random
+from itertools import islice
+
+from django.db import transaction
+
+from .models import User, Verification
+from .codes import generate_codes
+from .imports import WaitlistImport
+
+FIRST_NAMES = (
+    "Ada Alan Amara Ben Chen Dara Elif Emma Farid Grace Hana Ivan Jonas Kofi Lena "
+    "Luis Maya Noah Olga Priya Ravi Sara Tomas Yuki Zoe"
+).split()
+LAST_NAMES = (
+    "Adams Berg Costa Diaz Eze Fischer Garcia Haddad Ito Jensen Kim Lopez Mensah "
+    "Novak Okafor Patel Quinn Rossi Silva Tanaka Usman Varga Wang Yilmaz Zhou"
+).split()
+
+
+def seed_email(prefix, number):
+    """Return the email of the synthetic user `number`."""
+    return f"{prefix}{number}@example.com"
+
+
+def seed_rows(
+    users,
+    seed=0,
+    referral_rate=0.6,
+    chain_rate=0.1,
+    verification_rate=0.8,
+    deletion_rate=0.02,
+    prefix="seed",
+):
+    """
+    Yield the rows of a synthetic waitlist, in signup order.
+
+    Args:
+        users (int): Number of users.
+        seed (int, optional): Seed of the generator. Defaults to 0.
+        referral_rate (float, optional): Share of users signing up with a referral. Defaults to 0.6.
+        chain_rate (float, optional): Share of referrals continuing the latest referral chain. Defaults to 0.1.
+        verification_rate (float, optional): Share of users who verified their email. Defaults to 0.8.
+        deletion_rate (float, optional): Share of soft-deleted users. Defaults to 0.02.
+        prefix (str, optional): Prefix of the emails. Defaults to "seed".
+
+    Yields:
+        dict: The columns of a user, as read by core.imports.
+    """
+    generator = random.Random(seed)
+    # Every user appears once, plus once per referral, so picking from it favors
+    # the users with the most referrals
+    attachment = []
+    latest_referee = None
+
+    for number in range(users):
+        row = {
+            "email": seed_email(prefix, number),
+            "name": f"{generator.choice(FIRST_NAMES)} {generator.choice(LAST_NAMES)}",
+            "is_verified": generator.random() < verification_rate,
+            "is_deleted": generator.random() < deletion_rate,
+        }
+
+        if attachment and generator.random() < referral_rate:
+            if latest_referee is not None and generator.random() < chain_rate:
+                referrer = latest_referee
+            else:
+                referrer = generator.choice(attachment)
+            row["referrer"] = seed_email(prefix, referrer)
+            attachment.append(referrer)
+            latest_referee = number
+
+        attachment.append(number)
+        yield row
+
+
+def _add_verifications(user_ids, chunk_size):
+    """Give the unverified users among `user_ids` a pending verification code."""
+    user_ids = iter(user_ids)
+    added = 0
+    while chunk := list(islice(user_ids, chunk_size)):
+        pending = list(
+            User.objects.filter(id__in=chunk, is_verified=False, is_deleted=False)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        codes = generate_codes("verification", len(pending))
+        with transaction.atomic():
+            Verification.objects.bulk_create(
+                [
+                    Verification(user_id=user_id, unique_code=code)
+                    for user_id, code in zip(pending, codes)
+                ]
+            )
+        added += len(pending)
+    return added
+
+
+def seed_waitlist(users, seed=0, chunk_size=5000, **rates):
+    """
+    Insert a synthetic waitlist.
+
+    Args:
+        users (int): Number of users.
+        seed (int, optional): Seed of the generator. Defaults to 0.
+        chunk_size (int, optional): Number of rows written per statement. Defaults to 5000.
+        **rates: The distribution options of seed_rows.
+
+    Returns:
+        dict: The number of users, referrals, waitlist entries and verifications inserted.
+    """
+    waitlist_import = WaitlistImport(chunk_size)
+    counts = {
+        "users": waitlist_import.add_users(seed_rows(users, seed, **rates)),
+        "referrals": waitlist_import.add_referrals(),
+        "waitlist_entries": waitlist_import.add_waitlist_entries(),
+    }
+    counts["verifications"] = _add_verifications(
+        waitlist_import.user_ids.values(), chunk_size
+    )
+    return counts
@@ -0,0 +1,124 @@
+"""
+This module hands out unique values from named counters stored in the Sequence table.
+
+Each process reserves a block of values with a single locked update of the
+counter row and then serves values from that block in memory, so concurrent
+workers never scan a table or race each other for the same value. Values left in
+a block when a process exits are skipped, leaving gaps but never duplicates.
+
+Blocks are reserved on a connection of their own, SEQUENCE_DATABASE, which
+commits them at once instead of holding the counter row locked until the caller
+commits. When that connection is in a transaction anyway (on SQLite, where it
+is the connection of the caller, and in the tests), the rest of a block is only
+shared once the transaction commits, since a rollback returns the block to the
+counter.
+
+Classes:
+    SequenceAllocator: Allocates unique values from a named counter in blocks.
+
+Functions:
+    get_waitlist_position_allocator(): Return the process wide allocator for waitlist positions.
+"""
+
+import threading
+from collections import deque
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Sequence, Waitlist
+
+
+class SequenceAllocator:
+    """
+    Allocates unique values from a named counter in blocks.
+
+    Args:
+        name (str): Name of the counter in the Sequence table.
+        block_size (int): Number of values reserved per round-trip.
+        initial (callable): Returns the first value when the counter does not exist yet.
+    """
+
+    def __init__(self, name, block_size, initial):
+        self.name = name
+        self.block_size = block_size
+        self.initial = initial
+        self._blocks = deque()
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        """
+        Reserve a contiguous range of values directly from the counter.
+
+        Args:
+            count (int): Number of values to reserve.
+
+        Returns:
+            range: The reserved values.
+        """
+        using = settings.SEQUENCE_DATABASE
+        with transaction.atomic(using=using):
+            # The initial value is only computed when the counter is created
+            sequences = Sequence.objects.using(using).select_for_update()
+            sequence, _ = sequences.get_or_create(
+                name=self.name, defaults={"next_value": self.initial}
+            )
+
+            start = sequence.next_value
+            sequence.next_value = start + count
+            sequence.save(update_fields=["next_value"])
+
+        return range(start, start + count)
+
+    def next(self):
+        """
+        Return the next value, reserving a new block when the current one is used up.
+
+        Returns:
+            int: A value no other caller will receive.
+        """
+        with self._lock:
+            if self._blocks:
+                block = self._blocks.popleft()
+                if len(block) > 1:
+                    self._blocks.appendleft(block[1:])
+                return block.start
+
+        block = self.reserve(self.block_size)
+        # Runs at once when the reservation is already committed
+        transaction.on_commit(
+            partial(self._share, block[1:]), using=settings.SEQUENCE_DATABASE
+        )
+        return block.start
+
+    def _share(self, block):
+        with self._lock:
+            if block:
+                self._blocks.append(block)
+
+
+def _first_waitlist_position():
+    """Return the position after the last waitlist entry, scanned once when the counter is created."""
+    last_position = Waitlist.objects.aggregate(last_position=Max("position"))[
+        "last_position"
+    ]
+    return (last_position or settings.WAITLIST_FIRST_POSITION - 1) + 1
+
+
+_waitlist_position_allocator = SequenceAllocator(
+    "waitlist_position",
+    settings.WAITLIST_POSITION_BLOCK_SIZE,
+    _first_waitlist_position,
+)
+
+
+def get_waitlist_position_allocator():
+    """
+    Return the process wide allocator for waitlist positions.
+
+    Returns:
+        SequenceAllocator: The waitlist position allocator.
+    """
+    return _waitlist_position_allocator
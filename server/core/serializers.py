@@ -9,10 +9,12 @@ Classes:
     UserWithVerificationSerializer: Serializer for User model focusing on verification status.
     ReferralsWithDetailsSerializer: Serializer for Referral model with detailed referee information.
     ReferralSerializer: Serializer for Referral model.
+    AccessCodeSerializer: Serializer for AccessCode model.
+    LeaderboardEntrySerializer: Serializer for LeaderboardEntry model.
 """
 
 from rest_framework import serializers
-from .models import User, Waitlist, Verification, Referral, AccessCode
+from .models import User, Waitlist, Verification, Referral, AccessCode, LeaderboardEntry
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -112,3 +114,16 @@ class AccessCodeSerializer(serializers.ModelSerializer):
     class Meta:
         model = AccessCode
         fields = "__all__"
+
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    """
+    Serializer for LeaderboardEntry model.
+    Includes fields: user (name), position, referral_count.
+    """
+
+    user = serializers.CharField(source="name", read_only=True)
+
+    class Meta:
+        model = LeaderboardEntry
+        fields = ("user", "position", "referral_count")
@@ -0,0 +1,77 @@
+"""
+This module provides a local SMTP server that accepts and discards every message.
+
+It stands in for the real SMTP server when measuring email throughput offline.
+The delay added when a connection is opened simulates the TLS negotiation and
+login of a remote server, the cost that pooled connections avoid.
+
+Classes:
+    SMTPSinkHandler: Speaks enough SMTP to accept messages from smtplib.
+    SMTPSink: Threaded SMTP server counting the messages it accepts.
+"""
+
+import socketserver
+import threading
+import time
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Speaks enough SMTP to accept messages from smtplib."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        time.sleep(self.server.connect_delay)
+        self.reply("220 localhost SMTP sink")
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                time.sleep(self.server.message_delay)
+                self.server.count_message()
+                self.reply("250 OK")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Threaded SMTP server counting the messages it accepts.
+
+    Args:
+        address (tuple): The (host, port) to listen on, port 0 picks a free port.
+        connect_delay (float): Seconds waited before greeting a new connection.
+        message_delay (float): Seconds waited before accepting a message.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, connect_delay=0, message_delay=0):
+        super().__init__(address, SMTPSinkHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def count_message(self):
+        with self._lock:
+            self.messages += 1
+
+    def start(self):
+        """Serve in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
@@ -5,20 +5,43 @@ It utilizes Celery for asynchronous task processing.
 Functions:
 - send_text_email(subject, message, recipient_list): Sends an email to a list of recipients.
 - send_html_email(subject, html_content, recipient_list): Sends an HTML email to a list of recipients.
+- send_template_email(template_id, context, recipient_list): Renders and sends an email from its template id.
+- send_template_emails(emails): Renders and sends a batch of emails over one connection.
+- apply_ranking_events(events): Applies a batch of create_waitlist, update_waitlist and rank_referrers calls in one transaction.
 - create_waitlist(user_id): Adds a user to the waitlist and assigns them a position.
-- update_waitlist(user_id): Updates the position of a user in the waitlist based on certain criteria.
+- update_waitlist(referrer_id, referee_name): Updates the position of a user in the waitlist based on their referral count.
+- rank_referrers(referrer_ids): Moves referrers in the waitlist after their buffered referral counts were written.
 - create_referrals(referral_code, referee_id): Creates a referral entry and updates the referrer's count.
+- rerank_waitlist(): Recomputes every waitlist position in one set-based pass.
+- select_winners(selection_id): Gives access codes to the winners of a winner selection job.
 """
 
 from django.conf import settings
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.utils.html import strip_tags
-from django.template.loader import render_to_string
-from django.db import models
+from django.core.mail import send_mail
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef, F
+from django.utils import timezone
 from celery import shared_task
 
-from .serializers import WaitlistSerializer, ReferralSerializer
-from .models import User, Waitlist
+from .serializers import ReferralSerializer
+from .models import User, Waitlist, AccessCode, WinnerSelection
+from .codes import generate_codes
+from .mailer import build_html_email, get_mailer
+from .emails import render_email
+from .counters import get_referral_counter
+from .cache import invalidate_waitlists, bump_revision, referrals_revision
+from .ranking import get_ranking_index, reset_ranking_index, rerank_positions
+from .sequences import get_waitlist_position_allocator
+from .leaderboard import (
+    add_leaderboard_entry,
+    add_leaderboard_entries,
+    update_leaderboard_referral_count,
+)
+from .pubsub import publish_events, user_channel
+from .metrics import EMAILS, EMAIL_SEND_DURATION
+from .tracing import span
+
+POSITION_ATTEMPTS = 3
 
 
 @shared_task
@@ -31,132 +54,276 @@ def send_text_email(subject, message, recipient_list):
     - message (str): The body of the email.
     - recipient_list (list): A list of email addresses to send the email to.
     """
-    send_mail(subject, message, settings.EMAIL_HOST_USER, recipient_list)
+    # Opens a connection of its own, which is part of the measured send
+    with EMAIL_SEND_DURATION.time(), span("smtp.send", recipients=len(recipient_list)):
+        send_mail(subject, message, settings.EMAIL_HOST_USER, recipient_list)
+    EMAILS.inc("sent")
 
 
 @shared_task
 def send_html_email(subject, html_content, recipient_list):
     """
-    Sends an HTML email to a list of recipients.
+    Sends an HTML email to a list of recipients over the pooled connection of this worker.
 
     Parameters:
     - subject (str): The subject of the email.
     - html_content (str): The HTML content of the email.
     - recipient_list (list): A list of email addresses to send the email to.
     """
-    text_content = strip_tags(html_content)
+    email = build_html_email(subject, html_content, recipient_list)
 
-    email = EmailMultiAlternatives(
-        subject, text_content, to=recipient_list, from_email=settings.EMAIL_HOST_USER
-    )
-    email.attach_alternative(html_content, "text/html")
-
-    email.send()
+    for _, error in get_mailer().send([email]):
+        raise error
 
 
 @shared_task
-def create_waitlist(user_id):
+def send_template_email(template_id, context, recipient_list):
     """
-    Adds a user to the waitlist and assigns them a position.
+    Renders an email from its template id and sends it to a list of recipients.
 
     Parameters:
-    - user_id (int): The ID of the user to add to the waitlist.
+    - template_id (str): A key of core.emails.EMAIL_TEMPLATES.
+    - context (dict): The variables of the email.
+    - recipient_list (list): A list of email addresses to send the email to.
     """
-    last_position = Waitlist.objects.aggregate(last_position=models.Max("position"))[
-        "last_position"
-    ]
-    position = (last_position or 98) + 1
+    subject, html_content = render_email(template_id, context)
+    send_html_email(subject, html_content, recipient_list)
 
-    wait_serializer = WaitlistSerializer(data={"user": user_id, "position": position})
-    if wait_serializer.is_valid():
-        wait_serializer.save()
 
-        # Sending a welcome email to the user
-        user = User.objects.get(id=user_id)
-        subject = "Welcome - Your Spot is Confirmed!"
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_template_emails(self, emails):
+    """
+    Renders a batch of emails and sends them over the pooled connection of this worker.
 
-        context = {
-            "user_name": user.name,
-            "waitlist_position": position,
-            "type_of_action": "Registration",
-        }
-        html_content = render_to_string("welcome-email.html", context)
-        recipient_list = [user.email]
+    Every email is tried a few times on a fresh connection. The emails that still
+    fail are retried later as a smaller batch.
 
-        send_html_email.delay(subject, html_content, recipient_list)
-    else:
-        print(wait_serializer.errors)
+    Parameters:
+    - emails (list): The (template_id, context, recipient_list) of each email.
+    """
+    messages = [
+        build_html_email(*render_email(template_id, context), recipient_list)
+        for template_id, context, recipient_list in emails
+    ]
+    failed = get_mailer().send(messages)
+
+    if failed:
+        failed_messages = [message for message, _ in failed]
+        retry_emails = [
+            email
+            for email, message in zip(emails, messages)
+            if message in failed_messages
+        ]
+        raise self.retry(args=(retry_emails,), exc=failed[-1][1])
+
+
+def _add_waitlist_entry(user, allocator):
+    """Creates the waitlist and leaderboard entries of a user at the next free position."""
+    # Positions come from the allocator, a collision (e.g. a row moved there by
+    # hand) costs another position instead of dropping the user
+    for attempt in range(POSITION_ATTEMPTS):
+        position = allocator.next()
+        try:
+            with transaction.atomic():
+                waitlist = Waitlist.objects.create(user=user, position=position)
+                add_leaderboard_entry(user, position)
+                invalidate_waitlists()
+            return waitlist
+        except IntegrityError:
+            if attempt == POSITION_ATTEMPTS - 1:
+                raise
+
+
+def _add_waitlist_entries(users, allocator):
+    """
+    Creates the waitlist and leaderboard entries of users at contiguous new positions.
 
+    The entries are inserted with one statement per table. If a position is
+    already taken (e.g. a row moved there by hand), the users are added one by
+    one instead.
 
-@shared_task
-def update_waitlist(referrer_id, referee_name):
+    Returns:
+    - dict: The waitlist entry of each user ID.
+    """
+    positions = allocator.reserve(len(users))
+    try:
+        with transaction.atomic():
+            Waitlist.objects.bulk_create(
+                [
+                    Waitlist(user=user, position=position)
+                    for user, position in zip(users, positions)
+                ]
+            )
+            add_leaderboard_entries(list(zip(users, positions)))
+            invalidate_waitlists()
+    except IntegrityError:
+        return {user.id: _add_waitlist_entry(user, allocator) for user in users}
+
+    # MySQL does not return the IDs of bulk inserted rows
+    return {
+        waitlist.user_id: waitlist
+        for waitlist in Waitlist.objects.filter(user__in=users).only(
+            "id", "user", "position"
+        )
+    }
+
+
+def apply_ranking_events(events):
     """
-    Updates the position of user in the waitlist based on their referral count & creation date of their waitlist entry.
+    Applies a batch of create_waitlist, update_waitlist and rank_referrers calls in one transaction.
+
+    The users joining the waitlist are inserted together at contiguous positions,
+    so a burst of verifications costs a handful of queries per batch instead of
+    several per user. Every call then moves its user in the in-memory ranking
+    index, and positions are written back once for the whole batch, over the
+    ranks the batch moved. Referrers are ranked on their referral_count, as every
+    other ranking path is. Users added twice (e.g. a redelivered task) or unknown
+    users are skipped. The emails of the batch are sent after the commit in batched
+    tasks. If the transaction fails, the ranking index is dropped so it is
+    rebuilt from the database.
 
     Parameters:
-    - referrer_id (int): The ID of the referrer.
-    - referee_name (str): The name of the user being referred
+    - events (list): (task name, args) pairs, in the order the calls were queued.
     """
-    waitlist = Waitlist.objects.filter(user=referrer_id).first()
+    index = get_ranking_index()
+    allocator = get_waitlist_position_allocator()
 
-    if waitlist:
-        update_position = max(waitlist.position - 1, 1)
-        existing_waitlist_entry = Waitlist.objects.filter(
-            position=update_position
-        ).first()
+    user_ids = set()
+    for name, args in events:
+        if name == rank_referrers.name:
+            user_ids.update(args[0])
+        else:
+            user_ids.add(args[0])
+    users = User.objects.in_bulk(user_ids)
+
+    start, stop = len(index), 0
+    updated = {}
+    emails = []
+
+    try:
+        with transaction.atomic():
+            joining = [
+                users[user_id]
+                for user_id in dict.fromkeys(
+                    args[0] for name, args in events if name == create_waitlist.name
+                )
+                if user_id in users and user_id not in index
+            ]
+            waitlists = _add_waitlist_entries(joining, allocator) if joining else {}
+
+            for name, args in events:
+                moves = []
+
+                if name == create_waitlist.name:
+                    user = users.get(args[0])
+                    if user is None or user.id not in waitlists or user.id in index:
+                        continue
+                    waitlist = waitlists[user.id]
+                    moves.append(
+                        index.add(
+                            user.id, waitlist.id, user.referral_count, waitlist.position
+                        )
+                    )
+                    emails.append(
+                        ("welcome", user, "waitlist_position", {"user_name": user.name})
+                    )
+                elif name in (update_waitlist.name, rank_referrers.name):
+                    referrer_ids = args[0] if name == rank_referrers.name else [args[0]]
+                    referrers = [
+                        users[user_id]
+                        for user_id in referrer_ids
+                        if user_id in users and user_id in index
+                    ]
+                    for user in referrers:
+                        if user.id not in updated:
+                            update_leaderboard_referral_count(user)
+                            updated[user.id] = user.referral_count
+                        moves.append(index.update(user.id, user.referral_count))
+
+                    if name == update_waitlist.name and referrers:
+                        context = {
+                            "referrer_name": user.name,
+                            "referrer_referral_count": user.referral_count,
+                            "referee_name": args[1],
+                        }
+                        emails.append(("spot_update", user, "position", context))
+                else:
+                    raise ValueError(f"{name} is not a ranking task")
+
+                for moved in moves:
+                    if moved[0] < moved[1]:
+                        start, stop = min(start, moved[0]), max(stop, moved[1])
+
+            if start < stop:
+                index.write_positions(start, stop)
+            publish_events(
+                [
+                    (
+                        user_channel(user_id),
+                        {"type": "referral_count", "referral_count": referral_count},
+                    )
+                    for user_id, referral_count in updated.items()
+                ]
+            )
+    except Exception:
+        reset_ranking_index()
+        raise
+
+    # Sending the welcome and spot update emails with the positions after the batch
+    emails = [
+        (template_id, {**context, position_key: index.position_of(user.id)}, [user.email])
+        for template_id, user, position_key, context in emails
+    ]
+    for offset in range(0, len(emails), settings.EMAIL_BATCH_SIZE):
+        send_template_emails.delay(emails[offset : offset + settings.EMAIL_BATCH_SIZE])
 
-        if existing_waitlist_entry:
-            user_referral_count = User.objects.get(id=referrer_id).referral_count
-            existing_user_referral_count = User.objects.get(
-                id=existing_waitlist_entry.user.id
-            ).referral_count
 
-            print(user_referral_count, existing_user_referral_count)
-            if user_referral_count > existing_user_referral_count:
-                existing_waitlist_entry.position = 0
-                existing_waitlist_entry.save()
+@shared_task
+def create_waitlist(user_id):
+    """
+    Adds a user to the waitlist and assigns them a position.
 
-                waitlist.position = update_position
-                waitlist.save()
+    Routed to the ranking queue, where the ranking actor applies it together with
+    the other ranking tasks of its batch.
 
-                existing_waitlist_entry.position = update_position + 1
-                existing_waitlist_entry.save()
+    Parameters:
+    - user_id (int): The ID of the user to add to the waitlist.
+    """
+    apply_ranking_events([(create_waitlist.name, [user_id])])
 
-            elif user_referral_count < existing_user_referral_count:
-                pass
 
-            else:
-                if waitlist.created_at < existing_waitlist_entry.created_at:
-                    existing_waitlist_entry.position = 0
-                    existing_waitlist_entry.save()
+@shared_task
+def update_waitlist(referrer_id, referee_name):
+    """
+    Updates the position of user in the waitlist based on their referral count & the order they joined the waitlist.
 
-                    waitlist.position = update_position
-                    waitlist.save()
+    The referrer is moved in the in-memory ranking index and only the positions
+    between their old and new rank are written back. Routed to the ranking queue,
+    where the ranking actor applies it together with the other ranking tasks of
+    its batch.
 
-                    existing_waitlist_entry.position = update_position + 1
-                    existing_waitlist_entry.save()
+    Parameters:
+    - referrer_id (int): The ID of the referrer.
+    - referee_name (str): The name of the user being referred
+    """
+    apply_ranking_events([(update_waitlist.name, [referrer_id, referee_name])])
 
-                else:
-                    pass
-        else:
-            waitlist.position = update_position
-            waitlist.save()
 
-        # Sending an email to the user about their updated position
-        user = User.objects.get(id=referrer_id)
-        subject = "Spot Update - SpotHot"
+@shared_task
+def rank_referrers(referrer_ids):
+    """
+    Moves referrers in the waitlist after their buffered referral counts were written.
 
-        context = {
-            "referrer_name": user.name,
-            "referrer_referral_count": user.referral_count,
-            "referee_name": referee_name,
-            "position": waitlist.position,
-            "type_of_action": "Referral",
-        }
-        html_content = render_to_string("spot-update-email.html", context)
-        recipient_list = [user.email]
+    Queued by the referral count buffer of a worker (see core.counters) in the
+    transaction that writes the counts, so a referral counted after the
+    update_waitlist of its referee still moves the referrer. Routed to the ranking
+    queue, where the ranking actor applies it together with the other ranking
+    tasks of its batch.
 
-        send_html_email.delay(subject, html_content, recipient_list)
+    Parameters:
+    - referrer_ids (list): The IDs of the referrers whose count was written.
+    """
+    apply_ranking_events([(rank_referrers.name, [referrer_ids])])
 
 
 @shared_task
@@ -164,19 +331,135 @@ def create_referrals(referral_code, referee_id):
     """
     Creates a referral entry and updates the referrer's count.
 
+    The count is incremented atomically, and coalesced with other increments of
+    the same referrer when REFERRAL_COUNT_FLUSH_INTERVAL is set. The outbox
+    delivers a task at least once, so a referral that already exists is not
+    counted again.
+
     Parameters:
     - referral_code (str): The referral code of the referrer.
     - referee_id (int): The ID of the user being referred.
     """
-    referrer = User.objects.get(referral_code=referral_code)
-    referrer.referral_count = referrer.referral_count + 1
-    print(referrer.referral_count)
-    referrer.save()
+    referrer_id = User.objects.values_list("id", flat=True).get(
+        referral_code=referral_code
+    )
 
     referral_serializer = ReferralSerializer(
-        data={"referrer": referrer.id, "referee": referee_id}
+        data={"referrer": referrer_id, "referee": referee_id}
     )
-    if referral_serializer.is_valid():
-        referral_serializer.save()
-    else:
+    if not referral_serializer.is_valid():
         print(referral_serializer.errors)
+        return
+
+    try:
+        with transaction.atomic():
+            referral_serializer.save()
+            get_referral_counter().add(referrer_id)
+    except IntegrityError:
+        return  # Saved meanwhile by another delivery of the task
+
+    bump_revision(referrals_revision(referrer_id))
+    publish_events([(user_channel(referrer_id), {"type": "referrals"})])
+
+
+@shared_task
+def rerank_waitlist():
+    """
+    Recomputes every waitlist position in one set-based pass.
+
+    Corrects any drift from the true order, e.g. after referral counts were
+    edited by hand. Routed to the ranking queue, so it never runs alongside the
+    other ranking tasks. The moves are applied to the ranking index of the actor
+    as well, rather than rebuilding it.
+
+    Returns:
+    - int: The number of positions that changed.
+    """
+    return rerank_positions(
+        settings.WAITLIST_FIRST_POSITION, settings.RANKING_BATCH_SIZE
+    )
+
+
+def _winner_chunks(selection, chunk_size):
+    """
+    Yields the winners of a selection job in chunks of (user_id, name, email).
+
+    Users that already hold an active access code are skipped, so running a job
+    again only picks up the winners it has not reached yet.
+    """
+    has_code = Exists(AccessCode.objects.filter(user=OuterRef("user"), is_active=True))
+    waitlist = Waitlist.objects.filter(~has_code).order_by("position")
+    fields = ("user_id", "user__name", "user__email")
+
+    if selection.waitlist_ids:
+        ids = selection.waitlist_ids
+        for offset in range(0, len(ids), chunk_size):
+            chunk = list(
+                waitlist.filter(id__in=ids[offset : offset + chunk_size]).values_list(
+                    *fields
+                )
+            )
+            if chunk:
+                yield chunk
+        return
+
+    remaining = selection.count - selection.selected
+    chunk = []
+    for row in waitlist.values_list(*fields)[:remaining].iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@shared_task
+def select_winners(selection_id):
+    """
+    Gives access codes to the winners of a winner selection job.
+
+    The waitlist is streamed in position order. Each chunk of winners gets its
+    access codes in one bulk insert and their emails in batched tasks, and the
+    progress of the job is recorded after every chunk. A failing chunk is counted
+    and skipped instead of aborting the whole job.
+
+    Parameters:
+    - selection_id (int): The ID of the WinnerSelection job.
+    """
+    selection = WinnerSelection.objects.get(id=selection_id)
+    WinnerSelection.objects.filter(id=selection_id).update(
+        status=WinnerSelection.RUNNING
+    )
+
+    for chunk in _winner_chunks(selection, settings.WINNER_SELECTION_CHUNK_SIZE):
+        try:
+            codes = generate_codes("access", len(chunk))
+            with transaction.atomic():
+                AccessCode.objects.bulk_create(
+                    [
+                        AccessCode(user_id=user_id, code=code)
+                        for (user_id, _, _), code in zip(chunk, codes)
+                    ]
+                )
+                WinnerSelection.objects.filter(id=selection_id).update(
+                    selected=F("selected") + len(chunk)
+                )
+        except Exception as error:
+            WinnerSelection.objects.filter(id=selection_id).update(
+                failed=F("failed") + len(chunk), error=str(error)
+            )
+            continue
+
+        emails = [
+            ("winner", {"username": name, "access_code": code}, [email])
+            for (_, name, email), code in zip(chunk, codes)
+        ]
+        for offset in range(0, len(emails), settings.EMAIL_BATCH_SIZE):
+            send_template_emails.delay(emails[offset : offset + settings.EMAIL_BATCH_SIZE])
+
+    selection.refresh_from_db()
+    selection.status = WinnerSelection.FAILED if selection.failed else WinnerSelection.DONE
+    selection.finished_at = timezone.now()
+    selection.save(update_fields=["status", "finished_at"])
+
@@ -0,0 +1,77 @@
+"""
+Tests of the keyed permutation codes are generated with.
+
+Classes:
+    CodeGeneratorTests: Bijectivity and key dependence of the code permutation.
+    GenerateCodesTests: Codes drawn from the counters of every kind.
+"""
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .codes import CodeGenerator, generate_codes
+
+
+class CodeGeneratorTests(SimpleTestCase):
+    """Bijectivity and key dependence of the code permutation."""
+
+    def generator(self, kind="test", length=4, alphabet="ABC"):
+        """Return a generator of a small code space."""
+        return CodeGenerator(kind, length, alphabet, block_size=10)
+
+    def permutation(self, generator):
+        """Return the permuted value of every value of the code space."""
+        return [generator.permute(value) for value in range(generator.space)]
+
+    def test_permutation_is_bijective(self):
+        # Spaces of an even and an odd number of bits, the latter cycle walking
+        for alphabet, length in (("AB", 8), ("ABC", 4), ("ABCDEFGH", 3)):
+            with self.subTest(alphabet=alphabet, length=length):
+                generator = self.generator(length=length, alphabet=alphabet)
+                self.assertEqual(
+                    sorted(self.permutation(generator)), list(range(generator.space))
+                )
+
+    def test_permutation_shuffles(self):
+        generator = self.generator(length=6, alphabet="ABCD")
+        permutation = self.permutation(generator)
+        self.assertNotEqual(permutation, sorted(permutation))
+
+    def test_permutation_depends_on_key(self):
+        with override_settings(CODE_SECRET_KEY="a" * 32):
+            first = self.permutation(self.generator())
+            same = self.permutation(self.generator())
+            other_kind = self.permutation(self.generator(kind="other"))
+        with override_settings(CODE_SECRET_KEY="b" * 32):
+            other_key = self.permutation(self.generator())
+
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, other_kind)
+        self.assertNotEqual(first, other_key)
+
+    def test_encode(self):
+        generator = self.generator(length=3, alphabet="AB")
+        self.assertEqual(
+            [generator.encode(value) for value in range(generator.space)],
+            ["AAA", "AAB", "ABA", "ABB", "BAA", "BAB", "BBA", "BBB"],
+        )
+
+    def test_exhausted_space(self):
+        generator = self.generator(length=2, alphabet="AB")
+        with self.assertRaises(ValueError):
+            generator.permute(generator.space)
+
+
+class GenerateCodesTests(TestCase):
+    """Codes drawn from the counters of every kind."""
+
+    databases = "__all__"  # The counter blocks are reserved on SEQUENCE_DATABASE
+
+    def test_codes_are_unique(self):
+        for kind, options in settings.CODE_GENERATORS.items():
+            with self.subTest(kind=kind):
+                codes = generate_codes(kind, 200) + generate_codes(kind, 200)
+                self.assertEqual(len(set(codes)), len(codes))
+                for code in codes:
+                    self.assertEqual(len(code), options["length"])
+                    self.assertLessEqual(set(code), set(options["alphabet"]))
@@ -0,0 +1,129 @@
+"""
+Tests of the bulk import of a waitlist.
+
+Classes:
+    WaitlistImportTests: Merge order of the imported entries and the position counter.
+"""
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from .imports import WaitlistImport
+from .models import LeaderboardEntry, Referral, User, Waitlist
+from .ranking import reset_ranking_index
+from .sequences import get_waitlist_position_allocator
+
+
+@override_settings(PUBSUB_BACKEND="core.pubsub.InProcessPubSub")
+class WaitlistImportTests(TestCase):
+    """Merge order of the imported entries and the position counter."""
+
+    databases = "__all__"  # The counter blocks are reserved on SEQUENCE_DATABASE
+
+    def setUp(self):
+        # The ranking index is kept in memory, it would outlive the rolled back
+        # rows of the previous test
+        reset_ranking_index()
+
+    def add_existing(self, name, referral_count, rank):
+        """Add a user already in the waitlist at a rank."""
+        user = User.objects.create(
+            name=name,
+            email=f"{name}@example.com",
+            is_verified=True,
+            referral_count=referral_count,
+        )
+        position = settings.WAITLIST_FIRST_POSITION + rank
+        Waitlist.objects.create(user=user, position=position)
+        LeaderboardEntry.objects.create(
+            user=user, position=position, name=name, referral_count=referral_count
+        )
+
+    def run_import(self, rows):
+        """Import (name, referrer, is_verified) rows through every step."""
+        waitlist_import = WaitlistImport(chunk_size=2)
+        waitlist_import.add_users(
+            {
+                "email": f"{name}@example.com",
+                "name": name,
+                "referrer": referrer and f"{referrer}@example.com",
+                "is_verified": is_verified,
+            }
+            for name, referrer, is_verified in rows
+        )
+        waitlist_import.add_referrals()
+        return waitlist_import.add_waitlist_entries()
+
+    def waitlist(self):
+        """Return the names and referral counts of the waitlist, in position order."""
+        return list(
+            Waitlist.objects.order_by("position").values_list(
+                "user__name", "user__referral_count"
+            )
+        )
+
+    def test_merge_order(self):
+        self.add_existing("ada", 2, 0)
+        self.add_existing("ben", 0, 1)
+        self.add_existing("cem", 0, 2)
+
+        added = self.run_import(
+            [
+                ("dan", "ada", "true"),
+                ("eli", None, "true"),
+                ("fay", "eli", "true"),
+                ("gus", "eli", "false"),
+                ("hal", "eli", "true"),
+                ("ivy", "ben", "true"),
+                ("jon", None, "true"),
+            ]
+        )
+
+        # Most referrals first, existing entries before imported ones with as
+        # many, and imported ones in input order
+        self.assertEqual(added, 6)
+        self.assertEqual(
+            self.waitlist(),
+            [
+                ("ada", 3),
+                ("eli", 3),
+                ("ben", 1),
+                ("cem", 0),
+                ("dan", 0),
+                ("fay", 0),
+                ("hal", 0),
+                ("ivy", 0),
+                ("jon", 0),
+            ],
+        )
+        self.assertEqual(Referral.objects.count(), 5)
+
+        positions = list(
+            Waitlist.objects.order_by("position").values_list("position", flat=True)
+        )
+        first_position = settings.WAITLIST_FIRST_POSITION
+        self.assertEqual(positions, list(range(first_position, first_position + 9)))
+        self.assertEqual(
+            dict(LeaderboardEntry.objects.values_list("user__name", "position")),
+            dict(Waitlist.objects.values_list("user__name", "position")),
+        )
+        self.assertEqual(
+            dict(LeaderboardEntry.objects.values_list("user__name", "referral_count")),
+            dict(Waitlist.objects.values_list("user__name", "user__referral_count")),
+        )
+
+    def test_position_counter_advances(self):
+        self.add_existing("ada", 0, 0)
+        self.run_import([(name, None, "true") for name in ("ben", "cem", "dan")])
+
+        # The next user to verify joins after the imported ones
+        last_position = Waitlist.objects.order_by("position").last().position
+        next_position = get_waitlist_position_allocator().reserve(1).start
+        self.assertEqual(next_position, last_position + 1)
+
+    def test_import_into_empty_waitlist(self):
+        self.run_import(
+            [("ada", None, "true"), ("ben", "ada", "true"), ("cem", None, "true")]
+        )
+
+        self.assertEqual(self.waitlist(), [("ada", 1), ("ben", 0), ("cem", 0)])
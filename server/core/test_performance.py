@@ -0,0 +1,504 @@
+"""
+Query count and latency budgets for every route of core.urls and every task of core.tasks.
+
+Each operation is measured on synthetic waitlists of growing size (see
+core.seeding). A test fails when an operation runs more queries or takes longer
+than its budget, or when its query count changes with the size of the dataset,
+which is how a query per row (e.g. a relation serialized without being joined)
+shows up. The pages of the paginated routes grow with the dataset for the same
+reason. Every route is also checked for its status and its effects (e.g. the
+user created and their email queued), so that a failing request does not pass
+on the few queries it ran.
+
+Run with `python manage.py test core`, against MySQL or, offline, against SQLite
+with DATABASE_ENGINE=sqlite3.
+
+Classes:
+    PerformanceTestCase: Base class measuring operations against their budgets.
+    RoutePerformanceTests: Budgets of the API routes.
+    TaskPerformanceTests: Budgets of the Celery tasks.
+"""
+
+import os
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from server.celery import app
+
+from .codes import generate_codes
+from .counters import get_referral_counter
+from .models import (
+    LeaderboardEntry,
+    OutboxMessage,
+    Referral,
+    User,
+    Verification,
+    Waitlist,
+    WinnerSelection,
+)
+from .ranking import get_ranking_index, reset_ranking_index
+from .seeding import seed_waitlist
+from .views import (
+    ReferralsWithDetailsPagination,
+    WaitlistWithNamesCursorPagination,
+    WaitlistWithNamesPagination,
+)
+from .tasks import (
+    send_text_email,
+    send_html_email,
+    send_template_email,
+    send_template_emails,
+    create_waitlist,
+    update_waitlist,
+    create_referrals,
+    rerank_waitlist,
+    select_winners,
+)
+
+DATASET_SIZES = (12, 120)  # Users in the waitlist at each measurement
+PAGE_SIZES = dict(zip(DATASET_SIZES, (5, 50)))  # Rows per page of the waitlist
+DEFAULT_LATENCY_BUDGET = 0.5  # Seconds, generous so that slow machines pass
+
+# Queries per operation, counting the savepoints TestCase runs transactions in.
+# The tests never commit, so every code reserves a block of its counter (4 queries)
+QUERY_BUDGETS = {
+    "signup": 14,
+    "signup_with_referral": 16,
+    "verify": 6,
+    "resend_verification_email": 11,
+    "user": 1,
+    "waitlist": 1,
+    "global_waitlist": 2,
+    "global_waitlist_cursor": 1,
+    "referrals": 2,
+    "events": 1,
+    "export_waitlist": 5,
+    "export_referrals": 5,
+    "send_text_email": 0,
+    "send_html_email": 0,
+    "send_template_email": 0,
+    "send_template_emails": 0,
+    "create_referrals": 9,
+    "create_waitlist": 20,
+    "update_waitlist": 12,
+    "rerank_waitlist": 9,
+    "select_winners": 13,
+}
+LATENCY_BUDGETS = {
+    "rerank_waitlist": 2.0,
+    "select_winners": 2.0,
+}
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "revisions": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "revisions",
+        },
+    },
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    PUBSUB_BACKEND="core.pubsub.InProcessPubSub",
+)
+class PerformanceTestCase(TestCase):
+    """Base class measuring operations against their budgets."""
+
+    databases = "__all__"  # The counter blocks are reserved on SEQUENCE_DATABASE
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Emails queued by the tasks are sent in place instead of through a broker
+        cls._always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+
+    @classmethod
+    def tearDownClass(cls):
+        app.conf.task_always_eager = cls._always_eager
+        super().tearDownClass()
+
+    def setUp(self):
+        self.users = 0
+
+    def grow_to(self, users):
+        """Seed synthetic users until the dataset holds `users` of them."""
+        # The ranking index is kept in memory, it would outlive the rolled back
+        # rows of the previous test
+        reset_ranking_index()
+
+        seed_waitlist(users - self.users, seed=users, prefix=f"size{users}-")
+        self.users = users
+
+        # Warming up what a running process has already loaded, and the counter
+        # of each kind of code, created by the first code of the kind
+        get_ranking_index()
+        for kind in settings.CODE_GENERATORS:
+            generate_codes(kind, 1)
+
+    def measure(self, operation):
+        """
+        Run an operation once.
+
+        Args:
+            operation (callable): The operation.
+
+        Returns:
+            tuple: The result of the operation, its number of queries and the
+                seconds it took.
+        """
+        with ExitStack() as stack:
+            captures = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in settings.DATABASES
+            ]
+            start = time.perf_counter()
+            result = operation()
+            elapsed = time.perf_counter() - start
+        return result, sum(len(queries) for queries in captures), elapsed
+
+    def assertWithinBudget(self, name, prepare, check=None):
+        """
+        Measure an operation at every dataset size and check it against its budget.
+
+        Args:
+            name (str): The key of the operation in QUERY_BUDGETS.
+            prepare (callable): Returns the operation to measure, called after
+                the dataset grew and not measured itself.
+            check (callable, optional): Called with the result of the operation
+                after it was measured, to assert what it did. Defaults to None.
+        """
+        query_counts = {}
+        for size in DATASET_SIZES:
+            self.grow_to(size)
+            operation = prepare()
+            result, queries, elapsed = self.measure(operation)
+            query_counts[size] = queries
+
+            with self.subTest(operation=name, size=size):
+                if check is not None:
+                    check(result)
+                self.assertLessEqual(
+                    queries, QUERY_BUDGETS[name], f"{name} ran {queries} queries"
+                )
+                self.assertLessEqual(
+                    elapsed,
+                    LATENCY_BUDGETS.get(name, DEFAULT_LATENCY_BUDGET),
+                    f"{name} took {elapsed:.3f}s",
+                )
+
+        self.assertEqual(
+            len(set(query_counts.values())),
+            1,
+            f"The queries of {name} grow with the dataset: {query_counts}",
+        )
+
+    def top_referrer(self):
+        """Return the user with the most referrals."""
+        return User.objects.order_by("-referral_count", "id").first()
+
+    def new_user(self, **fields):
+        """Create a user outside of the seeded ones."""
+        self.new_users = getattr(self, "new_users", 0) + 1
+        return User.objects.create(
+            name="New User", email=f"new-{self.new_users}@example.com", **fields
+        )
+
+
+class RoutePerformanceTests(PerformanceTestCase):
+    """Budgets of the API routes."""
+
+    def assertStatus(self, response, status):
+        self.assertEqual(response.status_code, status, getattr(response, "data", None))
+
+    def assertVerificationSent(self, user):
+        """Check that the user has a verification and that its email was queued."""
+        code = Verification.objects.get(user=user).unique_code
+        context = {"verification_url": f"{os.getenv('CLIENT_URL')}/verify/?code={code}"}
+        self.assertIn(
+            ["verification", context, [user.email]],
+            [
+                message.args
+                for message in OutboxMessage.objects.filter(task=send_template_email.name)
+            ],
+        )
+
+    def assertQueued(self, task, *args):
+        """Check that a task was queued in the outbox with the given arguments."""
+        self.assertIn(
+            list(args),
+            [message.args for message in OutboxMessage.objects.filter(task=task.name)],
+        )
+
+    def paginated(self, pagination_class, page_size, operation):
+        """Return the operation, run with pages of `page_size` rows."""
+
+        def run():
+            with mock.patch.object(pagination_class, "page_size", page_size):
+                return operation()
+
+        return run
+
+    def test_signup(self):
+        def prepare():
+            email = f"signup-{self.users}@example.com"
+            return lambda: self.client.post(
+                reverse("auth"), {"name": "Signup", "email": email}
+            )
+
+        def check(response):
+            self.assertStatus(response, 201)
+            self.assertVerificationSent(User.objects.get(id=response.data["id"]))
+
+        self.assertWithinBudget("signup", prepare, check)
+
+    def test_signup_with_referral(self):
+        def prepare():
+            email = f"referred-{self.users}@example.com"
+            self.referrer = self.top_referrer()
+            url = reverse("auth_with_referal", args=[self.referrer.referral_code])
+            return lambda: self.client.post(url, {"name": "Referred", "email": email})
+
+        def check(response):
+            self.assertStatus(response, 201)
+            user = User.objects.get(id=response.data["id"])
+            self.assertVerificationSent(user)
+            self.assertQueued(create_referrals, self.referrer.referral_code, user.id)
+
+        self.assertWithinBudget("signup_with_referral", prepare, check)
+
+    def test_verify(self):
+        def prepare():
+            self.user = self.new_user()
+            Verification.objects.create(user=self.user, unique_code=f"V{self.users:05d}")
+            url = reverse("verify", args=[f"V{self.users:05d}"])
+            return lambda: self.client.get(url)
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.is_verified)
+            self.assertQueued(create_waitlist, self.user.id)
+
+        self.assertWithinBudget("verify", prepare, check)
+
+    def test_resend_verification_email(self):
+        def prepare():
+            self.user = self.new_user()
+            Verification.objects.create(user=self.user, unique_code=f"R{self.users:05d}")
+            Verification.objects.filter(user=self.user).update(
+                created_at=timezone.now() - timedelta(minutes=5)
+            )
+            return lambda: self.client.post(
+                reverse("resend_verification_email"), {"email": self.user.email}
+            )
+
+        def check(response):
+            self.assertStatus(response, 200)
+            # The old verification was replaced by a new one
+            self.assertFalse(
+                Verification.objects.filter(unique_code=f"R{self.users:05d}").exists()
+            )
+            self.assertVerificationSent(self.user)
+
+        self.assertWithinBudget("resend_verification_email", prepare, check)
+
+    def test_user(self):
+        def prepare():
+            self.user = self.top_referrer()
+            return lambda: self.client.get(reverse("user"), data={"email": self.user.email})
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertEqual(response.data["id"], self.user.id)
+
+        self.assertWithinBudget("user", prepare, check)
+
+    def test_waitlist(self):
+        def prepare():
+            self.waitlist = Waitlist.objects.order_by("position").last()
+            return lambda: self.client.get(
+                reverse("waitlist"), data={"id": self.waitlist.user_id}
+            )
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertEqual(response.data["position"], self.waitlist.position)
+
+        self.assertWithinBudget("waitlist", prepare, check)
+
+    def test_global_waitlist(self):
+        # Both the pages and the waitlist grow, so that a query per row shows up
+        def prepare():
+            return self.paginated(
+                WaitlistWithNamesPagination,
+                PAGE_SIZES[self.users],
+                lambda: self.client.get(reverse("global_waitlist")),
+            )
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertEqual(len(response.data["results"]), PAGE_SIZES[self.users])
+
+        self.assertWithinBudget("global_waitlist", prepare, check)
+
+    def test_global_waitlist_cursor(self):
+        def prepare():
+            return self.paginated(
+                WaitlistWithNamesCursorPagination,
+                PAGE_SIZES[self.users],
+                lambda: self.client.get(
+                    reverse("global_waitlist"), data={"pagination": "cursor"}
+                ),
+            )
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertEqual(len(response.data["results"]), PAGE_SIZES[self.users])
+
+        self.assertWithinBudget("global_waitlist_cursor", prepare, check)
+
+    def test_referrals(self):
+        # A page holds every referral of the top referrer, more at each size
+        def prepare():
+            self.user = self.top_referrer()
+            url = reverse("referrals", args=[self.user.id])
+            return self.paginated(
+                ReferralsWithDetailsPagination,
+                self.user.referral_count,
+                lambda: self.client.get(url),
+            )
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertGreater(self.user.referral_count, 0)
+            self.assertEqual(len(response.data["results"]), self.user.referral_count)
+
+        self.assertWithinBudget("referrals", prepare, check)
+
+    def test_events(self):
+        def prepare():
+            url = reverse("events", args=[self.top_referrer().id])
+
+            # Only opening the stream is measured, it then waits for events
+            def open_stream():
+                response = self.client.get(url)
+                response.close()
+                return response
+
+            return open_stream
+
+        def check(response):
+            self.assertStatus(response, 200)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        self.assertWithinBudget("events", prepare, check)
+
+    def test_exports(self):
+        staff = get_user_model().objects.create(username="staff", is_staff=True)
+        self.client.force_login(staff)
+
+        rows = {"waitlist": Waitlist.objects.count, "referrals": Referral.objects.count}
+        for kind, count in rows.items():
+            with self.subTest(kind=kind):
+                self.users = 0
+                url = reverse("export", args=[kind])
+
+                def export():
+                    response = self.client.get(url)
+                    return response, b"".join(response.streaming_content)
+
+                def check(result):
+                    response, content = result
+                    self.assertStatus(response, 200)
+                    # The header, then a line per row
+                    self.assertEqual(content.count(b"\n"), count() + 1)
+
+                self.assertWithinBudget(f"export_{kind}", lambda: export, check)
+                User.objects.filter(email__startswith="size").delete()
+
+
+class TaskPerformanceTests(PerformanceTestCase):
+    """Budgets of the Celery tasks."""
+
+    def test_send_emails(self):
+        recipients = ["user@example.com"]
+        emails = [("welcome", {"user_name": "User", "waitlist_position": 1}, recipients)]
+        operations = {
+            "send_text_email": lambda: send_text_email("Subject", "Message", recipients),
+            "send_html_email": lambda: send_html_email("Subject", "<p>Hi</p>", recipients),
+            "send_template_email": lambda: send_template_email(*emails[0]),
+            "send_template_emails": lambda: send_template_emails(emails * 10),
+        }
+        for name, operation in operations.items():
+            with self.subTest(task=name):
+                self.users = 0
+                self.assertWithinBudget(name, lambda: operation)
+                User.objects.filter(email__startswith="size").delete()
+
+    def test_create_referrals(self):
+        def prepare():
+            code = self.top_referrer().referral_code
+            user_id = self.new_user().id
+            return lambda: create_referrals(code, user_id)
+
+        self.assertWithinBudget("create_referrals", prepare)
+
+    def test_create_waitlist(self):
+        def prepare():
+            user_id = self.new_user(is_verified=True).id
+            return lambda: create_waitlist(user_id)
+
+        self.assertWithinBudget("create_waitlist", prepare)
+
+    def test_update_waitlist(self):
+        def prepare():
+            # Referrals lifting the last user of the waitlist to the top, counted
+            # as create_referrals counts them
+            self.referrer = Waitlist.objects.order_by("position").last().user
+            missing = self.top_referrer().referral_count + 1 - self.referrer.referral_count
+            Referral.objects.bulk_create(
+                Referral(referrer=self.referrer, referee=self.new_user())
+                for _ in range(missing)
+            )
+            get_referral_counter().add(self.referrer.id, missing)
+            return lambda: update_waitlist(self.referrer.id, "Referee")
+
+        def check(result):
+            referral_count = Referral.objects.filter(referrer=self.referrer).count()
+            top = Waitlist.objects.order_by("position").first()
+            self.assertEqual(top.user_id, self.referrer.id)
+            self.assertEqual(get_ranking_index().position_of(self.referrer.id), top.position)
+            entry = LeaderboardEntry.objects.get(user=self.referrer)
+            self.assertEqual(entry.position, top.position)
+            self.assertEqual(entry.referral_count, referral_count)
+
+        self.assertWithinBudget("update_waitlist", prepare, check)
+
+    def test_rerank_waitlist(self):
+        def prepare():
+            # Referral counts edited by hand, leaving positions out of order
+            User.objects.filter(is_verified=True).update(
+                referral_count=F("referral_count") + F("id") % 3
+            )
+            return rerank_waitlist
+
+        self.assertWithinBudget("rerank_waitlist", prepare)
+
+    def test_select_winners(self):
+        def prepare():
+            selection_id = WinnerSelection.objects.create(count=5).id
+            return lambda: select_winners(selection_id)
+
+        self.assertWithinBudget("select_winners", prepare)
@@ -0,0 +1,97 @@
+"""
+Tests of the indexable skip list the ranking index is built on.
+
+Every operation is checked against a sorted list, the oracle, after random
+inserts and removals.
+
+Classes:
+    IndexableSkipListTests: Rank and index lookups against a sorted list.
+"""
+
+import random
+from bisect import bisect_left, insort
+
+from django.test import SimpleTestCase
+
+from .ranking import IndexableSkipList
+
+
+class IndexableSkipListTests(SimpleTestCase):
+    """Rank and index lookups against a sorted list."""
+
+    def setUp(self):
+        # The heights of the nodes are drawn from the module wide generator
+        random.seed(0)
+        self.operations = random.Random(1)
+
+    def assertMatches(self, skip_list, oracle):
+        """Check every lookup of the skip list against the sorted list."""
+        self.assertEqual(len(skip_list), len(oracle))
+        self.assertEqual(list(skip_list), oracle)
+        for index, value in enumerate(oracle):
+            self.assertEqual(skip_list[index], value)
+            self.assertEqual(skip_list.index(value), index)
+
+    def test_insert_and_remove(self):
+        skip_list, oracle = IndexableSkipList(), []
+        values = self.operations.sample(range(10_000), 500)
+
+        for value in values:
+            self.assertEqual(skip_list.insert(value), bisect_left(oracle, value))
+            insort(oracle, value)
+        self.assertMatches(skip_list, oracle)
+
+        for value in self.operations.sample(values, 250):
+            self.assertEqual(skip_list.remove(value), oracle.index(value))
+            oracle.remove(value)
+        self.assertMatches(skip_list, oracle)
+
+    def test_interleaved_operations(self):
+        skip_list, oracle = IndexableSkipList(), []
+
+        for _ in range(2000):
+            if oracle and self.operations.random() < 0.4:
+                value = self.operations.choice(oracle)
+                self.assertEqual(skip_list.remove(value), oracle.index(value))
+                oracle.remove(value)
+            else:
+                value = self.operations.randrange(1_000_000)
+                if value in oracle:
+                    continue
+                self.assertEqual(skip_list.insert(value), bisect_left(oracle, value))
+                insort(oracle, value)
+        self.assertMatches(skip_list, oracle)
+
+    def test_slice(self):
+        skip_list = IndexableSkipList()
+        oracle = sorted(self.operations.sample(range(1000), 100))
+        for value in oracle:
+            skip_list.insert(value)
+
+        ranges = [(0, 100), (0, 1), (10, 20), (99, 100), (-5, 3), (95, 120), (60, 40)]
+        for start, stop in ranges:
+            self.assertEqual(skip_list.slice(start, stop), oracle[max(start, 0) : stop])
+
+    def test_ranking_keys(self):
+        # The keys of RankingIndex: most referrals first, then first to join
+        skip_list, oracle = IndexableSkipList(), []
+        for waitlist_id in range(200):
+            key = (-self.operations.randrange(5), waitlist_id)
+            skip_list.insert(key)
+            insort(oracle, key)
+        self.assertMatches(skip_list, oracle)
+
+    def test_missing_values(self):
+        skip_list = IndexableSkipList()
+        for value in (1, 3, 5):
+            skip_list.insert(value)
+
+        for value in (0, 2, 6):
+            with self.assertRaises(KeyError):
+                skip_list.index(value)
+            with self.assertRaises(KeyError):
+                skip_list.remove(value)
+        for index in (-1, 3):
+            with self.assertRaises(IndexError):
+                skip_list[index]
+        self.assertEqual(list(skip_list), [1, 3, 5])
@@ -0,0 +1,375 @@
+"""
+This module traces a request through the outbox, the Celery tasks it queues and SMTP.
+
+A trace is a tree of spans, each timing one step: the request, the publishing of
+a task by the outbox dispatcher, the task, its queries, its email renders and
+its SMTP calls. The context of the current span is kept in a context variable,
+and crosses process boundaries as a W3C `traceparent` value: read from the
+request headers, stored on the outbox row with the task, and sent in the
+headers of the task message, so the tasks a task queues join the same trace.
+
+Finished spans are appended as JSON lines to TRACE_EXPORT, a file shared by the
+processes, or written to stdout when it is "-". `python manage.py show_trace`
+prints them as trees. With TRACE_EXPORT empty nothing is traced. Traces are
+sampled at TRACE_SAMPLE_RATE when they start, and the decision is propagated
+with the context.
+
+The ranking actor applies the tasks of many traces in one batch. The batch is a
+trace of its own, and each task gets a span in its own trace with the timing of
+the batch and the IDs of the batch span.
+
+Classes:
+    Span: A timed step of a trace.
+    TracingMiddleware: Traces every request, continuing an incoming traceparent.
+
+Functions:
+- span(name, **attributes): Trace a block as a child of the current span.
+- trace(name, traceparent, root, **attributes): Trace a block, continuing a traceparent.
+- current_traceparent(): Return the traceparent of the current span.
+- record_span(name, traceparent, start_time, duration, **attributes): Export a span timed elsewhere.
+"""
+
+import contextvars
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+TRACEPARENT_HEADER = "traceparent"
+TRACE_ID_RESPONSE_HEADER = "X-Trace-Id"
+STATEMENT_LENGTH = 500  # Characters of SQL kept on a query span, parameters are never kept
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_export_lock = threading.Lock()
+_export_file = None
+_export_pid = None
+
+
+class Span:
+    """
+    A timed step of a trace.
+
+    Args:
+        name (str): What the step does.
+        trace_id (str): 32 hex digits shared by the spans of the trace.
+        parent_id (str): The span ID of the parent, None for the root.
+        sampled (bool): Whether the trace is exported.
+        attributes (dict): Details of the step, JSON serializable.
+    """
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "sampled",
+        "attributes",
+        "start_time",
+        "_start",
+    )
+
+    def __init__(self, name, trace_id, parent_id, sampled, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+
+    @property
+    def traceparent(self):
+        """The W3C traceparent of the span, to continue its trace elsewhere."""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self, error=None):
+        """Export the span, with the error that ended it if any."""
+        if self.sampled:
+            _export(self, time.perf_counter() - self._start, error)
+
+
+def _enabled():
+    return bool(settings.TRACE_EXPORT)
+
+
+def _parse_traceparent(traceparent):
+    """Return the (trace ID, parent span ID, sampled) of a traceparent, None when malformed."""
+    parts = (traceparent or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+def _start_span(name, traceparent=None, root=True, attributes=None):
+    """
+    Start a span under a traceparent, else under the current span, else as a new trace.
+
+    Returns None when tracing is disabled, or without a parent when `root` is False.
+    """
+    if not _enabled():
+        return None
+
+    parent = _parse_traceparent(traceparent)
+    if parent is None:
+        current = _current_span.get()
+        if current is not None:
+            parent = current.trace_id, current.span_id, current.sampled
+        elif root:
+            sampled = random.random() < settings.TRACE_SAMPLE_RATE
+            parent = f"{random.getrandbits(128):032x}", None, sampled
+        else:
+            return None
+
+    trace_id, parent_id, sampled = parent
+    return Span(name, trace_id, parent_id, sampled, attributes or {})
+
+
+@contextmanager
+def _activate(span):
+    if span is None:
+        yield None
+        return
+
+    # The connection of this thread may have been opened before tracing started
+    _install_query_tracer(connection)
+    token = _current_span.set(span)
+    error = None
+    try:
+        yield span
+    except BaseException as exception:
+        error = exception
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end(error)
+
+
+def span(name, **attributes):
+    """
+    Trace a block as a child of the current span, nothing when there is none.
+
+    Args:
+        name (str): What the block does.
+        **attributes: Details of the block, JSON serializable.
+
+    Returns:
+        contextmanager: Yields the Span, or None when not traced.
+    """
+    current = _current_span.get()
+    if current is None or not current.sampled:
+        return _activate(None)
+    return _activate(Span(name, current.trace_id, current.span_id, True, attributes))
+
+
+def trace(name, traceparent=None, root=True, **attributes):
+    """
+    Trace a block, continuing a traceparent or the current span.
+
+    Args:
+        name (str): What the block does.
+        traceparent (str, optional): The context to continue. Defaults to None.
+        root (bool, optional): Whether to start a new trace when there is no
+            context to continue. Defaults to True.
+        **attributes: Details of the block, JSON serializable.
+
+    Returns:
+        contextmanager: Yields the Span, or None when not traced.
+    """
+    return _activate(_start_span(name, traceparent, root, attributes))
+
+
+def current_traceparent():
+    """
+    Return the traceparent of the current span.
+
+    Returns:
+        str: The traceparent, empty outside of a trace.
+    """
+    current = _current_span.get()
+    return current.traceparent if current is not None else ""
+
+
+def record_span(name, traceparent, start_time, duration, **attributes):
+    """
+    Export a span timed elsewhere under a traceparent.
+
+    Args:
+        name (str): What the step did.
+        traceparent (str): The context of the parent, nothing is exported without it.
+        start_time (float): Epoch seconds the step started at.
+        duration (float): Seconds the step took.
+        **attributes: Details of the step, JSON serializable.
+    """
+    parent = _parse_traceparent(traceparent) if _enabled() else None
+    if parent is None or not parent[2]:
+        return
+
+    recorded = Span(name, parent[0], parent[1], True, attributes)
+    recorded.start_time = start_time
+    _export(recorded, duration, None)
+
+
+def _export(span, duration, error):
+    record = {
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "name": span.name,
+        "start": span.start_time,
+        "duration_ms": round(duration * 1000, 3),
+        "process": f"{socket.gethostname()}:{os.getpid()}",
+        "attributes": span.attributes,
+    }
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    line = json.dumps(record, default=str) + "\n"
+
+    if settings.TRACE_EXPORT == "-":
+        with _export_lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return
+
+    # One write per line to a file opened for appending, so the lines of
+    # concurrent processes never interleave
+    os.write(_get_export_file(), line.encode())
+
+
+def _get_export_file():
+    global _export_file, _export_pid
+
+    with _export_lock:
+        if _export_file is None or _export_pid != os.getpid():
+            _export_file = os.open(
+                settings.TRACE_EXPORT, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            _export_pid = os.getpid()
+        return _export_file
+
+
+def _trace_query(execute, sql, params, many, context):
+    current = _current_span.get()
+    if current is None or not current.sampled:
+        return execute(sql, params, many, context)
+
+    with span("db.query", statement=sql[:STATEMENT_LENGTH]):
+        return execute(sql, params, many, context)
+
+
+def _install_query_tracer(connection):
+    if _trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_trace_query)
+
+
+@receiver(connection_created)
+def install_query_tracer(sender, connection, **kwargs):
+    """Trace the queries of every new database connection."""
+    if _enabled():
+        _install_query_tracer(connection)
+
+
+class TracingMiddleware:
+    """
+    Traces every request, continuing an incoming traceparent.
+
+    The ID of the trace is returned in the X-Trace-Id header, for `show_trace`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with self._trace(request) as request_span:
+            response = self.get_response(request)
+            self._finish(request, response, request_span)
+        return response
+
+    async def __acall__(self, request):
+        with self._trace(request) as request_span:
+            response = await self.get_response(request)
+            self._finish(request, response, request_span)
+        return response
+
+    @staticmethod
+    def _trace(request):
+        return trace(
+            f"{request.method} request",
+            request.headers.get(TRACEPARENT_HEADER),
+            method=request.method,
+        )
+
+    @staticmethod
+    def _finish(request, response, request_span):
+        if request_span is None:
+            return
+        match = getattr(request, "resolver_match", None)
+        # The route pattern rather than the path, which may hold codes
+        route = match.route if match is not None else "<unmatched>"
+        request_span.name = f"{request.method} {route}"
+        request_span.attributes.update(route=route, status=response.status_code)
+        if request_span.sampled:
+            response[TRACE_ID_RESPONSE_HEADER] = request_span.trace_id
+
+
+@before_task_publish.connect
+def propagate_trace(headers=None, **kwargs):
+    """Send the context of the current span with the tasks queued inside it."""
+    traceparent = current_traceparent()
+    if headers is not None and traceparent:
+        headers.setdefault(TRACEPARENT_HEADER, traceparent)
+
+
+_running_tasks = {}  # Task ID -> (Span, context token) of the tasks of this process
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    """Start the span of a task, under the span that queued it."""
+    task_span = _start_span(
+        f"task {task.name}",
+        task.request.get(TRACEPARENT_HEADER),
+        attributes={"task_id": task_id},
+    )
+    if task_span is not None:
+        _install_query_tracer(connection)
+        _running_tasks[task_id] = (task_span, _current_span.set(task_span))
+
+
+@task_postrun.connect
+def end_task_span(task_id=None, state=None, **kwargs):
+    """End the span of a task with its final state."""
+    running = _running_tasks.pop(task_id, None)
+    if running is None:
+        return
+
+    task_span, token = running
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        _current_span.set(None)  # Started in another context
+    task_span.attributes["state"] = state
+    task_span.end()
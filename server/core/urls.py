@@ -11,8 +11,14 @@ Routes:
 - waitlist/: Manages the waitlist for users without specifying names.
 - global-waitlist/: Manages a global waitlist including names.
 - referrals/<int:id>/: Provides details on referrals based on their ID.
+- events/<int:id>/: Streams position and referral updates of a user as server-sent events.
+- export/<str:kind>/: Streams a full export of the waitlist or the referral graph, for staff.
+
+The signup routes are served by the async views of `core.async_views` instead
+when the ASYNC_SIGNUP_VIEWS setting is on.
 """
 
+from django.conf import settings
 from django.urls import path
 
 from .views import (
@@ -23,19 +29,33 @@ from .views import (
     WaitlistView,
     WaitlistWithNamesView,
     ReferralsWithDetailsView,
+    UserEventsView,
+    ExportView,
+)
+from .async_views import (
+    AsyncAuthenticationView,
+    AsyncVerificationView,
+    AsyncResendVerificationEmailView,
 )
 
+if settings.ASYNC_SIGNUP_VIEWS:
+    auth_view = AsyncAuthenticationView.as_view()
+    verify_view = AsyncVerificationView.as_view()
+    resend_view = AsyncResendVerificationEmailView.as_view()
+else:
+    auth_view = AuthenticationView.as_view()
+    verify_view = VerificationView.as_view()
+    resend_view = ResendVerificationEmailView.as_view()
+
 urlpatterns = [
-    path("auth/", AuthenticationView.as_view(), name="auth"),
-    path("auth/<str:code>/", AuthenticationView.as_view(), name="auth_with_referal"),
-    path("auth/verify/<str:code>/", VerificationView.as_view(), name="verify"),
-    path(
-        "resend-verification-email/",
-        ResendVerificationEmailView.as_view(),
-        name="resend_verification_email",
-    ),
+    path("auth/", auth_view, name="auth"),
+    path("auth/<str:code>/", auth_view, name="auth_with_referal"),
+    path("auth/verify/<str:code>/", verify_view, name="verify"),
+    path("resend-verification-email/", resend_view, name="resend_verification_email"),
     path("user/", UserView.as_view(), name="user"),
     path("waitlist/", WaitlistView.as_view(), name="waitlist"),
     path("global-waitlist/", WaitlistWithNamesView.as_view(), name="global_waitlist"),
     path("referrals/<int:id>/", ReferralsWithDetailsView.as_view(), name="referrals"),
+    path("events/<int:id>/", UserEventsView.as_view(), name="events"),
+    path("export/<str:kind>/", ExportView.as_view(), name="export"),
 ]
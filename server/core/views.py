@@ -2,45 +2,122 @@
 Views for the core app.
 
 Classes:
+    RevisionETagMixin: Mixin answering conditional GETs of a list view from a revision stamp.
     AuthenticationView: API view for user authentication and verification email sending.
     VerificationView: API view for user verification.
-    UserView: API view for retrieving user details.
-    WaitlistView: API view for retrieving waitlist details.
+    UserView: API view for retrieving user details, cached.
+    WaitlistView: API view for retrieving waitlist details, cached.
     WaitlistWithNamesPagination: Custom pagination class for waitlist with names.
+    WaitlistWithNamesCursorPagination: Cursor pagination class for waitlist with names.
     WaitlistWithNamesView: API view for retrieving the waitlist with user names.
     ReferralsWithDetailsPagination: Custom pagination class for referrals with details.
     ReferralsWithDetailsView: API view for retrieving referrals with details.
+    UserEventsView: Async view streaming the events of a user as server-sent events.
+    ExportView: View streaming a full export of the waitlist or the referral graph, for staff.
+    MetricsView: View exposing the metrics of every process to Prometheus.
 """
 
+import hashlib
+import hmac
+import json
 from datetime import timedelta
 from math import ceil
 
-from django.utils.crypto import get_random_string
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
 from django.utils import timezone
+from django.views import View
 from rest_framework import generics
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 from .tasks import create_waitlist, create_referrals, update_waitlist
 from .serializers import (
     UserSerializer,
-    VerificationSerializer,
     WaitlistSerializer,
-    WaitlistWithNamesSerializer,
     ReferralsWithDetailsSerializer,
+    LeaderboardEntrySerializer,
 )
-from .models import Verification, User, Referral, Waitlist
+from .models import Verification, User, Referral, Waitlist, LeaderboardEntry
 from .helpers import send_verification_mail
+from .codes import generate_code
+from .outbox import enqueue
+from .exports import EXPORTS, EXPORT_FORMATS, export_chunks
+from .pubsub import get_pubsub, user_channel
+from .metrics import render_metrics
+from .cache import (
+    read_through,
+    user_cache_key,
+    waitlist_cache_key,
+    invalidate_users,
+    get_revision,
+    bump_revision,
+    referrals_revision,
+    GLOBAL_WAITLIST_REVISION,
+    WAITLIST_VERSION_KEY,
+)
+
+
+class RevisionETagMixin:
+    """
+    Mixin answering conditional GETs of a list view from a revision stamp.
+
+    The ETag of a page is the revision stamp of the resource plus the page URL.
+    The stamp is read before the queryset, and a request whose If-None-Match
+    holds the current ETag gets a 304 without evaluating or serializing anything.
+    """
+
+    def get_revision_name(self):
+        """
+        Get the revision name of the listed resource.
+
+        Returns:
+            str: The revision name.
+        """
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the resource, or answer 304 when the client already has the page.
+
+        Args:
+            request (HttpRequest): The request object.
+
+        Returns:
+            Response: The response object with the page or an empty 304.
+        """
+        page_hash = hashlib.sha256(request.get_full_path().encode()).hexdigest()[:16]
+        etag = f'"{get_revision(self.get_revision_name())}-{page_hash}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+        if_none_match = request.headers.get("If-None-Match", "")
+        client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in client_etags:
+            return Response(status=304, headers=headers)
+
+        response = super().list(request, *args, **kwargs)
+        for header, value in headers.items():
+            response[header] = value
+        return response
 
 
 class AuthenticationView(APIView):
     """API view for user authentication and verification email sending."""
 
+    @transaction.atomic
     def post(self, request, code=None):
         """
         Handle user registration and send verification email.
 
+        The user, the verification and the queued tasks are written in one
+        transaction, the tasks reach the broker through the outbox.
+
         Args:
             request (HttpRequest): The request object containing user data.
             code (str, optional): The referral code. Defaults to None.
@@ -51,32 +128,23 @@ class AuthenticationView(APIView):
         user_serializer = UserSerializer(data=request.data)
         if user_serializer.is_valid():
             user_instance = user_serializer.save()
+            invalidate_users([user_instance.email])
 
             if code and User.objects.filter(referral_code=code).exists():
-                create_referrals.delay(code, user_serializer.data["id"])
+                enqueue(create_referrals, code, user_serializer.data["id"])
             elif code:
                 user_instance.delete()
+                invalidate_users([user_instance.email])
                 return Response({"message": "Invalid referral code"}, status=400)
 
-            random_code = get_random_string(length=6)
-
-            while Verification.objects.filter(unique_code=random_code).exists():
-                random_code = get_random_string(length=6)
-
-            verification_serializer = VerificationSerializer(
-                data={"unique_code": random_code, "user": user_serializer.data["id"]}
+            # Generated codes are unique and the user is known, so the
+            # verification is created without validating it against the database
+            verification = Verification.objects.create(
+                unique_code=generate_code("verification"), user=user_instance
             )
-            if verification_serializer.is_valid():
-                verification_serializer.save()
-
-                send_verification_mail(
-                    verification_serializer.data["unique_code"],
-                    user_serializer.data["email"],
-                )
+            send_verification_mail(verification.unique_code, user_instance.email)
 
-                return Response(user_serializer.data, status=201)
-
-            return Response(verification_serializer.errors, status=400)
+            return Response(user_serializer.data, status=201)
 
         return Response(user_serializer.errors, status=400)
 
@@ -84,6 +152,7 @@ class AuthenticationView(APIView):
 class VerificationView(APIView):
     """API view for user verification."""
 
+    @transaction.atomic
     def get(self, request, code):
         """
         Verify user using the provided verification code.
@@ -95,7 +164,9 @@ class VerificationView(APIView):
         Returns:
             Response: The response object with success or error message.
         """
-        verification = Verification.objects.filter(unique_code=code).first()
+        verification = (
+            Verification.objects.select_related("user").filter(unique_code=code).first()
+        )
 
         if verification is None:
             return Response({"message": "Invalid verification code"}, status=400)
@@ -107,14 +178,16 @@ class VerificationView(APIView):
             return Response({"message": "Verification code expired"}, status=400)
 
         verification.user.is_verified = True
-        verification.user.save()
+        verification.user.save(update_fields=["is_verified"])
+        invalidate_users([verification.user.email])
 
-        create_waitlist.delay(verification.user.id)
+        enqueue(create_waitlist, verification.user.id)
 
         referrer = Referral.objects.filter(referee=verification.user).first()
         if referrer is not None:
-            referrer_id = referrer.referrer.id
-            update_waitlist.delay(referrer_id, verification.user.name)
+            referrer_id = referrer.referrer_id
+            bump_revision(referrals_revision(referrer_id))
+            enqueue(update_waitlist, referrer_id, verification.user.name)
 
         return Response({"message": "User verified successfully"}, status=200)
 
@@ -122,6 +195,7 @@ class VerificationView(APIView):
 class ResendVerificationEmailView(APIView):
     """API view for resending verification email."""
 
+    @transaction.atomic
     def post(self, request):
         """
         Handle resending of verification email.
@@ -153,25 +227,12 @@ class ResendVerificationEmailView(APIView):
         if verification:
             verification.delete()
 
-        random_code = get_random_string(length=6)
-
-        while Verification.objects.filter(unique_code=random_code).exists():
-            random_code = get_random_string(length=6)
-
-        verification_serializer = VerificationSerializer(
-            data={"unique_code": random_code, "user": user.id}
+        verification = Verification.objects.create(
+            unique_code=generate_code("verification"), user=user
         )
-        if verification_serializer.is_valid():
-            verification_serializer.save()
-
-            send_verification_mail(
-                verification_serializer.data["unique_code"],
-                user.email,
-            )
-
-            return Response({"message": "Verification email sent"}, status=200)
+        send_verification_mail(verification.unique_code, user.email)
 
-        return Response(verification_serializer.errors, status=400)
+        return Response({"message": "Verification email sent"}, status=200)
 
 
 class UserView(APIView):
@@ -205,14 +266,17 @@ class UserView(APIView):
         if email is None:
             return Response({"message": "Email is required"}, status=400)
 
-        user = User.objects.filter(email=email).first()
-        if user is None:
-            return Response({"message": "User not found"}, status=404)
+        def load_user():
+            user = User.objects.filter(email=email).first()
+            if user is None or user.is_deleted:
+                return None
+            return dict(UserSerializer(user).data)
 
-        if user.is_deleted:
+        data = read_through(user_cache_key(email), load_user)
+        if data is None:
             return Response({"message": "User not found"}, status=404)
 
-        return Response(UserSerializer(user).data, status=200)
+        return Response(data, status=200)
 
 
 class WaitlistView(APIView):
@@ -246,11 +310,22 @@ class WaitlistView(APIView):
         if user_id is None:
             return Response({"message": "ID is required"}, status=400)
 
-        waitlist = Waitlist.objects.filter(user=user_id).first()
-        if waitlist is None:
+        if not str(user_id).isdigit():
+            return Response({"message": "Waitlist not found"}, status=404)
+
+        def load_waitlist():
+            waitlist = Waitlist.objects.filter(user=user_id).first()
+            if waitlist is None:
+                return None
+            return dict(WaitlistSerializer(waitlist).data)
+
+        data = read_through(
+            waitlist_cache_key(user_id), load_waitlist, WAITLIST_VERSION_KEY
+        )
+        if data is None:
             return Response({"message": "Waitlist not found"}, status=404)
 
-        return Response(WaitlistSerializer(waitlist).data, status=200)
+        return Response(data, status=200)
 
 
 class WaitlistWithNamesPagination(PageNumberPagination):
@@ -294,13 +369,77 @@ class WaitlistWithNamesPagination(PageNumberPagination):
         )
 
 
-class WaitlistWithNamesView(generics.ListAPIView):
-    """API view for retrieving the waitlist with user names."""
+class WaitlistWithNamesCursorPagination(CursorPagination):
+    """
+    Cursor pagination class for waitlist with names.
+
+    Pages are fetched with a range scan on the unique `position` index, so the
+    cost of a page does not grow with its depth and no total count is computed.
+    """
+
+    page_size = 10
+    ordering = "position"
+
+    def get_paginated_response(self, data):
+        """
+        Get the paginated response.
+
+        Args:
+            data (list): The paginated data.
+
+        Returns:
+            Response: The response object with opaque next & previous links.
+        """
+        return Response(
+            {
+                "links": {
+                    "next": self.get_next_link(),
+                    "previous": self.get_previous_link(),
+                },
+                "results": data,
+            }
+        )
 
-    queryset = Waitlist.objects.all().order_by("position")
-    serializer_class = WaitlistWithNamesSerializer
+
+class WaitlistWithNamesView(RevisionETagMixin, generics.ListAPIView):
+    """
+    API view for retrieving the waitlist with user names.
+
+    Served from the LeaderboardEntry read model, so a page is a single range scan
+    without joins. Uses page number pagination by default. Passing
+    `pagination=cursor` (or a `cursor` from a previous response) switches to
+    cursor pagination.
+    """
+
+    queryset = LeaderboardEntry.objects.all().order_by("position")
+    serializer_class = LeaderboardEntrySerializer
     pagination_class = WaitlistWithNamesPagination
 
+    @property
+    def paginator(self):
+        """
+        Get the paginator instance for the requested pagination mode.
+
+        Returns:
+            BasePagination: The paginator instance.
+        """
+        if not hasattr(self, "_paginator"):
+            params = self.request.query_params
+            if params.get("pagination") == "cursor" or "cursor" in params:
+                self._paginator = WaitlistWithNamesCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_revision_name(self):
+        """
+        Get the revision name of the global waitlist.
+
+        Returns:
+            str: The revision name.
+        """
+        return GLOBAL_WAITLIST_REVISION
+
 
 class ReferralsWithDetailsPagination(PageNumberPagination):
     """Custom pagination class for referrals with details."""
@@ -343,7 +482,7 @@ class ReferralsWithDetailsPagination(PageNumberPagination):
         )
 
 
-class ReferralsWithDetailsView(generics.ListAPIView):
+class ReferralsWithDetailsView(RevisionETagMixin, generics.ListAPIView):
     """API view for retrieving referrals with details."""
 
     serializer_class = ReferralsWithDetailsSerializer
@@ -357,4 +496,168 @@ class ReferralsWithDetailsView(generics.ListAPIView):
             QuerySet: The queryset of referrals.
         """
         user_id = self.kwargs.get("id")
-        return Referral.objects.filter(referrer=user_id)
+        # The referee of every row is serialized, so it is joined in
+        return (
+            Referral.objects.filter(referrer=user_id)
+            .select_related("referee")
+            .order_by("id")
+        )
+
+    def get_revision_name(self):
+        """
+        Get the revision name of the referrals of the user.
+
+        Returns:
+            str: The revision name.
+        """
+        return referrals_revision(self.kwargs.get("id"))
+
+
+class UserEventsView(View):
+    """
+    Async view streaming the events of a user as server-sent events.
+
+    The stream opens with the current position of the user, then carries a
+    `position`, `referral_count` or `referrals` event whenever the workers change
+    them, so the client no longer polls the waitlist. A comment is sent when the
+    stream is idle to keep proxies from closing it. It must be served by an ASGI
+    server, where an open stream costs no thread.
+    """
+
+    async def get(self, request, id):
+        """
+        Stream the events of a user.
+
+        Args:
+            request (HttpRequest): The request object.
+            id (int): The user's ID.
+
+        Returns:
+            StreamingHttpResponse: The event stream.
+        """
+        # Subscribing before reading the position, so an update published in
+        # between is delivered rather than lost
+        subscription = get_pubsub().subscribe(user_channel(id))
+        try:
+            waitlist = await Waitlist.objects.filter(user=id).afirst()
+        except BaseException:
+            subscription.close()
+            raise
+        position = waitlist.position if waitlist is not None else None
+
+        response = StreamingHttpResponse(
+            self.stream(subscription, position), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, subscription, position):
+        """
+        Yield the server-sent events of a user until the client disconnects.
+
+        Args:
+            subscription (Subscription): The subscription to the channel of the user.
+            position (int): The current position of the user, None if not on the waitlist.
+
+        Yields:
+            str: Event stream chunks.
+        """
+        try:
+            yield self.format_event({"type": "position", "position": position})
+
+            while True:
+                payload = await subscription.get(settings.EVENTS_KEEPALIVE_INTERVAL)
+                if payload is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield self.format_event(payload)
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def format_event(payload):
+        """Format a payload as a server-sent event named after its type."""
+        return f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def _iterate_in_thread(iterator):
+    """Yield the items of a sync iterator from async code, one thread hop per item."""
+    iterator = iter(iterator)
+    sentinel = object()
+    while True:
+        item = await sync_to_async(next)(iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+@method_decorator(staff_member_required, name="dispatch")
+class ExportView(View):
+    """
+    View streaming a full export of the waitlist or the referral graph, for staff.
+
+    The export is read in keyset chunks and written as it is read, see
+    core.exports, so memory stays constant at any size. Under ASGI the chunks are
+    produced in the thread of the request and streamed asynchronously, since
+    Django would otherwise buffer a sync stream whole.
+    """
+
+    def get(self, request, kind):
+        """
+        Stream an export.
+
+        Query parameters: `format` is csv (default) or ndjson, `gzip=1` compresses
+        the export.
+
+        Args:
+            request (HttpRequest): The request object.
+            kind (str): waitlist or referrals.
+
+        Returns:
+            StreamingHttpResponse: The export as an attachment.
+        """
+        export_format = request.GET.get("format", "csv")
+        if kind not in EXPORTS or export_format not in EXPORT_FORMATS:
+            raise Http404("Unknown export")
+
+        compress = request.GET.get("gzip") in ("1", "true")
+        chunks = export_chunks(kind, export_format, compress)
+        if isinstance(request, ASGIRequest):
+            chunks = _iterate_in_thread(chunks)
+
+        filename = f"{kind}.{export_format}" + (".gz" if compress else "")
+        response = StreamingHttpResponse(
+            chunks,
+            content_type="application/gzip" if compress else EXPORT_FORMATS[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class MetricsView(View):
+    """
+    View exposing the metrics of every process to Prometheus.
+
+    When METRICS_TOKEN is set, the scraper must send it as a bearer token.
+    """
+
+    def get(self, request):
+        """
+        Render the metrics in the Prometheus text format.
+
+        Args:
+            request (HttpRequest): The request object.
+
+        Returns:
+            HttpResponse: The metrics, or 401 without the expected token.
+        """
+        if settings.METRICS_TOKEN:
+            expected = f"Bearer {settings.METRICS_TOKEN}"
+            provided = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(provided.encode(), expected.encode()):
+                return HttpResponse(status=401)
+
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
@@ -2,14 +2,120 @@
 Celery configuration file
 
 This file contains the Celery configuration for the Django project.
+
+Tasks are routed to dedicated queues, so a slow kind of work never holds up a
+latency-sensitive one:
+
+- ranking: the tasks that move waitlist positions, consumed by the single ranking
+  actor (`python manage.py run_ranking_actor`) rather than by a Celery worker.
+- email: transactional emails. Verification emails get the highest priority,
+  since a user is waiting for their code.
+- bulk_email: winner emails sent by the winner selection jobs, on their own
+  workers so a blast of them never delays a verification email.
+- celery: every other task.
+
+Each queue is served by its own workers, sized by the WORKER_CONCURRENCY setting,
+and `python manage.py queue_depth` shows how many tasks are waiting in each.
 """
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from kombu import Exchange, Queue
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings")
 
 app = Celery("server")
 
 app.config_from_object("django.conf:settings", namespace="CELERY")
+
+DEFAULT_QUEUE = "celery"
+RANKING_QUEUE = "ranking"
+EMAIL_QUEUE = "email"
+BULK_EMAIL_QUEUE = "bulk_email"
+
+RANKING_TASKS = (
+    "core.tasks.create_waitlist",
+    "core.tasks.update_waitlist",
+    "core.tasks.rank_referrers",
+    "core.tasks.rerank_waitlist",
+)
+EMAIL_TASKS = (
+    "core.tasks.send_text_email",
+    "core.tasks.send_html_email",
+    "core.tasks.send_template_email",
+    "core.tasks.send_template_emails",
+)
+BULK_EMAIL_TEMPLATES = {"winner"}
+
+MAX_PRIORITY = 9
+EMAIL_PRIORITIES = {"verification": MAX_PRIORITY}  # Other templates get DEFAULT_EMAIL_PRIORITY
+DEFAULT_EMAIL_PRIORITY = 5
+
+
+def _queue(name, **queue_arguments):
+    return Queue(
+        name, Exchange(name), routing_key=name, queue_arguments=queue_arguments or None
+    )
+
+
+QUEUES = {
+    DEFAULT_QUEUE: _queue(DEFAULT_QUEUE),
+    RANKING_QUEUE: _queue(RANKING_QUEUE),
+    EMAIL_QUEUE: _queue(EMAIL_QUEUE, **{"x-max-priority": MAX_PRIORITY}),
+    BULK_EMAIL_QUEUE: _queue(BULK_EMAIL_QUEUE),
+}
+
+
+def _template_ids(name, args, kwargs):
+    """Return the template ids of an email task call, empty for untemplated emails."""
+    if name == "core.tasks.send_template_email":
+        return {args[0] if args else kwargs["template_id"]}
+    if name == "core.tasks.send_template_emails":
+        emails = args[0] if args else kwargs["emails"]
+        return {template_id for template_id, _, _ in emails}
+    return set()
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Route a task call to its queue.
+
+    Args:
+        name (str): The name of the task.
+        args (tuple): The positional arguments of the call.
+        kwargs (dict): The keyword arguments of the call.
+        options (dict): The options of the call.
+
+    Returns:
+        dict: The queue and, for emails, the priority of the call.
+    """
+    if name in RANKING_TASKS:
+        return {"queue": RANKING_QUEUE}
+
+    if name in EMAIL_TASKS:
+        template_ids = _template_ids(name, args, kwargs)
+        if template_ids and template_ids <= BULK_EMAIL_TEMPLATES:
+            return {"queue": BULK_EMAIL_QUEUE}
+        priority = max(
+            (
+                EMAIL_PRIORITIES.get(template_id, DEFAULT_EMAIL_PRIORITY)
+                for template_id in template_ids
+            ),
+            default=DEFAULT_EMAIL_PRIORITY,
+        )
+        return {"queue": EMAIL_QUEUE, "priority": priority}
+
+    return {"queue": DEFAULT_QUEUE}
+
+
+# The ranking queue is left out of the worker queues, so that a worker started
+# without -Q never consumes it behind the back of the ranking actor
+app.conf.task_queues = [
+    queue for name, queue in QUEUES.items() if name != RANKING_QUEUE
+]
+app.conf.task_default_queue = DEFAULT_QUEUE
+app.conf.task_routes = (route_task,)
+# Workers reserve one task per process, so a queued verification email overtakes
+# the lower priority emails instead of waiting behind a prefetched backlog
+app.conf.worker_prefetch_multiplier = 1
 app.autodiscover_tasks()
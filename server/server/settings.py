@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
+    "core.tracing.TracingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -86,18 +88,24 @@ WSGI_APPLICATION = "server.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-if (
-    os.environ.get("DATABASE_NAME") is None
-    or os.environ.get("DATABASE_USER") is None
-    or os.environ.get("DATABASE_PASSWORD") is None
-    or os.environ.get("DATABASE_HOST") is None
-    or os.environ.get("DATABASE_PORT") is None
+# sqlite3 only needs DATABASE_NAME, the path of the database file, e.g. to run
+# the benchmarks offline
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE") or "mysql"
+
+if os.environ.get("DATABASE_NAME") is None or (
+    DATABASE_ENGINE != "sqlite3"
+    and (
+        os.environ.get("DATABASE_USER") is None
+        or os.environ.get("DATABASE_PASSWORD") is None
+        or os.environ.get("DATABASE_HOST") is None
+        or os.environ.get("DATABASE_PORT") is None
+    )
 ):
     raise ValueError("Insufficient environment variables. 'DATABASE'")
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.mysql",
+        "ENGINE": f"django.db.backends.{DATABASE_ENGINE}",
         "NAME": os.environ.get("DATABASE_NAME"),
         "USER": os.environ.get("DATABASE_USER"),
         "PASSWORD": os.environ.get("DATABASE_PASSWORD"),
@@ -106,6 +114,13 @@ DATABASES = {
     }
 }
 
+# Counter blocks (core.sequences) are reserved on a connection of their own, so
+# that they commit at once. SQLite allows a single writer, there they are
+# reserved on the connection of the caller
+if DATABASE_ENGINE != "sqlite3":
+    DATABASES["sequences"] = {**DATABASES["default"]}
+SEQUENCE_DATABASE = "sequences" if "sequences" in DATABASES else "default"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -153,23 +168,143 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+# Cache settings. The lookups of core.cache go to "default", the revision stamps
+# of the ETags to "revisions", which is never culled. In Redis both are shared by
+# the server and the workers. Without it every process caches in its own memory,
+# where the invalidations of the other processes never arrive, so entries and
+# stamps expire within seconds instead
+
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+
+if CACHE_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+            "KEY_PREFIX": "lookups",
+        },
+        "revisions": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_REDIS_URL,
+            "KEY_PREFIX": "revisions",
+        },
+    }
+    READ_CACHE_TIMEOUT = 300  # Seconds a user or waitlist lookup is cached
+    READ_CACHE_NEGATIVE_TIMEOUT = 30  # Seconds an unknown email or id is cached
+    REVISION_TIMEOUT = None  # Seconds a revision stamp is kept, None for ever
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "lookups",
+            "OPTIONS": {"MAX_ENTRIES": 50000},
+        },
+        "revisions": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "revisions",
+            "OPTIONS": {"MAX_ENTRIES": 100000},
+        },
+    }
+    READ_CACHE_TIMEOUT = 5
+    READ_CACHE_NEGATIVE_TIMEOUT = 5
+    REVISION_TIMEOUT = 5
+
+# Serve the signup routes with the async views, only useful behind server.asgi
+
+ASYNC_SIGNUP_VIEWS = os.environ.get("ASYNC_SIGNUP_VIEWS", "False") == "True"
+
+# Event stream settings, the broker backend delivers worker events to every ASGI process
+
+PUBSUB_BACKEND = "core.pubsub.BrokerPubSub"
+PUBSUB_QUEUE_SIZE = 100  # Events held per open stream before new ones are dropped
+EVENTS_KEEPALIVE_INTERVAL = 15  # Seconds between keepalive comments of an idle stream
+
+# Metrics settings, see core.metrics and /metrics
+
+# Every process writes its metrics there, so it must be shared by the server and the workers
+METRICS_DIR = os.environ.get("METRICS_DIR") or BASE_DIR / ".metrics"
+METRICS_FLUSH_INTERVAL = 10  # Seconds between writes of the metrics of a process
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # Bearer token required by /metrics when set
+
+# Tracing settings, see core.tracing and the show_trace command
+
+# File the spans are appended to as JSON lines, "-" for stdout, empty disables tracing
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE") or 1)  # Share of traces exported
+
 # Celery settings
 
 BROKER_URL = os.environ.get("RABBITMQ_URL")
 if BROKER_URL is None:
     raise ValueError("Insufficient environment variables. 'RABBITMQ_URL'")
 
+# Worker processes per queue, used by the run_worker command, see server/celery.py
+
+WORKER_CONCURRENCY = {
+    "email": 8,  # Transactional emails, mostly waiting on SMTP
+    "bulk_email": 2,  # Winner emails, kept low so a blast cannot starve the rest
+    "celery": 4,  # Referrals and winner selection jobs
+}
+
+# Outbox settings, see core.outbox and the dispatch_outbox command
+
+OUTBOX_BATCH_SIZE = 100  # Tasks published per broker round
+OUTBOX_POLL_INTERVAL = 0.2  # Seconds the dispatcher waits when the outbox is empty
+OUTBOX_RETRY_INTERVAL = 5  # Seconds the dispatcher waits after a broker error
+
+CELERY_BEAT_SCHEDULE = {
+    "rerank-waitlist": {
+        "task": "core.tasks.rerank_waitlist",
+        "schedule": 15 * 60,  # Seconds between full re-ranks
+    },
+}
+
+# Waitlist settings
+
+WAITLIST_FIRST_POSITION = 99  # Position of the first user in the waitlist
+RANKING_BATCH_SIZE = 1000  # Rows written per statement when positions change
+RANKING_ACTOR_BATCH_SIZE = 500  # Ranking tasks applied per transaction by the ranking actor
+RANKING_ACTOR_BATCH_WINDOW = 0.05  # Seconds the ranking actor collects a batch after its first task
+WAITLIST_POSITION_BLOCK_SIZE = 100  # Positions reserved per worker at a time
+WINNER_SELECTION_CHUNK_SIZE = 1000  # Winners given access codes per statement
+REFERRAL_COUNT_FLUSH_INTERVAL = 0  # Seconds referral counts are coalesced, 0 writes each one
+
+# Code settings, each kind draws from its own counter through a keyed permutation
+
+CODE_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+# Keys the permutations of core.codes: anyone holding it can predict the codes,
+# so it is a secret of its own rather than the SECRET_KEY committed above
+CODE_SECRET_KEY = os.environ.get("CODE_SECRET_KEY") or ""
+if len(CODE_SECRET_KEY) < 32:
+    raise ValueError("Insufficient environment variables. 'CODE_SECRET_KEY'")
+
+CODE_GENERATORS = {
+    "referral": {"length": 8, "alphabet": CODE_ALPHABET, "block_size": 100},
+    "verification": {"length": 6, "alphabet": CODE_ALPHABET, "block_size": 100},
+    "access": {
+        "length": 16,
+        "alphabet": "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789",
+        "block_size": 1000,
+    },
+}
+
 # Email settings
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
-EMAIL_HOST = "smtp.gmail.com"
-EMAIL_USE_TLS = True
-EMAIL_PORT = 587
+# Blank values, as in .env.example, fall back to the defaults
+EMAIL_HOST = os.environ.get("EMAIL_HOST") or "smtp.gmail.com"
+EMAIL_USE_TLS = (os.environ.get("EMAIL_USE_TLS") or "True") == "True"
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT") or 587)
 EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
 if EMAIL_HOST_USER is None or EMAIL_HOST_PASSWORD is None:
     raise ValueError("Insufficient environment variables. 'EMAIL'")
 
+EMAIL_SEND_ATTEMPTS = 3  # Tries per message, reconnecting in between
+EMAIL_CONNECTION_MAX_IDLE = 60  # Seconds before an unused connection is reopened
+EMAIL_BATCH_SIZE = 100  # Emails sent per send_template_emails task
+
 
 # Unfold Settings
 
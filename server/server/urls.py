@@ -20,7 +20,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import MetricsView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("core.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)